@@ -26,6 +26,9 @@ from .handlers.faq import register_faq
 from .handlers.booking import register_booking
 from .handlers.policy import register_policy
 from .db.session import init_engine_and_db
+from .db.chat_history import flush_chat_messages
+from .stt_client import preload_model
+from .stt_settings import STT_SETTINGS
 
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
@@ -113,6 +116,10 @@ async def main() -> None:
     register_policy(dp)
     logger.info("Обработчики зарегистрированы")
     
+    # Модель STT грузится в фоне, чтобы первое голосовое сообщение не ждало её загрузки
+    if STT_SETTINGS.preload:
+        asyncio.get_running_loop().run_in_executor(None, preload_model)
+    
     # Настраиваем команды бота
     await _setup_bot_commands(bot)
     
@@ -125,6 +132,8 @@ async def main() -> None:
     except Exception as e:
         logger.error(f"Критическая ошибка при работе бота: {e}", exc_info=True)
     finally:
+        # Дописываем историю чата, оставшуюся в буфере
+        await flush_chat_messages()
         await bot.session.close()
 
 
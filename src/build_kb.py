@@ -27,6 +27,8 @@ import json
 import re
 import io
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 from pypdf import PdfReader
 from PIL import Image
 from dotenv import load_dotenv
@@ -294,6 +296,14 @@ def extract_images_from_pdfs() -> dict:
     return mapping
 
 
+def _structure_pdf(pdf_file: str) -> Tuple[Optional[str], Optional[str]]:
+    """Структурирует один PDF в дочернем процессе: (текст, None) или (None, ошибка)."""
+    try:
+        return extract_and_structure_pdf(pdf_file), None
+    except Exception as e:
+        return None, str(e)
+
+
 def create_structured_texts() -> None:
     """Шаг 2: Создает структурированные txt файлы из PDF."""
     print("\n=== Шаг 2: Создание структурированных текстов ===")
@@ -306,20 +316,26 @@ def create_structured_texts() -> None:
     
     print(f"Обработка PDF файлов: {len(pdf_files)}")
     
-    for pdf_file in sorted(pdf_files):
-        try:
+    pdf_files.sort()
+    # Разбор PDF (pypdf) нагружает CPU, поэтому файлы обрабатываются параллельно
+    # в отдельных процессах; результаты сохраняются по порядку в основном процессе
+    workers = min(len(pdf_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for pdf_file, (structured_text, error) in zip(pdf_files, pool.map(_structure_pdf, pdf_files)):
             print(f"  Обработка: {pdf_file}")
-            structured_text = extract_and_structure_pdf(pdf_file)
-            
-            output_filename = pdf_file.replace(".pdf", "_structured.txt")
-            output_path = os.path.join(STRUCTURED_DIR, output_filename)
-            
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(structured_text)
-            
-            print(f"    Сохранен: {output_filename}")
-        except Exception as e:
-            print(f"    Ошибка при обработке {pdf_file}: {e}")
+            if error is not None:
+                print(f"    Ошибка при обработке {pdf_file}: {error}")
+                continue
+            try:
+                output_filename = pdf_file.replace(".pdf", "_structured.txt")
+                output_path = os.path.join(STRUCTURED_DIR, output_filename)
+                
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(structured_text)
+                
+                print(f"    Сохранен: {output_filename}")
+            except Exception as e:
+                print(f"    Ошибка при обработке {pdf_file}: {e}")
 
 
 def build_text_index() -> None:
@@ -1,13 +1,31 @@
-from typing import List, Dict
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Dict, Optional
 
-from sqlalchemy import select, desc
+from sqlalchemy import insert, select, desc
 
 from .session import get_session
 from .models import ChatMessage
 
+# Сообщения копятся в буфере и записываются одной пачкой через FLUSH_DELAY секунд
+FLUSH_DELAY = 0.05
+# При таком размере буфера запись выполняется сразу
+MAX_PENDING_MESSAGES = 128
+# Сколько несохранённых сообщений держим, пока БД недоступна (самые старые отбрасываются)
+MAX_RETAINED_MESSAGES = 1024
+
+logger = logging.getLogger(__name__)
+
+_pending_messages: List[Dict] = []
+_flush_task: Optional[asyncio.Task] = None
+_flush_lock = asyncio.Lock()
+
 
 async def get_chat_history(user_id: int, limit: int = 10) -> List[Dict]:
     """Возвращает последние N сообщений истории чата пользователя."""
+    # Дописываем ещё не сохранённые сообщения, чтобы история была полной
+    await flush_chat_messages()
     history: List[Dict] = []
     async for session in get_session():
         try:
@@ -28,22 +46,53 @@ async def get_chat_history(user_id: int, limit: int = 10) -> List[Dict]:
 
 
 async def save_chat_message(user_id: int, role: str, content: str) -> None:
-    """Сохраняет одно сообщение в историю чата."""
-    async for session in get_session():
-        try:
-            chat_msg = ChatMessage(
-                tg_user_id=user_id,
-                role=role,
-                content=content,
-            )
-            session.add(chat_msg)
-            await session.commit()
-            break
-        except Exception:
-            try:
-                await session.rollback()
-            except Exception:
-                pass
-            break
+    """Ставит сообщение в очередь на запись в историю чата.
+
+    Запись выполняется в фоне одним INSERT на пачку сообщений, поэтому обработчик не ждёт БД.
+    """
+    global _flush_task
+    # Время фиксируем сразу, чтобы порядок в истории не зависел от момента записи
+    _pending_messages.append({
+        "tg_user_id": user_id,
+        "role": role,
+        "content": content,
+        "created_at": datetime.utcnow(),
+    })
+    if len(_pending_messages) >= MAX_PENDING_MESSAGES:
+        await flush_chat_messages()
+    elif _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.get_running_loop().create_task(_flush_later())
 
 
+async def _flush_later() -> None:
+    await asyncio.sleep(FLUSH_DELAY)
+    await flush_chat_messages()
+
+
+async def flush_chat_messages() -> None:
+    """Записывает все накопленные сообщения одной пачкой."""
+    async with _flush_lock:
+        if not _pending_messages:
+            return
+        batch = _pending_messages[:]
+        _pending_messages.clear()
+        async for session in get_session():
+            try:
+                # Core-insert по таблице: прямой executemany драйвера без ORM bulk-слоя
+                await session.execute(insert(ChatMessage.__table__), batch)
+                await session.commit()
+                break
+            except Exception:
+                # История не должна прерывать работу бота: пачка возвращается в начало буфера
+                # и будет записана при следующей попытке
+                logger.warning(f"Не удалось сохранить историю чата ({len(batch)} сообщений)", exc_info=True)
+                try:
+                    await session.rollback()
+                except Exception:
+                    pass
+                _pending_messages[:0] = batch
+                overflow = len(_pending_messages) - MAX_RETAINED_MESSAGES
+                if overflow > 0:
+                    del _pending_messages[:overflow]
+                    logger.warning(f"Буфер истории чата переполнен, отброшено старых сообщений: {overflow}")
+                break
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Integer, String, DateTime, Text
+from sqlalchemy import Integer, String, DateTime, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .session import Base
@@ -27,6 +27,9 @@ class ChatMessage(Base):
     content: Mapped[str] = mapped_column(Text)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
 
+    # Покрывает выборку истории пользователя по времени и поиск дубликатов при импорте
+    __table_args__ = (Index("ix_chat_messages_user_created", "tg_user_id", "created_at"),)
+
 
 class UserProfile(Base):
     """Глобальные переменные для каждого клиента"""
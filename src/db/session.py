@@ -25,5 +25,13 @@ async def init_engine_and_db() -> None:
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all не добавляет новые индексы в уже существующие таблицы
+        await conn.run_sync(_create_missing_indexes)
+
+
+def _create_missing_indexes(sync_conn) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
 
 
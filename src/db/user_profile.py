@@ -1,7 +1,7 @@
 """Функции для работы с профилем пользователя (глобальные переменные)"""
 import logging
 from datetime import datetime
-from sqlalchemy import select, update
+from sqlalchemy import case, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .session import get_session
@@ -121,6 +121,32 @@ async def get_or_create_user_profile(tg_user_id: int, name_sys: str = "") -> Use
         return profile
 
 
+async def accept_user_policy(tg_user_id: int, name_sys: str = "") -> UserProfile:
+    """
+    Отметить согласие с политикой (Politic = "ДА") в одной сессии:
+    профиль создаётся, если его нет, а name_sys заполняется, если он ещё пустой.
+    """
+    async for session in get_session():
+        result = await session.execute(
+            select(UserProfile).where(UserProfile.tg_user_id == tg_user_id)
+        )
+        profile = result.scalar_one_or_none()
+        
+        if profile is None:
+            profile = UserProfile(tg_user_id=tg_user_id, status="Читатель")
+            session.add(profile)
+            logger.info(f"Создан новый профиль для пользователя {tg_user_id}")
+        
+        if name_sys and not profile.name_sys:
+            profile.name_sys = name_sys
+        profile.politic = "ДА"
+        profile.date = datetime.utcnow()
+        
+        await session.commit()
+        logger.info(f"Пользователь {tg_user_id} принял политику: status={profile.status}")
+        return profile
+
+
 async def update_user_profile(
     tg_user_id: int,
     date: datetime | None = None,
@@ -191,3 +217,26 @@ async def update_user_profile(
         
         return profile
 
+
+async def update_user_status(tg_user_id: int, status: str, name_sys: str = "") -> None:
+    """
+    Обновить статус пользователя и заполнить name_sys, если он ещё пустой.
+    Выполняется одним UPDATE без предварительного SELECT профиля.
+    Если профиля нет, он создаётся через update_user_profile.
+    """
+    values: dict = {"status": status, "date": datetime.utcnow(), "updated_at": datetime.utcnow()}
+    if name_sys:
+        values["name_sys"] = case(
+            (or_(UserProfile.name_sys.is_(None), UserProfile.name_sys == ""), name_sys),
+            else_=UserProfile.name_sys,
+        )
+    async for session in get_session():
+        result = await session.execute(
+            update(UserProfile).where(UserProfile.tg_user_id == tg_user_id).values(**values)
+        )
+        await session.commit()
+        if result.rowcount:
+            logger.info(f"Обновлен статус пользователя {tg_user_id}: status={status}")
+            return
+    
+    await update_user_profile(tg_user_id=tg_user_id, status=status)
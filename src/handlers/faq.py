@@ -1,19 +1,23 @@
-﻿import logging
+﻿import asyncio
+import contextlib
+import io
+import logging
 import os
 import re
-import tempfile
+import shutil
 import unicodedata
 from collections.abc import Sequence
 from functools import lru_cache
 
-from aiogram import Dispatcher, F, Router
+from aiogram import Bot, Dispatcher, F, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
+    BufferedInputFile,
     CallbackQuery,
-    FSInputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaPhoto,
     Message,
     InputFile,
 )
@@ -26,13 +30,19 @@ from ..knowledge.text_search import STRUCTURED_DIR
 from ..knowledge import image_mapper
 from .. import prompt_config
 from ..db.chat_history import get_chat_history, save_chat_message
-from ..db.user_profile import get_or_create_user_profile, update_user_profile, get_user_profile, reset_user_profile_fields, check_status_changed
+from ..db.user_profile import get_or_create_user_profile, update_user_profile, update_user_status, get_user_profile, reset_user_profile_fields, check_status_changed
 from ..handlers.booking import BookingStates
 from ..handlers.policy import show_policy_window
-from ..stt_client import transcribe_file
+from ..stt_client import PCM_SAMPLE_RATE, transcribe_file, transcribe_pcm
 
 
 router = Router()
+logger = logging.getLogger(__name__)
+
+# Путь к ffmpeg определяется один раз при загрузке модуля
+FFMPEG_BIN = shutil.which("ffmpeg")
+if FFMPEG_BIN is None:
+    logger.warning("ffmpeg не найден в PATH: голосовые сообщения будут декодироваться средствами faster-whisper")
 
 LINKS_FILE_PATH = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "knowledge", "data", "links.txt")
@@ -107,6 +117,11 @@ SCHOOL_TOPIC_KEYWORDS = (
 )
 
 PRIMARY_SOURCE_TELEGRAM_LIMIT = 3500
+# Максимальное число фото в одном альбоме (sendMediaGroup)
+MEDIA_GROUP_LIMIT = 10
+
+# Всё, кроме букв, цифр и пробелов (подчёркивание тоже убираем, как и str.isalnum)
+_TRANSCRIPT_PUNCT_PATTERN = re.compile(r"[^\w\s]|_")
 
 
 def classify_topic(query: str) -> tuple[str, float]:
@@ -1610,6 +1625,105 @@ def _build_primary_source_markup(
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def _get_download_info_for_fragment(fragment: dict, main_source: str | None) -> dict[str, str] | None:
+    """Ссылка на скачивание для источника фрагмента (или основного источника запроса)."""
+    fragment_source = fragment.get("source") if isinstance(fragment, dict) else None
+    resolved_source = fragment_source or main_source
+    return _get_download_info_for_source(resolved_source) if resolved_source else None
+
+
+def _format_primary_source_fragments(fragments: list[dict], main_source: str | None) -> list[str]:
+    """Форматирует все фрагменты первоисточника один раз при открытии окна.
+
+    Результат хранится в state и используется при навигации без повторного форматирования.
+    """
+    total = len(fragments)
+    return [
+        _format_primary_source_fragment(fragment, idx, total, _get_download_info_for_fragment(fragment, main_source))
+        for idx, fragment in enumerate(fragments)
+    ]
+
+
+# file_id уже загруженных в Telegram рисунков: повторная отправка по file_id не требует загрузки файла
+_FIGURE_FILE_ID_CACHE: dict[str, str] = {}
+
+
+@lru_cache(maxsize=256)
+def _load_figure_bytes(img_path: str) -> bytes:
+    """Читает файл рисунка с диска один раз и держит байты в памяти."""
+    with open(img_path, "rb") as fh:
+        return fh.read()
+
+
+def _get_figure_photo(fig_key: str, img_path: str) -> str | BufferedInputFile:
+    """Возвращает file_id рисунка, если он уже загружался, иначе файл из кэша в памяти."""
+    file_id = _FIGURE_FILE_ID_CACHE.get(fig_key)
+    if file_id:
+        return file_id
+    return BufferedInputFile(_load_figure_bytes(img_path), filename=os.path.basename(img_path))
+
+
+def _remember_figure_file_id(fig_key: str, fig_message: Message | None) -> None:
+    """Сохраняет file_id загруженного рисунка для последующих отправок."""
+    if fig_key not in _FIGURE_FILE_ID_CACHE and fig_message and fig_message.photo:
+        _FIGURE_FILE_ID_CACHE[fig_key] = fig_message.photo[-1].file_id
+
+
+async def _send_fragment_figures(sent_message: Message, fragment: dict, main_source: str | None) -> list[int]:
+    """Отправляет рисунки фрагмента первоисточника альбомом (до 10 фото за один запрос к Telegram).
+
+    Возвращает message_id отправленных сообщений с рисунками.
+    """
+    fig_keys: list[str] = []
+    fig_paths: list[str] = []
+    media: list[InputMediaPhoto] = []
+    fragment_figures = _get_figures_for_fragment(fragment, main_source)
+    img_paths = image_mapper.get_image_paths_for_figures(fragment_figures)
+    for fig_key in fragment_figures:
+        img_path = img_paths[fig_key]
+        if not img_path:
+            continue
+        title = image_mapper.get_figure_title(fig_key)
+        caption = f"{title} {fig_key}." if title else f"{fig_key}."
+        fig_keys.append(fig_key)
+        fig_paths.append(img_path)
+        media.append(InputMediaPhoto(media=_get_figure_photo(fig_key, img_path), caption=caption))
+
+    figure_message_ids: list[int] = []
+    for start in range(0, len(media), MEDIA_GROUP_LIMIT):
+        chunk = media[start:start + MEDIA_GROUP_LIMIT]
+        chunk_keys = fig_keys[start:start + MEDIA_GROUP_LIMIT]
+        sent: list[tuple[str, Message]] = []
+        try:
+            # Альбом в Telegram должен содержать от 2 до 10 элементов
+            if len(chunk) == 1:
+                fig_messages = [await sent_message.answer_photo(photo=chunk[0].media, caption=chunk[0].caption)]
+            else:
+                fig_messages = await sent_message.answer_media_group(media=chunk)
+            sent.extend(zip(chunk_keys, fig_messages))
+        except Exception as img_error:
+            logger.warning(f"Не удалось отправить рисунки фрагмента ({len(chunk)} шт.): {img_error}")
+            # Если file_id перестал работать, в следующий раз загрузим файлы заново
+            for fig_key in chunk_keys:
+                _FIGURE_FILE_ID_CACHE.pop(fig_key, None)
+            # Одна ошибка роняет весь альбом: повторяем по одному фото с загрузкой файла,
+            # чтобы терялся только проблемный рисунок
+            for fig_key, img_path, item in zip(chunk_keys, fig_paths[start:start + MEDIA_GROUP_LIMIT], chunk):
+                try:
+                    fig_message = await sent_message.answer_photo(
+                        photo=_get_figure_photo(fig_key, img_path), caption=item.caption
+                    )
+                except Exception as photo_error:
+                    logger.warning(f"Не удалось отправить рисунок {fig_key}: {photo_error}")
+                    continue
+                sent.append((fig_key, fig_message))
+        for fig_key, fig_message in sent:
+            _remember_figure_file_id(fig_key, fig_message)
+            if fig_message and fig_message.message_id:
+                figure_message_ids.append(fig_message.message_id)
+    return figure_message_ids
+
+
 # Глобальная переменная для хранения file_id анимированного стикера с глазами
 # Будет автоматически обновляться, когда пользователь отправит стикер боту
 WAITING_STICKER_FILE_ID: str | None = None
@@ -1622,7 +1736,6 @@ async def _send_waiting_sticker(message: Message) -> Message | None:
     Если file_id не установлен, пробует использовать известные file_id из стандартных наборов.
     """
     global WAITING_STICKER_FILE_ID
-    logger = logging.getLogger(__name__)
 
     # Сначала пробуем использовать сохраненный file_id
     if WAITING_STICKER_FILE_ID:
@@ -1678,7 +1791,6 @@ async def handle_sticker_for_waiting(message: Message) -> None:
         # Проверяем, что это анимированный стикер (эмодзи-стикер обычно анимированный)
         if sticker.is_animated or sticker.is_video:
             WAITING_STICKER_FILE_ID = sticker.file_id
-            logger = logging.getLogger(__name__)
             logger.info(f"File_id анимированного стикера сохранен: {WAITING_STICKER_FILE_ID[:30]}...")
             await message.answer(
                 f"✅ <b>Стикер сохранен!</b>\n\n"
@@ -1690,13 +1802,26 @@ async def handle_sticker_for_waiting(message: Message) -> None:
             await message.answer("⚠️ Пожалуйста, отправьте <b>анимированный</b> стикер с глазами.", parse_mode=ParseMode.HTML)
 
 
+async def _delete_messages(bot: Bot, chat_id: int, message_ids: Sequence[int]) -> None:
+    """Удаляет сообщения параллельно: задержка одного запроса к Telegram вместо N последовательных."""
+    if not message_ids:
+        return
+    results = await asyncio.gather(
+        *(bot.delete_message(chat_id=chat_id, message_id=msg_id) for msg_id in message_ids),
+        return_exceptions=True,
+    )
+    for msg_id, result in zip(message_ids, results):
+        if isinstance(result, Exception):
+            logger.debug(f"Не удалось удалить сообщение {msg_id}: {result}")
+    logger.info(f"Удалено сообщений: {sum(1 for r in results if not isinstance(r, Exception))} из {len(message_ids)}")
+
+
 async def _delete_waiting_sticker(waiting_sticker_message: Message | None) -> None:
     """Удаляет стикер ожидания, если он существует."""
     if waiting_sticker_message:
         try:
             await waiting_sticker_message.delete()
         except Exception as e:
-            logger = logging.getLogger(__name__)
             logger.warning(f"Не удалось удалить стикер ожидания: {e}")
 
 
@@ -1706,8 +1831,6 @@ async def _show_intent_selection_window(
     waiting_sticker_message: Message | None = None,
 ) -> None:
     """Показать окно выбора намерения (Обучение/Консультация/Продолжить)"""
-    logger = logging.getLogger(__name__)
-
     try:
         if not message:
             logger.error("_show_intent_selection_window: message is None")
@@ -1766,8 +1889,6 @@ async def _show_phase4_booking_window(
     waiting_sticker_message: Message | None = None,
 ) -> None:
     """Показать окно записи Фазы 4 с кнопками"""
-    logger = logging.getLogger(__name__)
-
     try:
         if not message:
             logger.error("_show_phase4_booking_window: message is None")
@@ -1829,8 +1950,6 @@ async def _process_faq_query(
     input_mode: str = "text",
     waiting_sticker_message: Message | None = None,
 ) -> None:
-    logger = logging.getLogger(__name__)
-
     user_id = message.from_user.id if message.from_user else 0
 
     # Получаем системное имя пользователя
@@ -1918,12 +2037,7 @@ async def _process_faq_query(
                 logger.warning(f"Пользователь {user_id} не смог ответить на вопрос {anketa_question} после {anketa_retry_count} попыток")
                 # Удаляем все нерелевантные сообщения (включая ответы бота) перед выходом
                 if invalid_messages and message and message.chat:
-                    for msg_id in invalid_messages:
-                        try:
-                            await message.bot.delete_message(chat_id=message.chat.id, message_id=msg_id)
-                            logger.info(f"Удалено нерелевантное сообщение {msg_id} для пользователя {user_id}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось удалить сообщение {msg_id}: {e}")
+                    await _delete_messages(message.bot, message.chat.id, invalid_messages)
                 await state.update_data(
                     phase=1,
                     anketa_started=False,
@@ -1964,12 +2078,7 @@ async def _process_faq_query(
 
         # Если ответ валиден, удаляем все нерелевантные сообщения (включая ответы бота)
         if invalid_messages and message and message.chat:
-            for msg_id in invalid_messages:
-                try:
-                    await message.bot.delete_message(chat_id=message.chat.id, message_id=msg_id)
-                    logger.info(f"Удалено нерелевантное сообщение {msg_id} для пользователя {user_id}")
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение {msg_id}: {e}")
+            await _delete_messages(message.bot, message.chat.id, invalid_messages)
             await state.update_data(anketa_invalid_messages=[])
 
         # Сбрасываем счетчик попыток и сохраняем ответ
@@ -2151,12 +2260,7 @@ async def _process_faq_query(
 
                 # Удаляем все нерелевантные сообщения (включая ответы бота) перед завершением
                 if invalid_messages and message and message.chat:
-                    for msg_id in invalid_messages:
-                        try:
-                            await message.bot.delete_message(chat_id=message.chat.id, message_id=msg_id)
-                            logger.info(f"Удалено нерелевантное сообщение {msg_id} для пользователя {user_id}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось удалить сообщение {msg_id}: {e}")
+                    await _delete_messages(message.bot, message.chat.id, invalid_messages)
 
                 # Сохраняем в Excel после записи Name и Phone
                 profile = await get_user_profile(user_id)
@@ -3037,16 +3141,13 @@ async def _process_faq_query(
 
     try:
         for hit in used_hits:
-            if hit.figures:
-                for fig in hit.figures.split(","):
-                    fig = fig.strip()
-                    if fig:
-                        # Рис.1.2.1 добавляется только если в ответе LLM есть "начальный курс"
-                        if fig == "Рис.1.2.1":
-                            if answer and "начальный курс" in answer.lower():
-                                figures_found.append(fig)
-                        else:
-                            figures_found.append(fig)
+            for fig in hit.figure_list:
+                # Рис.1.2.1 добавляется только если в ответе LLM есть "начальный курс"
+                if fig == "Рис.1.2.1":
+                    if answer and "начальный курс" in answer.lower():
+                        figures_found.append(fig)
+                else:
+                    figures_found.append(fig)
 
         figures_in_answer = image_mapper.find_figures_in_text(answer) if answer else []
         figures_in_question = image_mapper.find_figures_in_text(user_q) if user_q else []
@@ -3488,48 +3589,51 @@ async def _process_faq_query(
 
     try:
         # Сохраняем в state если allow_rule_button = True
-        # Для rule_query=True и наличия источников в fragment_sources разрешаем кнопку даже если фрагменты не найдены
-        # (фрагменты будут найдены при нажатии на кнопку)
+        # Для rule_query=True с источниками правил в fragment_sources фрагменты ищутся сразу, до ответа:
+        # кнопка показывается только если они найдены, и при нажатии повторный поиск не нужен
         if allow_rule_button:
             # Если есть stored_primary_sources - сохраняем их
-            # Если stored_primary_sources пуст, но rule_query=True и есть fragment_sources - все равно разрешаем
-            # Сохраняем hits в сериализуемом формате для использования при нажатии на кнопку
-            hits_serializable = []
-            for h in hits[:5]:
-                if hasattr(h, 'text') and hasattr(h, 'source'):
-                    hits_serializable.append({
-                        "text": h.text,
-                        "source": h.source,
-                        "score": getattr(h, 'score', 0.0),
-                        "title": getattr(h, 'title', ""),
-                        "figures": getattr(h, 'figures', ""),
-                        "section": getattr(h, 'section', "")
-                    })
-
+            # Если stored_primary_sources пуст, но rule_query=True и есть fragment_sources - ищем фрагменты сейчас
             if stored_primary_sources:
                 await state.update_data(
                     primary_sources=stored_primary_sources,
                     primary_source_index=0,
+                    primary_source_formatted=[],
                     primary_source_main_source=main_source,
                     primary_source_is_rules=True,
-                    primary_source_hits=hits_serializable,  # Сохраняем hits для повторного поиска
                 )
                 logger.info(f"State обновлен: primary_sources count={len(stored_primary_sources)}, primary_source_is_rules=True, main_source={main_source}")
             elif rule_query and fragment_sources and any(src in RULE_PRIMARY_ALLOWED_SOURCES for src in fragment_sources):
-                # Для rule_query=True разрешаем кнопку даже без фрагментов (они будут найдены при нажатии)
+                # Для rule_query=True заранее ищем фрагменты только в основном источнике
+                rule_main_source = main_source or (list(fragment_sources)[0] if fragment_sources else None)
+                rule_fragments = []
+                if rule_main_source in RULE_PRIMARY_ALLOWED_SOURCES:
+                    try:
+                        # Поиск синхронный и заметный по времени: выполняем его в потоке, не блокируя event loop
+                        rule_fragments = await asyncio.to_thread(
+                            search_store.get_primary_source_fragments,
+                            hits[:5],
+                            user_q,
+                            allowed_sources=[rule_main_source],
+                        )
+                    except Exception as search_error:
+                        logger.warning(f"Ошибка при поиске фрагментов для {rule_main_source}: {search_error}", exc_info=True)
                 await state.update_data(
-                    primary_sources=[],
+                    primary_sources=rule_fragments,
                     primary_source_index=0,
-                    primary_source_main_source=main_source or (list(fragment_sources)[0] if fragment_sources else None),
+                    primary_source_formatted=[],
+                    primary_source_main_source=rule_main_source,
                     primary_source_is_rules=True,
-                    primary_source_hits=hits_serializable,  # Сохраняем hits для повторного поиска
                 )
-                logger.info(f"State обновлен для rule_query=True: primary_source_is_rules=True, main_source={main_source or (list(fragment_sources)[0] if fragment_sources else None)}, fragment_sources={fragment_sources}")
+                logger.info(f"State обновлен для rule_query=True: primary_source_is_rules=True, main_source={rule_main_source}, fragment_sources={fragment_sources}, fragments count={len(rule_fragments)}")
+                # Кнопка показывается только при найденных фрагментах
+                stored_primary_sources = rule_fragments
             else:
                 # Если первоисточники не разрешены, очищаем state
                 await state.update_data(
                     primary_sources=[],
                     primary_source_index=0,
+                    primary_source_formatted=[],
                     primary_source_main_source=None,
                     primary_source_is_rules=False,
                 )
@@ -3539,6 +3643,7 @@ async def _process_faq_query(
             await state.update_data(
                 primary_sources=[],
                 primary_source_index=0,
+                primary_source_formatted=[],
                 primary_source_main_source=None,
                 primary_source_is_rules=False,
             )
@@ -3575,16 +3680,14 @@ async def _process_faq_query(
     # 0.5. НЕТ критических стоп-слов в ответе LLM (жесткая блокировка, даже для правил)
     # 1. allow_rule_button = True (первоисточники разрешены)
     # 2. Нет стоп-слов в ответе LLM (НО для правил это не блокирует кнопку, если нет критических)
-    # 3. И (stored_primary_sources не пуст ИЛИ rule_query=True с fragment_sources из правил)
+    # 3. И stored_primary_sources не пуст (для rule_query=True туда попадают найденные заранее фрагменты правил)
     # Для правил (rule_query=True) игнорируем обычную блокировку из-за стоп-слов, НО критическая блокировка применяется всегда
     should_show_button = (
         not is_critically_excluded and
         not critical_llm_response_blocked and
         allow_rule_button and (
-            (not llm_response_blocked or rule_query) and (
-                stored_primary_sources or
-                (rule_query and fragment_sources and any(src in RULE_PRIMARY_ALLOWED_SOURCES for src in fragment_sources))
-            )
+            (not llm_response_blocked or rule_query) and
+            bool(stored_primary_sources)
         )
     )
 
@@ -3713,23 +3816,26 @@ async def _process_faq_query(
             logger.info(f"ℹ️ ПРОВЕРКА ПЕРЕД ОТПРАВКОЙ: 'начальный курс' НЕ найден в ответе LLM, filtered_figures={filtered_figures}")
 
     images_sent = []
+    img_paths = image_mapper.get_image_paths_for_figures(filtered_figures)
 
     for fig_key in filtered_figures:
-        img_path = image_mapper.get_image_path_for_figure(fig_key)
+        img_path = img_paths[fig_key]
         if img_path and img_path not in images_sent:
             try:
-                photo = FSInputFile(img_path)
+                photo = _get_figure_photo(fig_key, img_path)
                 title = image_mapper.get_figure_title(fig_key)
                 if title:
                     caption = f"{title} {fig_key}."
                 else:
                     caption = f"{fig_key}."
-                await message.answer_photo(photo=photo, caption=caption)
+                fig_message = await message.answer_photo(photo=photo, caption=caption)
+                _remember_figure_file_id(fig_key, fig_message)
                 images_sent.append(img_path)
                 logger.info(f"Отправлен рисунок {fig_key} пользователю {user_id}")
             except Exception as e:
+                # Если file_id перестал работать, в следующий раз загрузим файл заново
+                _FIGURE_FILE_ID_CACHE.pop(fig_key, None)
                 logger.warning(f"Не удалось отправить изображение {fig_key}: {e}")
-                pass
 
 # Функции истории чата перенесены в db/chat_history.py
 
@@ -3737,7 +3843,6 @@ async def _process_faq_query(
 @router.message(Command("cancel"))
 async def cmd_cancel(message: Message, state: FSMContext) -> None:
     """Обработка команды /cancel - нормализация состояния и возврат к Фазе 1"""
-    logger = logging.getLogger(__name__)
     user_id = message.from_user.id if message.from_user else 0
     logger.info(f"Получена команда /cancel от пользователя {user_id}")
 
@@ -3758,8 +3863,6 @@ async def cmd_cancel(message: Message, state: FSMContext) -> None:
 
 @router.message(lambda m: m.text and not m.text.startswith("/") and m.text != "📝 Запись на обучение")
 async def handle_faq(message: Message, state: FSMContext) -> None:
-    logger = logging.getLogger(__name__)
-
     current_state = await state.get_state()
     if current_state and current_state.startswith("BookingStates"):
         logger.debug(f"Пропускаем FAQ обработку - пользователь в состоянии {current_state}")
@@ -3802,10 +3905,39 @@ async def handle_faq(message: Message, state: FSMContext) -> None:
             pass
 
 
+async def _decode_voice_to_pcm(voice_bytes: bytes) -> bytes | None:
+    """Декодирует голосовое сообщение (.oga) в 16 кГц mono s16le PCM через ffmpeg.
+
+    Данные передаются через stdin/stdout без временных файлов: ffmpeg декодирует поток
+    по мере записи. Возвращает None, если ffmpeg недоступен или завершился с ошибкой.
+    """
+    if FFMPEG_BIN is None:
+        return None
+
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, "-nostdin", "-threads", "1", "-loglevel", "error", "-i", "pipe:0",
+        "-ar", str(PCM_SAMPLE_RATE), "-ac", "1", "-f", "s16le", "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    try:
+        pcm, stderr = await asyncio.wait_for(proc.communicate(voice_bytes), timeout=30)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        logger.error("Превышено время конвертации голосового сообщения через ffmpeg")
+        return None
+
+    if proc.returncode != 0:
+        logger.error(f"Ошибка конвертации через ffmpeg: {stderr.decode(errors='replace')}")
+        return None
+    return pcm
+
+
 @router.message(F.voice)
 async def handle_voice_message(message: Message, state: FSMContext) -> None:
-    logger = logging.getLogger(__name__)
-
     current_state = await state.get_state()
     if current_state and current_state.startswith("BookingStates"):
         logger.debug(f"Пропускаем FAQ обработку голосового сообщения - состояние {current_state}")
@@ -3822,82 +3954,33 @@ async def handle_voice_message(message: Message, state: FSMContext) -> None:
     else:
         logger.info(f"Стикер ожидания не отправляется для Фазы {current_phase}")
 
-    temp_path: str | None = None
-    converted_path: str | None = None
     transcript: str = ""
     try:
-        # Используем /tmp в Docker контейнере, если доступен, иначе системную временную директорию
-        temp_dir = os.getenv("TMPDIR", os.getenv("TEMP", tempfile.gettempdir()))
-        # Создаем директорию, если её нет
-        os.makedirs(temp_dir, exist_ok=True)
-
-        # Скачиваем голосовое сообщение в .oga формате
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".oga", dir=temp_dir) as tmp:
-            await message.bot.download(message.voice, destination=tmp.name)
-            temp_path = tmp.name
-
-        logger.info(f"Голосовое сообщение скачано: {temp_path}, размер: {os.path.getsize(temp_path) if os.path.exists(temp_path) else 0} байт")
-
-        # Конвертируем .oga в .wav через ffmpeg (faster-whisper лучше работает с .wav)
-        import subprocess
-        converted_path = temp_path.replace(".oga", ".wav")
-
-        logger.info(f"Конвертация .oga в .wav: {converted_path}")
-        try:
-            # Конвертируем через ffmpeg
-            subprocess.run(
-                ["ffmpeg", "-i", temp_path, "-y", "-ar", "16000", "-ac", "1", "-f", "wav", converted_path],
-                check=True,
-                capture_output=True,
-                timeout=30
-            )
-            logger.info(f"Конвертация завершена успешно: {converted_path}")
-
-            # Используем сконвертированный файл для транскрибации
-            audio_file = converted_path
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка конвертации через ffmpeg: {e.stderr.decode() if e.stderr else str(e)}")
-            # Пытаемся использовать оригинальный файл
-            audio_file = temp_path
-            logger.warning("Используем оригинальный .oga файл (может не работать)")
-        except FileNotFoundError:
-            logger.warning("ffmpeg не найден, используем оригинальный файл")
-            audio_file = temp_path
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка при конвертации: {e}", exc_info=True)
-            audio_file = temp_path
-
-        logger.info(f"Начало транскрибации голосового файла: {audio_file}")
-        transcript = await transcribe_file(audio_file)
+        # Скачиваем голосовое сообщение в память, без временных файлов
+        voice_buffer = await message.bot.download(message.voice)
+        voice_bytes = voice_buffer.getvalue() if voice_buffer else b""
+        logger.info(f"Голосовое сообщение скачано, размер: {len(voice_bytes)} байт")
+
+        # Конвертируем .oga в PCM через ffmpeg (faster-whisper принимает массив сэмплов напрямую)
+        pcm = await _decode_voice_to_pcm(voice_bytes)
+        if pcm:
+            transcript = await transcribe_pcm(pcm)
+        else:
+            logger.warning("Используем исходный .oga (декодирование средствами faster-whisper)")
+            transcript = await transcribe_file(io.BytesIO(voice_bytes))
         logger.info(f"Транскрибация завершена успешно, результат: '{transcript[:100] if transcript else 'ПУСТО'}'...")
     except ImportError as e:
         logger.error(f"STT недоступно: {e}", exc_info=True)
         # Удаляем стикер ожидания при ошибке
-        if waiting_sticker_message:
-            try:
-                await waiting_sticker_message.delete()
-            except Exception:
-                pass
+        await _delete_waiting_sticker(waiting_sticker_message)
         await message.answer(
             "Для распознавания речи нужна локальная модель Whisper. Установите 'faster-whisper' и ffmpeg, затем попробуйте снова."
         )
         return
     except Exception as e:
         logger.error(f"Ошибка транскрибации голосового сообщения: {e}", exc_info=True)
-        logger.error(f"Путь к временному файлу: {temp_path}, существует: {os.path.exists(temp_path) if temp_path else 'N/A'}")
-        logger.error(f"Путь к сконвертированному файлу: {converted_path}, существует: {os.path.exists(converted_path) if converted_path else 'N/A'}")
-        logger.error(f"TMPDIR: {os.getenv('TMPDIR')}, TEMP: {os.getenv('TEMP')}, tempfile.gettempdir(): {tempfile.gettempdir()}")
         await _answer_with_sticker_cleanup(message, "Не удалось распознать голос. Попробуйте ещё раз или задайте вопрос текстом.", waiting_sticker_message)
         return
-    finally:
-        # Удаляем временные файлы
-        for file_path in [temp_path, converted_path]:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    logger.debug(f"Удален временный файл: {file_path}")
-                except OSError as e:
-                    logger.warning(f"Не удалось удалить временный файл {file_path}: {e}")
 
     transcript = (transcript or "").strip()
     if not transcript:
@@ -3905,11 +3988,7 @@ async def handle_voice_message(message: Message, state: FSMContext) -> None:
         return
 
     # Удаляем стикер ожидания после появления расшифрованной фразы
-    if waiting_sticker_message:
-        try:
-            await waiting_sticker_message.delete()
-        except Exception as e:
-            logger.warning(f"Не удалось удалить стикер ожидания: {e}")
+    await _delete_waiting_sticker(waiting_sticker_message)
 
     logger.info(
         f"Получено голосовое сообщение от пользователя {message.from_user.id if message.from_user else 'unknown'}: '{transcript[:50]}'"
@@ -3918,7 +3997,7 @@ async def handle_voice_message(message: Message, state: FSMContext) -> None:
     # Показываем распознанный текст пользователю перед обработкой
     # Убираем знаки препинания и делаем первую букву маленькой
     # Оставляем только буквы, цифры и пробелы
-    cleaned_transcript = ''.join(c for c in transcript if c.isalnum() or c.isspace()).strip()
+    cleaned_transcript = _TRANSCRIPT_PUNCT_PATTERN.sub("", transcript).strip()
     if cleaned_transcript:
         cleaned_transcript = cleaned_transcript[0].lower() + cleaned_transcript[1:] if len(cleaned_transcript) > 1 else cleaned_transcript.lower()
     # Отправляем расшифровку голоса - это текстовое сообщение, поэтому удаляем стикер ожидания
@@ -3942,8 +4021,6 @@ async def handle_voice_message(message: Message, state: FSMContext) -> None:
 @router.callback_query(F.data.startswith("intent:"))
 async def handle_intent_selection(callback: CallbackQuery, state: FSMContext) -> None:
     """Обработка выбора намерения из окна выбора"""
-    logger = logging.getLogger(__name__)
-
     # Проверяем наличие пользователя и сообщения
     if not callback.from_user:
         logger.error("callback.from_user is None")
@@ -3972,12 +4049,8 @@ async def handle_intent_selection(callback: CallbackQuery, state: FSMContext) ->
                     name_sys = callback.from_user.first_name
                 elif callback.from_user.username:
                     name_sys = callback.from_user.username
-            # Получаем профиль для проверки name_sys
-            profile = await get_user_profile(user_id)
-            if profile and not profile.name_sys and name_sys:
-                await update_user_profile(tg_user_id=user_id, status=status, name_sys=name_sys)
-            else:
-                await update_user_profile(tg_user_id=user_id, status=status)
+            # Статус и name_sys (если он ещё пустой) обновляются одним запросом
+            await update_user_status(user_id, status, name_sys)
             await callback.answer("Выбрано: Обучение")
             logger.info(f"Пользователь {user_id} выбрал Обучение")
 
@@ -3998,12 +4071,8 @@ async def handle_intent_selection(callback: CallbackQuery, state: FSMContext) ->
                     name_sys = callback.from_user.first_name
                 elif callback.from_user.username:
                     name_sys = callback.from_user.username
-            # Получаем профиль для проверки name_sys
-            profile = await get_user_profile(user_id)
-            if profile and not profile.name_sys and name_sys:
-                await update_user_profile(tg_user_id=user_id, status=status, name_sys=name_sys)
-            else:
-                await update_user_profile(tg_user_id=user_id, status=status)
+            # Статус и name_sys (если он ещё пустой) обновляются одним запросом
+            await update_user_status(user_id, status, name_sys)
             await callback.answer("Выбрано: Консультация")
             logger.info(f"Пользователь {user_id} выбрал Консультация")
 
@@ -4047,7 +4116,6 @@ async def handle_intent_selection(callback: CallbackQuery, state: FSMContext) ->
 
 @router.callback_query(F.data == "primary_source:open")
 async def handle_primary_source_open(callback: CallbackQuery, state: FSMContext) -> None:
-    logger = logging.getLogger(__name__)
     data = await state.get_data()
     fragments = data.get("primary_sources") or []
     primary_source_is_rules = data.get("primary_source_is_rules", False)
@@ -4059,96 +4127,31 @@ async def handle_primary_source_open(callback: CallbackQuery, state: FSMContext)
         await callback.answer("Первоисточник недоступен для этого запроса.", show_alert=True)
         return
 
-    # Если фрагменты не найдены, но primary_source_is_rules=True, пытаемся найти их заново
+    # Фрагменты ищутся заранее при ответе на вопрос и сохраняются в state вместе с кнопкой
     if not fragments:
-        main_source = data.get("primary_source_main_source")
-        if main_source and main_source in RULE_PRIMARY_ALLOWED_SOURCES:
-            # Пытаемся найти фрагменты для источника
-            logger.info(f"Фрагменты не найдены в state, пытаемся найти для источника: {main_source}")
-            # Получаем последний запрос пользователя из истории
-            user_id = callback.from_user.id if callback.from_user else 0
-            chat_history = await get_chat_history(user_id, limit=5)
-            if chat_history:
-                # Берем последний запрос пользователя
-                last_user_message = next((msg for msg in reversed(chat_history) if msg["role"] == "user"), None)
-                if last_user_message:
-                    user_query = last_user_message.get("content", "")
-                    # Ищем фрагменты для этого запроса
-                    try:
-                        # Получаем hits из state, если они сохранены, иначе делаем новый поиск
-                        saved_hits_data = data.get("primary_source_hits")
-                        search_hits = []
-                        if saved_hits_data:
-                            # Восстанавливаем hits из сохраненных данных
-                            from ..knowledge.text_search import SearchHit
-                            for hit_data in saved_hits_data:
-                                if isinstance(hit_data, dict):
-                                    search_hits.append(SearchHit(
-                                        text=hit_data.get("text", ""),
-                                        source=hit_data.get("source", ""),
-                                        score=hit_data.get("score", 0.0),
-                                        title=hit_data.get("title", ""),
-                                        figures=hit_data.get("figures", ""),
-                                        section=hit_data.get("section", "")
-                                    ))
-
-                        if not search_hits:
-                            # Если hits не сохранены, делаем новый поиск
-                            from ..knowledge import search_store as kb_search
-                            search_results = kb_search.search(user_query, limit=5)
-                            search_hits = search_results if search_results else []
-
-                        fragments = search_store.get_primary_source_fragments(
-                            search_hits,
-                            user_query,
-                            allowed_sources=[main_source],
-                        )
-                        if fragments:
-                            await state.update_data(primary_sources=fragments, primary_source_index=0)
-                            logger.info(f"Найдено фрагментов при повторном поиске: {len(fragments)}")
-                        else:
-                            logger.warning(f"Фрагменты не найдены для источника {main_source} и запроса '{user_query[:50]}'")
-                            await callback.answer("Фрагменты не найдены для этого запроса.", show_alert=True)
-                            return
-                    except Exception as e:
-                        logger.error(f"Ошибка при поиске фрагментов: {e}", exc_info=True)
-                        await callback.answer("Ошибка при поиске фрагментов.", show_alert=True)
-                        return
-                else:
-                    logger.warning(f"Не найден последний запрос пользователя в истории")
-                    await callback.answer("Фрагменты не найдены для этого запроса.", show_alert=True)
-                    return
-            else:
-                logger.warning(f"История чата пуста для пользователя {user_id}")
-                await callback.answer("Фрагменты не найдены для этого запроса.", show_alert=True)
-                return
-        else:
-            logger.warning(f"Фрагменты не найдены в state для открытия первоисточника. data keys: {list(data.keys())}")
-            await callback.answer("Первоисточник недоступен для этого запроса.", show_alert=True)
-            return
-
-    # Убеждаемся, что у нас есть фрагменты
-    if not fragments or len(fragments) == 0:
-        logger.warning(f"Фрагменты пусты после повторного поиска")
+        logger.warning(f"Фрагменты не найдены в state для открытия первоисточника. data keys: {list(data.keys())}")
         await callback.answer("Фрагменты не найдены для этого запроса.", show_alert=True)
         return
 
     fragment = fragments[0]
     main_source = data.get("primary_source_main_source")
-    fragment_source = fragment.get("source") if isinstance(fragment, dict) else None
-    resolved_source = fragment_source or main_source
-    download_info = _get_download_info_for_source(resolved_source) if resolved_source else None
+    download_info = _get_download_info_for_fragment(fragment, main_source)
 
     try:
-        text = _format_primary_source_fragment(fragment, 0, len(fragments), download_info)
+        formatted_fragments = _format_primary_source_fragments(fragments, main_source)
     except Exception as format_error:
         logger.error(f"Ошибка при форматировании фрагмента: {format_error}", exc_info=True)
         await callback.answer("Ошибка при форматировании фрагмента.", show_alert=True)
         return
 
+    text = formatted_fragments[0]
     markup = _build_primary_source_markup(0, len(fragments), download_info)
 
-    await state.update_data(primary_source_index=0, primary_source_figure_messages=[])
+    await state.update_data(
+        primary_source_index=0,
+        primary_source_figure_messages=[],
+        primary_source_formatted=formatted_fragments,
+    )
     try:
         sent_message = await callback.message.answer(text, reply_markup=markup, parse_mode='HTML')
         await callback.answer()
@@ -4158,24 +4161,8 @@ async def handle_primary_source_open(callback: CallbackQuery, state: FSMContext)
         return
 
     # Отправляем рисунки, если они есть для этого фрагмента
-    figure_message_ids = []
     try:
-        figures_to_send = _get_figures_for_fragment(fragment, main_source)
-        for fig_key in figures_to_send:
-            img_path = image_mapper.get_image_path_for_figure(fig_key)
-            if img_path:
-                try:
-                    photo = FSInputFile(img_path)
-                    title = image_mapper.get_figure_title(fig_key)
-                    if title:
-                        caption = f"{title} {fig_key}."
-                    else:
-                        caption = f"{fig_key}."
-                    fig_message = await sent_message.answer_photo(photo=photo, caption=caption)
-                    if fig_message and fig_message.message_id:
-                        figure_message_ids.append(fig_message.message_id)
-                except Exception as img_error:
-                    logger.warning(f"Не удалось отправить изображение {fig_key}: {img_error}")
+        figure_message_ids = await _send_fragment_figures(sent_message, fragment, main_source)
         await state.update_data(primary_source_figure_messages=figure_message_ids)
     except Exception as fig_error:
         logger.warning(f"Ошибка при определении рисунков для фрагмента: {fig_error}")
@@ -4184,8 +4171,6 @@ async def handle_primary_source_open(callback: CallbackQuery, state: FSMContext)
 @router.callback_query(F.data.startswith("phase4:"))
 async def handle_phase4_button(callback: CallbackQuery, state: FSMContext) -> None:
     """Обработка кнопок Фазы 4 (Запись)"""
-    logger = logging.getLogger(__name__)
-
     if not callback.from_user:
         logger.error("callback.from_user is None")
         await callback.answer("Ошибка: пользователь не найден", show_alert=True)
@@ -4251,15 +4236,7 @@ async def handle_phase4_button(callback: CallbackQuery, state: FSMContext) -> No
 
             # Удаляем нерелевантные сообщения (включая ответы бота) перед отменой
             if invalid_messages and callback.message and callback.message.chat:
-                for msg_id in invalid_messages:
-                    try:
-                        await callback.message.bot.delete_message(
-                            chat_id=callback.message.chat.id,
-                            message_id=msg_id
-                        )
-                        logger.info(f"Удалено нерелевантное сообщение {msg_id} при отмене для пользователя {user_id}")
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить сообщение {msg_id} при отмене: {e}")
+                await _delete_messages(callback.message.bot, callback.message.chat.id, invalid_messages)
 
             await _normalize_state(state, user_id)
             cancel_message = "▶️ Я готов к Вашим вопросам."
@@ -4275,7 +4252,6 @@ async def handle_phase4_button(callback: CallbackQuery, state: FSMContext) -> No
 
 async def _normalize_state(state: FSMContext, user_id: int) -> None:
     """Нормализация состояния бота - сброс всех незавершенных операций"""
-    logger = logging.getLogger(__name__)
     try:
         await state.update_data(
             phase=1,
@@ -4298,7 +4274,6 @@ async def _normalize_state(state: FSMContext, user_id: int) -> None:
 
 @router.callback_query(F.data.startswith("primary_source:goto"))
 async def handle_primary_source_goto(callback: CallbackQuery, state: FSMContext) -> None:
-    logger = logging.getLogger(__name__)
     data = await state.get_data()
     if not data.get("primary_source_is_rules"):
         await callback.answer("Первоисточник недоступен для этого запроса.", show_alert=True)
@@ -4320,19 +4295,18 @@ async def handle_primary_source_goto(callback: CallbackQuery, state: FSMContext)
 
     fragment = fragments[idx]
     main_source = data.get("primary_source_main_source")
-    fragment_source = fragment.get("source") if isinstance(fragment, dict) else None
-    resolved_source = fragment_source or main_source
-    download_info = _get_download_info_for_source(resolved_source) if resolved_source else None
-    text = _format_primary_source_fragment(fragment, idx, len(fragments), download_info)
+    download_info = _get_download_info_for_fragment(fragment, main_source)
+    # Тексты фрагментов отформатированы при открытии окна; форматируем заново, только если список изменился
+    formatted_fragments = data.get("primary_source_formatted") or []
+    if len(formatted_fragments) == len(fragments):
+        text = formatted_fragments[idx]
+    else:
+        text = _format_primary_source_fragment(fragment, idx, len(fragments), download_info)
     markup = _build_primary_source_markup(idx, len(fragments), download_info)
 
     # Удаляем старые рисунки перед переходом к новому фрагменту
     old_figure_messages = data.get("primary_source_figure_messages") or []
-    for msg_id in old_figure_messages:
-        try:
-            await callback.bot.delete_message(chat_id=callback.message.chat.id, message_id=msg_id)
-        except Exception as del_error:
-            logger.debug(f"Не удалось удалить старое сообщение с рисунком {msg_id}: {del_error}")
+    await _delete_messages(callback.bot, callback.message.chat.id, old_figure_messages)
 
     sent_message = None
     try:
@@ -4341,55 +4315,35 @@ async def handle_primary_source_goto(callback: CallbackQuery, state: FSMContext)
     except Exception:
         sent_message = await callback.message.answer(text, reply_markup=markup, parse_mode='HTML')
 
-    await state.update_data(primary_source_index=idx)
     await callback.answer()
 
     # Отправляем рисунки, если они есть для этого фрагмента
-    figure_message_ids = []
+    figure_message_ids: list[int] = []
     if sent_message:
         try:
-            figures_to_send = _get_figures_for_fragment(fragment, main_source)
-            for fig_key in figures_to_send:
-                img_path = image_mapper.get_image_path_for_figure(fig_key)
-                if img_path:
-                    try:
-                        photo = FSInputFile(img_path)
-                        title = image_mapper.get_figure_title(fig_key)
-                        if title:
-                            caption = f"{title} {fig_key}."
-                        else:
-                            caption = f"{fig_key}."
-                        fig_message = await sent_message.answer_photo(photo=photo, caption=caption)
-                        if fig_message and fig_message.message_id:
-                            figure_message_ids.append(fig_message.message_id)
-                    except Exception as img_error:
-                        logger.warning(f"Не удалось отправить изображение {fig_key}: {img_error}")
-            await state.update_data(primary_source_figure_messages=figure_message_ids)
+            figure_message_ids = await _send_fragment_figures(sent_message, fragment, main_source)
         except Exception as fig_error:
             logger.warning(f"Ошибка при определении рисунков для фрагмента: {fig_error}")
 
+    # Индекс и рисунки записываем в state одним вызовом
+    await state.update_data(primary_source_index=idx, primary_source_figure_messages=figure_message_ids)
+
 
 @router.callback_query(F.data == "primary_source:close")
 async def handle_primary_source_close(callback: CallbackQuery, state: FSMContext) -> None:
-    logger = logging.getLogger(__name__)
     # Удаляем рисунки при закрытии окна
     data = await state.get_data()
     old_figure_messages = data.get("primary_source_figure_messages") or []
-    for msg_id in old_figure_messages:
-        try:
-            await callback.bot.delete_message(chat_id=callback.message.chat.id, message_id=msg_id)
-        except Exception as del_error:
-            logger.debug(f"Не удалось удалить сообщение с рисунком {msg_id}: {del_error}")
+    await _delete_messages(callback.bot, callback.message.chat.id, old_figure_messages)
 
     await state.update_data(primary_source_figure_messages=[])
 
     try:
         await callback.message.delete()
     except Exception:
-        try:
+        # Старые сообщения нельзя удалить — просто убираем кнопки
+        with contextlib.suppress(Exception):
             await callback.message.edit_reply_markup(reply_markup=None)
-        except Exception:
-            pass
     await callback.answer()
 
 
@@ -1,12 +1,14 @@
 """Обработчик Фазы 2: Политика конфиденциальности"""
 import logging
 import os
+import re
+from functools import lru_cache
 from aiogram import Dispatcher, Router, F
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.enums import ParseMode
 
-from ..db.user_profile import get_or_create_user_profile, update_user_profile, get_user_profile
+from ..db.user_profile import accept_user_policy, update_user_profile
 from ..db.chat_history import save_chat_message
 
 router = Router()
@@ -17,22 +19,37 @@ LINKS_FILE_PATH = os.path.abspath(
 )
 
 
+# Строка вида "4. Политика конфиденциальности - https://..."
+_POLICY_RE = re.compile(r"Политика конфиденциальности[^\n]*?\s-\s*(\S+)")
+
+
+@lru_cache(maxsize=1)
 def _load_policy_link() -> str:
-    """Загрузить ссылку на Политику конфиденциальности из links.txt"""
-    if not os.path.exists(LINKS_FILE_PATH):
-        return ""
+    """Загрузить ссылку на Политику конфиденциальности из links.txt (файл читается один раз)"""
     try:
         with open(LINKS_FILE_PATH, "r", encoding="utf-8") as file:
-            for line in file:
-                line = line.strip()
-                if "Политика конфиденциальности" in line and " - " in line:
-                    _, url = line.split(" - ", 1)
-                    return url.strip()
+            match = _POLICY_RE.search(file.read())
+        if match:
+            return match.group(1)
+    except FileNotFoundError:
+        return ""
     except Exception as e:
         logger.error(f"Ошибка при загрузке ссылки на политику: {e}")
     return ""
 
 
+@lru_cache(maxsize=8)
+def _policy_keyboard(user_intent: str) -> InlineKeyboardMarkup:
+    """Клавиатура окна политики; строится один раз на каждое намерение"""
+    policy_url = _load_policy_link()
+    # Размещаем кнопки горизонтально в одной строке
+    row = [InlineKeyboardButton(text="✅ ДА", callback_data=f"policy:accept:{user_intent}")]
+    if policy_url:
+        row.append(InlineKeyboardButton(text="📥 Политика", url=policy_url))
+    row.append(InlineKeyboardButton(text="🚫 НЕТ", callback_data="policy:reject"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
 async def show_policy_window(
     message: Message, 
     state: FSMContext, 
@@ -60,24 +77,13 @@ async def show_policy_window(
             except Exception as e:
                 logger.warning(f"Не удалось удалить стикер ожидания: {e}")
         
-        policy_url = _load_policy_link()
-        
         text = (
             "⚠️ <b>Внимание!</b> Для продолжения диалога Вы должны ответить на вопрос:\n"
             "| 👉 Вы хотите предоставить свои персональные данные на условиях <b>Политики конфиденциальности? |</b>\n"
             "В случае согласия Ваши персональные данные будут НАДЁЖНО защищены 🔥"
         )
         
-        # Размещаем кнопки горизонтально в одной строке
-        row = []
-        row.append(InlineKeyboardButton(text="✅ ДА", callback_data=f"policy:accept:{user_intent}"))
-        
-        if policy_url:
-            row.append(InlineKeyboardButton(text="📥 Политика", url=policy_url))
-        
-        row.append(InlineKeyboardButton(text="🚫 НЕТ", callback_data="policy:reject"))
-        
-        markup = InlineKeyboardMarkup(inline_keyboard=[row])
+        markup = _policy_keyboard(user_intent)
         
         await message.answer(
             text,
@@ -124,21 +130,8 @@ async def handle_policy_accept(callback: CallbackQuery, state: FSMContext) -> No
         elif callback.from_user.username:
             name_sys = callback.from_user.username
     
-    # Получаем профиль пользователя для проверки Status
-    profile = await get_user_profile(user_id)
-    if not profile:
-        # Если профиля нет, создаем его
-        profile = await get_or_create_user_profile(user_id, name_sys)
-    elif not profile.name_sys:
-        # Обновляем name_sys, если его нет
-        await update_user_profile(tg_user_id=user_id, name_sys=name_sys)
-    
-    # Устанавливаем Politic = "ДА"
-    updated_profile = await update_user_profile(
-        tg_user_id=user_id,
-        politic="ДА",
-        name_sys=name_sys if not profile.name_sys else None,
-    )
+    # Устанавливаем Politic = "ДА" (профиль создаётся, если его нет)
+    updated_profile = await accept_user_policy(user_id, name_sys)
     await save_chat_message(user_id, "user", "ДА")
     
     await callback.answer("Спасибо за согласие!")
@@ -146,7 +139,7 @@ async def handle_policy_accept(callback: CallbackQuery, state: FSMContext) -> No
     # Оставляем сообщение с политикой в чате (не удаляем)
     
     # Проверяем Status из обновленного профиля пользователя
-    status = updated_profile.status if updated_profile else (profile.status if profile else "Читатель")
+    status = updated_profile.status
     
     # Сбрасываем флаг показа политики, так как выбор сделан
     await state.update_data(policy_shown=False)
@@ -250,5 +243,8 @@ async def handle_policy_reject(callback: CallbackQuery, state: FSMContext) -> No
 
 
 def register_policy(dp: Dispatcher) -> None:
+    # Читаем links.txt и строим клавиатуры при запуске бота, чтобы обработчики не делали файловый I/O в event loop
+    for intent in ("Обучение", "Консультация"):
+        _policy_keyboard(intent)
     dp.include_router(router)
 
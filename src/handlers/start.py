@@ -15,6 +15,10 @@ AD_IMAGE_PATH = os.path.abspath(os.path.join(
     "..", "knowledge", "data", "images",
     "1.1_Общая_информация_page2__Image37.jpg"
 ))
+# Картинка статична: проверяем её наличие один раз при загрузке модуля, а не в обработчике
+AD_IMAGE_EXISTS = os.path.exists(AD_IMAGE_PATH)
+# file_id картинки после первой загрузки в Telegram: дальше отправляем его вместо файла
+_ad_image_file_id: str | None = None
 
 AD_TEXT = """🎯 Вы хотите научиться играть на бильярде или повысить уровень игры?
 Играть красиво и уверенно? Узнать все секреты? Достичь вершин мастерства? Тогда... мы ждем Вас в школе русского бильярда «Абриколь» 🎯"""
@@ -56,12 +60,17 @@ async def _send_start_menu(message: Message) -> None:
                 Name_sys = message.from_user.full_name.split()[0] if message.from_user.full_name.split() else "друг"
         
         # 1. Сначала отправляем картинку (если существует)
-        if os.path.exists(AD_IMAGE_PATH):
+        if AD_IMAGE_EXISTS:
+            global _ad_image_file_id
             try:
-                photo = FSInputFile(AD_IMAGE_PATH)
-                await message.answer_photo(photo=photo)
+                photo = _ad_image_file_id or FSInputFile(AD_IMAGE_PATH)
+                sent_photo = await message.answer_photo(photo=photo)
+                if not _ad_image_file_id and sent_photo.photo:
+                    _ad_image_file_id = sent_photo.photo[-1].file_id
                 logger.info("Рекламная картинка отправлена")
             except Exception as e:
+                # Если file_id перестал работать, в следующий раз загрузим файл заново
+                _ad_image_file_id = None
                 logger.warning(f"Не удалось отправить картинку: {e}")
         
         # 2. Затем рекламный текст
@@ -19,29 +19,193 @@
     {"tg_user_id": 123456789, "role": "assistant", "content": "Привет! Чем могу помочь?", "timestamp": "2024-01-01T12:00:01"}
 ]
 
+Большие файлы читаются потоково, если установлен пакет ijson (pip install ijson).
+
 Использование:
     python -m src.import_chat_history path/to/chat_history.json
     python src/import_chat_history.py path/to/chat_history.json
 """
 
 import asyncio
+import itertools
 import json
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 
 from dotenv import load_dotenv
 
-from .db.session import get_session, init_engine_and_db
+from .db.session import engine, init_engine_and_db
 from .db.models import ChatMessage
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Размер пачки при вставке сообщений
+INSERT_BATCH_SIZE = 1000
+# Размер пачки tg_user_id в IN (...) при поиске дубликатов (лимит параметров SQLite)
+USER_ID_BATCH_SIZE = 500
+# Форматы timestamp, которые не разбирает datetime.fromisoformat
+TIMESTAMP_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f")
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    """Парсит timestamp сообщения (ISO-строка или unix-время). Возвращает None, если не удалось."""
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        # В БД хранится naive UTC
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    except ValueError:
+        pass
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _iter_json_array(path: Path) -> Iterator[Any]:
+    """Итерирует элементы верхнеуровневого JSON-массива.
+
+    Если установлен ``ijson``, файл разбирается потоково и в памяти держится только текущая пачка,
+    иначе файл целиком загружается через ``json.load``.
+    Ошибки формата пробрасываются как ``ValueError``.
+    """
+    try:
+        import ijson  # type: ignore
+    except ImportError:
+        ijson = None
+
+    if ijson is None:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError("JSON должен содержать массив объектов")
+        yield from data
+        return
+
+    with open(path, "rb") as f:
+        head = f.read(64).lstrip()
+        if head and not head.startswith(b"["):
+            raise ValueError("JSON должен содержать массив объектов")
+        f.seek(0)
+        try:
+            yield from ijson.items(f, "item", use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(str(e)) from e
+
+
+def _make_row(tg_user_id: Any, msg: Any) -> Optional[Dict[str, Any]]:
+    """Строка для вставки в chat_messages или None, если у сообщения нет role/content."""
+    if type(msg) is not dict:
+        return None
+    role = msg.get("role")
+    content = msg.get("content")
+    if role is None or content is None:
+        return None
+    return {
+        "tg_user_id": tg_user_id,
+        "role": role,
+        "content": content,
+        "created_at": _parse_ts(msg.get("timestamp")) or datetime.utcnow(),
+    }
+
+
+def _iter_grouped(records: Iterator[Any]) -> Iterator[Dict[str, Any]]:
+    """Группированный формат: {tg_user_id, messages: [...]}"""
+    for record in records:
+        tg_user_id = record.get("tg_user_id") if type(record) is dict else None
+        messages = record.get("messages") if tg_user_id is not None else None
+        if messages is None:
+            print(f"⚠️ Пропущена некорректная группа: {record}")
+            continue
+        for msg in messages:
+            row = _make_row(tg_user_id, msg)
+            if row is not None:
+                yield row
+
+
+def _iter_flat(records: Iterator[Any]) -> Iterator[Dict[str, Any]]:
+    """Плоский формат: список сообщений с tg_user_id в каждом"""
+    for record in records:
+        tg_user_id = record.get("tg_user_id") if type(record) is dict else None
+        row = _make_row(tg_user_id, record) if tg_user_id is not None else None
+        if row is None:
+            print(f"⚠️ Пропущено некорректное сообщение: {record}")
+            continue
+        yield row
+
+
+def _iter_messages(records: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    """Разворачивает группированный или плоский формат в поток строк для вставки.
+
+    Формат определяется один раз по первому элементу, дальше работает цикл
+    только для этого формата (без проверки формата на каждой записи).
+    """
+    records = iter(records)
+    for first in records:
+        break
+    else:
+        return
+    # Проверяем формат: если первый элемент имеет ключ "messages", это группированный формат
+    is_grouped = type(first) is dict and "messages" in first
+    print("📋 Обнаружен группированный формат" if is_grouped else "📋 Обнаружен плоский формат")
+    yield from (_iter_grouped if is_grouped else _iter_flat)(itertools.chain((first,), records))
+
+
+async def _insert_batch(session: AsyncSession, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Вставляет пачку сообщений (без коммита), пропуская дубликаты. Возвращает (вставлено, пропущено)."""
+    # Загружаем ключи уже существующих сообщений одним запросом на пачку пользователей
+    # (вместо отдельного SELECT на каждое сообщение). Диапазон created_at ограничивает
+    # выборку и позволяет использовать индекс (tg_user_id, created_at)
+    existing_keys: Set[Tuple[int, str, datetime]] = set()
+    user_ids = list({row["tg_user_id"] for row in rows})
+    min_ts = min(row["created_at"] for row in rows)
+    max_ts = max(row["created_at"] for row in rows)
+    for i in range(0, len(user_ids), USER_ID_BATCH_SIZE):
+        result = await session.execute(
+            select(ChatMessage.tg_user_id, ChatMessage.content, ChatMessage.created_at).where(
+                ChatMessage.tg_user_id.in_(user_ids[i:i + USER_ID_BATCH_SIZE]),
+                ChatMessage.created_at.between(min_ts, max_ts),
+            )
+        )
+        existing_keys.update(tuple(r) for r in result)
+    
+    # Отбрасываем дубликаты (по пользователю, тексту и timestamp), в том числе внутри пачки.
+    # Строки предыдущих пачек уже вставлены в этой же транзакции и находятся запросом выше
+    new_rows: List[Dict[str, Any]] = []
+    for row in rows:
+        key = (row["tg_user_id"], row["content"], row["created_at"])
+        if key in existing_keys:
+            continue
+        existing_keys.add(key)
+        new_rows.append(row)
+    
+    if new_rows:
+        # Core-insert по таблице: прямой executemany драйвера без ORM bulk-слоя
+        await session.execute(insert(ChatMessage.__table__), new_rows)
+    return len(new_rows), len(rows) - len(new_rows)
 
 
 async def import_chat_history(file_path: str, clear_existing: bool = False) -> None:
     """
     Импортирует историю чата из JSON файла.
     
+    Файл читается и записывается в БД пачками по ``INSERT_BATCH_SIZE`` сообщений
+    (потоково, если установлен ``ijson``).
+    
     Args:
         file_path: Путь к JSON файлу с историей чата
         clear_existing: Если True, удаляет существующие сообщения перед импортом
@@ -55,142 +219,70 @@ async def import_chat_history(file_path: str, clear_existing: bool = False) -> N
         return
     
     print(f"📂 Чтение файла: {file_path}")
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except json.JSONDecodeError as e:
-        print(f"❌ Ошибка парсинга JSON: {e}")
-        return
-    except Exception as e:
-        print(f"❌ Ошибка чтения файла: {e}")
-        return
-    
-    # Определяем формат данных
-    if not isinstance(data, list):
-        print("❌ JSON должен содержать массив объектов")
-        return
-    
-    if not data:
-        print("⚠️ Файл пуст")
-        return
-    
-    # Проверяем формат: если первый элемент имеет ключ "messages", это группированный формат
-    is_grouped = isinstance(data[0], dict) and "messages" in data[0]
     
-    messages_to_import: List[Dict[str, Any]] = []
-    
-    if is_grouped:
-        # Группированный формат: {tg_user_id, messages: [...]}
-        print("📋 Обнаружен группированный формат")
-        for group in data:
-            if not isinstance(group, dict) or "tg_user_id" not in group or "messages" not in group:
-                print(f"⚠️ Пропущена некорректная группа: {group}")
-                continue
-            tg_user_id = group["tg_user_id"]
-            for msg in group["messages"]:
-                if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
-                    continue
-                messages_to_import.append({
-                    "tg_user_id": tg_user_id,
-                    "role": msg["role"],
-                    "content": msg["content"],
-                    "timestamp": msg.get("timestamp")
-                })
-    else:
-        # Плоский формат: список сообщений с tg_user_id в каждом
-        print("📋 Обнаружен плоский формат")
-        for msg in data:
-            if not isinstance(msg, dict) or "tg_user_id" not in msg or "role" not in msg or "content" not in msg:
-                print(f"⚠️ Пропущено некорректное сообщение: {msg}")
-                continue
-            messages_to_import.append({
-                "tg_user_id": msg["tg_user_id"],
-                "role": msg["role"],
-                "content": msg["content"],
-                "timestamp": msg.get("timestamp")
-            })
-    
-    if not messages_to_import:
-        print("⚠️ Нет сообщений для импорта")
-        return
-    
-    print(f"📊 Найдено сообщений: {len(messages_to_import)}")
-    
-    # Если нужно очистить существующие сообщения
-    if clear_existing:
-        async for session in get_session():
-            try:
-                result = await session.execute(delete(ChatMessage))
-                await session.commit()
-                deleted = result.rowcount if hasattr(result, 'rowcount') else 0
-                print(f"🗑️ Удалено существующих сообщений: {deleted}")
-            except Exception as e:
-                await session.rollback()
-                print(f"⚠️ Ошибка при удалении сообщений: {e}")
-            break
-    
-    # Импортируем сообщения
+    found = 0
     imported = 0
     skipped = 0
     
-    async for session in get_session():
+    async with engine.connect() as conn:
+        # На время импорта отключаем fsync SQLite. Прагма действует на соединение,
+        # поэтому сессия привязывается к нему на весь импорт
+        is_sqlite = conn.dialect.name == "sqlite"
+        if is_sqlite:
+            prev_synchronous = (await conn.exec_driver_sql("PRAGMA synchronous")).scalar()
+            await conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            # Завершаем autobegin-транзакцию соединения, чтобы сессия открыла и закоммитила свою
+            await conn.commit()
         try:
-            for msg_data in messages_to_import:
+            # Весь импорт (включая --clear) — одна транзакция: при ошибке БД не меняется
+            async with AsyncSession(bind=conn, expire_on_commit=False) as session:
                 try:
-                    # Парсим timestamp если есть
-                    created_at = datetime.utcnow()
-                    if msg_data.get("timestamp"):
-                        try:
-                            if isinstance(msg_data["timestamp"], str):
-                                # Пробуем разные форматы
-                                for fmt in ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f"]:
-                                    try:
-                                        created_at = datetime.strptime(msg_data["timestamp"], fmt)
-                                        break
-                                    except ValueError:
-                                        continue
-                            elif isinstance(msg_data["timestamp"], (int, float)):
-                                created_at = datetime.fromtimestamp(msg_data["timestamp"])
-                        except Exception:
-                            pass  # Используем текущее время
-                    
-                    # Проверяем, не существует ли уже такое сообщение (по timestamp и content)
-                    existing = await session.execute(
-                        select(ChatMessage).where(
-                            ChatMessage.tg_user_id == msg_data["tg_user_id"],
-                            ChatMessage.content == msg_data["content"],
-                            ChatMessage.created_at == created_at
-                        )
-                    )
-                    if existing.scalar_one_or_none():
-                        skipped += 1
-                        continue
-                    
-                    # Создаём новое сообщение
-                    chat_msg = ChatMessage(
-                        tg_user_id=msg_data["tg_user_id"],
-                        role=msg_data["role"],
-                        content=msg_data["content"],
-                        created_at=created_at
-                    )
-                    session.add(chat_msg)
-                    imported += 1
+                    if clear_existing:
+                        result = await session.execute(delete(ChatMessage))
+                        deleted = result.rowcount if hasattr(result, 'rowcount') else 0
                     
+                    batch: List[Dict[str, Any]] = []
+                    for row in _iter_messages(_iter_json_array(path)):
+                        found += 1
+                        batch.append(row)
+                        if len(batch) >= INSERT_BATCH_SIZE:
+                            batch_imported, batch_skipped = await _insert_batch(session, batch)
+                            imported += batch_imported
+                            skipped += batch_skipped
+                            batch = []
+                    if batch:
+                        batch_imported, batch_skipped = await _insert_batch(session, batch)
+                        imported += batch_imported
+                        skipped += batch_skipped
+                    if found:
+                        await session.commit()
+                        if clear_existing:
+                            print(f"🗑️ Удалено существующих сообщений: {deleted}")
+                    else:
+                        # Пустой файл не должен приводить к очистке истории
+                        await session.rollback()
+                except ValueError as e:
+                    await session.rollback()
+                    print(f"❌ Ошибка парсинга JSON: {e}")
+                    print("↩️ Импорт отменён, база данных не изменена")
+                    return
                 except Exception as e:
-                    print(f"⚠️ Ошибка при импорте сообщения: {e}")
-                    skipped += 1
-                    continue
-            
-            await session.commit()
-            print(f"✅ Импортировано сообщений: {imported}")
-            if skipped > 0:
-                print(f"⏭️ Пропущено (дубликаты): {skipped}")
-            
-        except Exception as e:
-            await session.rollback()
-            print(f"❌ Ошибка при сохранении: {e}")
-            raise
-        break
+                    await session.rollback()
+                    print(f"❌ Ошибка при сохранении: {e}")
+                    raise
+        finally:
+            if is_sqlite:
+                await conn.exec_driver_sql(f"PRAGMA synchronous={int(prev_synchronous)}")
+                await conn.commit()
+    
+    if not found:
+        print("⚠️ Нет сообщений для импорта")
+        return
+    
+    print(f"📊 Найдено сообщений: {found}")
+    print(f"✅ Импортировано сообщений: {imported}")
+    if skipped > 0:
+        print(f"⏭️ Пропущено (дубликаты): {skipped}")
 
 
 async def main() -> None:
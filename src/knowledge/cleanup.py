@@ -12,25 +12,61 @@ from __future__ import annotations
 import os
 import json
 import re
-from typing import Callable, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 
-# Набор целевых замен для типовых разрывов внутри слов (безопасные точечные фиксы)
-SAFE_WORD_FIXES: List[Tuple[re.Pattern, str]] = [
+# Набор целевых замен для типовых разрывов внутри слов (безопасные точечные фиксы):
+# (начало слова, хвост после пробела, требуется ли граница слова после хвоста, замена)
+SAFE_WORD_FIXES: List[Tuple[str, str, bool, str]] = [
     # Общие OCR-ошибки с разрывами
-    (re.compile(r"\bбан\s+нер\b", re.IGNORECASE), "баннер"),
-    (re.compile(r"\bСертифика\s+т\b", re.IGNORECASE), "Сертификат"),
-    (re.compile(r"\bборт\s+ов\b", re.IGNORECASE), "бортов"),
-    (re.compile(r"\bосв\s+ещенн", re.IGNORECASE), "освещенн"),
-    (re.compile(r"\bрасположе\s+ни", re.IGNORECASE), "расположени"),
-    (re.compile(r"\bназываетс\s+я\b", re.IGNORECASE), "называется"),
-    (re.compile(r"\bруководствоватьс\s+я\b", re.IGNORECASE), "руководствоваться"),
-    (re.compile(r"\bсоударени\s+я\b", re.IGNORECASE), "соударения"),
-    (re.compile(r"\bпадени\s+я\b", re.IGNORECASE), "падения"),
-    (re.compile(r"\bнаход\s+ящ", re.IGNORECASE), "находящ"),
+    ("бан", "нер", True, "баннер"),
+    ("Сертифика", "т", True, "Сертификат"),
+    ("борт", "ов", True, "бортов"),
+    ("осв", "ещенн", False, "освещенн"),
+    ("расположе", "ни", False, "расположени"),
+    ("называетс", "я", True, "называется"),
+    ("руководствоватьс", "я", True, "руководствоваться"),
+    ("соударени", "я", True, "соударения"),
+    ("падени", "я", True, "падения"),
+    ("наход", "ящ", False, "находящ"),
 ]
 
 
+def _build_safe_word_fixes_re() -> re.Pattern:
+    """Одно регулярное выражение «начало\\s+хвост» для всех фиксов.
+
+    Вместо отдельного прохода на каждый фикс текст сканируется один раз, а нужная замена
+    выбирается по паре (начало, хвост) из словаря — как в автомате Ахо-Корасик.
+    """
+    heads = sorted({head.lower() for head, _, _, _ in SAFE_WORD_FIXES}, key=len, reverse=True)
+    tails = sorted(
+        {tail.lower() + (r"\b" if boundary else "") for _, tail, boundary, _ in SAFE_WORD_FIXES},
+        key=len,
+        reverse=True,
+    )
+    return re.compile(
+        r"\b(" + "|".join(heads) + r")\s+(" + "|".join(tails) + ")",
+        re.IGNORECASE,
+    )
+
+
+_SAFE_WORD_FIXES_RE = _build_safe_word_fixes_re()
+_SAFE_WORD_REPLACEMENTS: Dict[Tuple[str, str], str] = {
+    (head.lower(), tail.lower()): replacement for head, tail, _, replacement in SAFE_WORD_FIXES
+}
+
+_FIGURE_REF_RE = re.compile(r"Рис\.?\s*([0-9\s\.]{3,})")
+_FIGURE_DOT_RE = re.compile(r"\s*\.\s*")
+
+_MULTI_SPACE_RE = re.compile(r"[ ]{2,}")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([.,;:!?])")
+# Только пробельные серии, отличные от одного пробела: «. » уже нормализовано и не переписывается
+_SPACE_AFTER_PUNCT_RE = re.compile(r"([.,;:!?])(?: \s+|[^\S ]\s*)")
+# «слово - слово» и «слово -слово» → «слово-слово» за один проход
+_SPACED_HYPHEN_RE = re.compile(r"\s+-(?:\s+|(?=[А-Яа-яЁёA-Za-z]))")
+
+
 def normalize_figure_refs(text: str) -> str:
     """Нормализует формат ссылок на рисунки к «Рис.X.Y.Z» без лишних пробелов.
 
@@ -41,12 +77,11 @@ def normalize_figure_refs(text: str) -> str:
     def _repl(m: re.Match) -> str:
         num = m.group(1)
         # Убираем пробелы вокруг точек и внутри компонентов
-        num = re.sub(r"\s*\.\s*", ".", num.strip())
+        num = _FIGURE_DOT_RE.sub(".", num.strip())
         return f"Рис.{num}"
 
     # Допускаем опциональную точку после «Рис», любые пробелы, и числа с точками и пробелами
-    pattern = re.compile(r"Рис\.?\s*([0-9\s\.]{3,})")
-    return pattern.sub(_repl, text)
+    return _FIGURE_REF_RE.sub(_repl, text)
 
 
 def apply_safe_word_fixes(text: str) -> str:
@@ -54,23 +89,25 @@ def apply_safe_word_fixes(text: str) -> str:
 
     Используются только проверенные замены, не влияющие на разделение слов в нормальных случаях.
     """
-    fixed = text
-    for pattern, replacement in SAFE_WORD_FIXES:
-        fixed = pattern.sub(replacement, fixed)
-    return fixed
+    def _repl(m: re.Match) -> str:
+        # Совпавшая пара может не относиться ни к одному фиксу (например, «бан т») — оставляем как есть
+        return _SAFE_WORD_REPLACEMENTS.get((m.group(1).lower(), m.group(2).lower()), m.group(0))
+
+    return _SAFE_WORD_FIXES_RE.sub(_repl, text)
 
 
 def normalize_whitespace_punctuation(text: str) -> str:
     """Базовая нормализация пробелов и пунктуации (щадящая)."""
-    # 2+ пробелов → один
-    text = re.sub(r"[ ]{2,}", " ", text)
+    # 2+ пробелов → один (поиск подстроки дешевле холостого прохода регулярки)
+    if "  " in text:
+        text = _MULTI_SPACE_RE.sub(" ", text)
     # Пробелы перед знаками препинания
-    text = re.sub(r"\s+([.,;:!?])", r"\1", text)
+    text = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", text)
     # Нормализуем пробелы после знаков препинания (по крайней мере один)
-    text = re.sub(r"([.,;:!?])\s+", r"\1 ", text)
+    text = _SPACE_AFTER_PUNCT_RE.sub(r"\1 ", text)
     # Убираем пробелы вокруг дефисов внутри слов
-    text = re.sub(r"\s+-\s+", "-", text)
-    text = re.sub(r"\s+-\s*([А-Яа-яЁёA-Za-z])", r"-\1", text)
+    if "-" in text:
+        text = _SPACED_HYPHEN_RE.sub("-", text)
     return text.strip()
 
 
@@ -82,31 +119,95 @@ def clean_text_content(text: str) -> str:
     return text
 
 
+# Файл с mtime уже очищенных файлов (лежит рядом с ними)
+CLEANUP_CACHE_NAME = ".cleanup_mtimes.json"
+# С какого числа изменённых файлов очищать их в пуле процессов
+PARALLEL_MIN_FILES = 16
+
+
+def _load_cleanup_cache(cache_path: str) -> Dict[str, int]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except Exception:
+        return {}
+
+
+def _clean_one_file(path: str) -> Optional[int]:
+    """Очищает один файл (запись только при изменениях). Возвращает его mtime или None при ошибке."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            original = f.read()
+        cleaned = clean_text_content(original)
+        if cleaned != original:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(cleaned)
+        return os.stat(path).st_mtime_ns
+    except Exception:
+        # Щадяще: не прерываем конвейер при единичной ошибке
+        return None
+
+
 def clean_structured_texts(structured_dir: str) -> None:
-    """Проходит по всем *_structured.txt и применяет очистку."""
+    """Проходит по всем *_structured.txt и применяет очистку.
+
+    Файлы, не изменившиеся (по mtime) с прошлой очистки, пропускаются.
+    Если изменённых файлов много, они очищаются параллельно в нескольких процессах.
+    """
     if not os.path.isdir(structured_dir):
         return
-    for name in os.listdir(structured_dir):
-        if not name.endswith("_structured.txt"):
-            continue
-        path = os.path.join(structured_dir, name)
+    cache_path = os.path.join(structured_dir, CLEANUP_CACHE_NAME)
+    cache = _load_cleanup_cache(cache_path)
+    new_cache: Dict[str, int] = {}
+    pending: List[Tuple[str, str]] = []
+    with os.scandir(structured_dir) as it:
+        for entry in it:
+            if not entry.name.endswith("_structured.txt") or not entry.is_file():
+                continue
+            try:
+                mtime = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+            if cache.get(entry.name) == mtime:
+                new_cache[entry.name] = mtime
+            else:
+                pending.append((entry.name, entry.path))
+
+    paths = [path for _, path in pending]
+    if len(paths) >= PARALLEL_MIN_FILES and (os.cpu_count() or 1) > 1:
+        # Регулярки — чистый CPU, а файлы независимы: процессы обходят GIL
+        with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(paths))) as ex:
+            mtimes = list(ex.map(_clean_one_file, paths, chunksize=8))
+    else:
+        # Для нескольких файлов запуск процессов дороже самой очистки
+        mtimes = [_clean_one_file(path) for path in paths]
+
+    for (name, _), mtime in zip(pending, mtimes):
+        if mtime is not None:
+            new_cache[name] = mtime
+    if new_cache != cache:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                original = f.read()
-            cleaned = clean_text_content(original)
-            if cleaned != original:
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(cleaned)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(new_cache, f, ensure_ascii=False, indent=2)
         except Exception:
-            # Щадяще: не прерываем конвейер при единичной ошибке
-            continue
+            pass
 
 
 def clean_figure_mapping_titles(mapping_file: str) -> None:
-    """Очищает заголовки в figure_mapping.json (поле title)."""
+    """Очищает заголовки в figure_mapping.json (поле title).
+
+    Если файл не менялся (по mtime) с прошлой очистки, он не читается.
+    Запись выполняется атомарно: во временный файл и затем os.replace.
+    """
     if not os.path.exists(mapping_file):
         return
+    cache_path = os.path.join(os.path.dirname(mapping_file), CLEANUP_CACHE_NAME)
+    cache = _load_cleanup_cache(cache_path)
+    cache_key = os.path.basename(mapping_file)
     try:
+        if cache.get(cache_key) == os.stat(mapping_file).st_mtime_ns:
+            return
         with open(mapping_file, "r", encoding="utf-8") as f:
             mapping = json.load(f)
     except Exception:
@@ -121,11 +222,14 @@ def clean_figure_mapping_titles(mapping_file: str) -> None:
                 info["title"] = cleaned
                 updated = True
 
-    if updated:
-        try:
-            with open(mapping_file, "w", encoding="utf-8") as f:
+    try:
+        if updated:
+            tmp_path = mapping_file + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
                 json.dump(mapping, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
-
-
+            os.replace(tmp_path, mapping_file)
+        cache[cache_key] = os.stat(mapping_file).st_mtime_ns
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+    except Exception:
+        pass
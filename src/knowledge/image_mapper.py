@@ -4,41 +4,155 @@
 
 import os
 import json
+import re
+import heapq
+from bisect import bisect_right
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional, Iterable, List, Tuple
+from typing import Any, Dict, Optional, Iterable, List, NamedTuple, Tuple
+
+try:
+    # orjson (если установлен) разбирает JSON в несколько раз быстрее стандартного json
+    from orjson import loads as _json_loads  # type: ignore
+except ImportError:
+    _json_loads = json.loads
 
 IMAGES_DIR = os.path.join(os.path.dirname(__file__), "data", "images")
 MAPPING_FILE = os.path.join(IMAGES_DIR, "figure_mapping.json")
+# Префикс для путей к файлам прямо в IMAGES_DIR (дешевле os.path.join)
+_IMAGES_PREFIX = IMAGES_DIR + os.sep
+
+_FIG_RE = re.compile(r'рис\.?\s*(\d+(?:\.\d+)+)', re.IGNORECASE)
+
+
+class FigInfo(NamedTuple):
+    """Запись маппинга рисунка; None — поле отсутствует в figure_mapping.json."""
+    title: Any = None
+    path: Any = None
+    image: Any = None
+
+
+# Разобранный маппинг и mtime файла, из которого он прочитан
+_MAPPING_CACHE: Optional[Tuple[int, Dict[str, FigInfo]]] = None
+# Индекс заголовков для find_figures_by_keywords, строится вместе с кешем маппинга:
+# (ключи рисунков, начала заголовков, склеенные заголовки, кеш совпадений по ключевому слову)
+_TITLE_INDEX: Optional[Tuple[Tuple[str, ...], Tuple[int, ...], str, Dict[str, frozenset]]] = None
+# Имена файлов в IMAGES_DIR и mtime папки, на момент которого они прочитаны
+_IMAGES_DIR_CACHE: Optional[Tuple[int, frozenset]] = None
+# Ограничение кеша совпадений (ключевые слова приходят из запросов пользователей)
+_MAX_KEYWORD_POSTINGS = 4096
 
 
-def load_figure_mapping() -> Dict[str, dict]:
-    """Загружает маппинг рисунков на изображения."""
-    if not os.path.exists(MAPPING_FILE):
+def load_figure_mapping() -> Dict[str, FigInfo]:
+    """Загружает маппинг рисунков на изображения.
+
+    Записи-словари из JSON превращаются в FigInfo, записи другого вида отбрасываются.
+    Результат кешируется и перечитывается только при изменении mtime файла.
+    Возвращаемый словарь общий для всех вызовов — не изменяйте его.
+    """
+    global _MAPPING_CACHE, _TITLE_INDEX
+    try:
+        mtime = os.stat(MAPPING_FILE).st_mtime_ns
+    except OSError:
+        _MAPPING_CACHE = _TITLE_INDEX = None
         return {}
     
+    if _MAPPING_CACHE is not None and _MAPPING_CACHE[0] == mtime:
+        return _MAPPING_CACHE[1]
+    
     try:
-        with open(MAPPING_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(MAPPING_FILE, "rb") as f:
+            raw = _json_loads(f.read())
+        mapping = {
+            fig_key: FigInfo(info.get("title"), info.get("path"), info.get("image"))
+            for fig_key, info in raw.items()
+            if isinstance(info, dict)
+        }
     except Exception:
+        _TITLE_INDEX = None
         return {}
+    _MAPPING_CACHE = (mtime, mapping)
+    _TITLE_INDEX = _build_title_index(mapping)
+    return mapping
 
 
 def find_figures_in_text(text: str) -> list:
     """Находит все упоминания рисунков в тексте (Рис.X.X.X)."""
-    import re
-    pattern = re.compile(r'рис\.?\s*(\d+(?:\.\d+)+)', re.IGNORECASE)
-    matches = pattern.findall(text or "")
-    return [f"Рис.{fig}" for fig in matches]
+    # В большинстве сообщений рисунков нет: поиск подстроки дешевле прохода регулярки.
+    # Самое короткое совпадение — "рис1.1" (6 символов), и в номере всегда есть точка,
+    # поэтому короткие сообщения и текст без точек отсекаются без копии text.lower()
+    if not text or len(text) < 6 or "." not in text or "рис" not in text.lower():
+        return []
+    return list(map("Рис.".__add__, _FIG_RE.findall(text)))
+
+
+def _images_dir_names() -> frozenset:
+    """Имена файлов (не папок) в IMAGES_DIR; список перечитывается только при изменении mtime папки."""
+    global _IMAGES_DIR_CACHE
+    try:
+        mtime = os.stat(IMAGES_DIR).st_mtime_ns
+    except OSError:
+        _IMAGES_DIR_CACHE = None
+        return frozenset()
+    if _IMAGES_DIR_CACHE is None or _IMAGES_DIR_CACHE[0] != mtime:
+        # DirEntry.is_file() берёт тип из самого листинга, без отдельного stat на файл
+        with os.scandir(IMAGES_DIR) as entries:
+            names = frozenset(entry.name for entry in entries if entry.is_file())
+        _IMAGES_DIR_CACHE = (mtime, names)
+    return _IMAGES_DIR_CACHE[1]
+
+
+def _image_in_dir(name: str) -> Optional[str]:
+    """Путь к файлу name внутри IMAGES_DIR, если он существует."""
+    if not name:
+        return None
+    if "/" in name or "\\" in name:
+        # Вложенные пути проверяем на диске
+        full_path = os.path.join(IMAGES_DIR, name)
+        return full_path if os.path.exists(full_path) else None
+    return _IMAGES_PREFIX + name if name in _images_dir_names() else None
 
 
 def get_image_path_for_figure(figure_key: str) -> Optional[str]:
-    """Возвращает путь к изображению для указанного рисунка."""
-    mapping = load_figure_mapping()
-    if figure_key in mapping and "path" in mapping[figure_key]:
-        path = mapping[figure_key]["path"]
-        
+    """Возвращает путь к изображению для указанного рисунка.
+
+    Результат запоминается до изменения маппинга или содержимого IMAGES_DIR (по их mtime).
+    """
+    load_figure_mapping()
+    _images_dir_names()
+    mapping_version = _MAPPING_CACHE[0] if _MAPPING_CACHE is not None else None
+    images_version = _IMAGES_DIR_CACHE[0] if _IMAGES_DIR_CACHE is not None else None
+    return _resolve_image_path(figure_key, mapping_version, images_version)
+
+
+def get_image_paths_for_figures(figure_keys: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Пути к изображениям сразу для нескольких рисунков: {ключ: путь или None}.
+
+    Маппинг и листинг IMAGES_DIR проверяются один раз на весь набор ключей.
+    """
+    load_figure_mapping()
+    _images_dir_names()
+    mapping_version = _MAPPING_CACHE[0] if _MAPPING_CACHE is not None else None
+    images_version = _IMAGES_DIR_CACHE[0] if _IMAGES_DIR_CACHE is not None else None
+    return {
+        figure_key: _resolve_image_path(figure_key, mapping_version, images_version)
+        for figure_key in figure_keys
+    }
+
+
+# Кешируются и промахи (None) — ключи с опечатками и OCR-шумом не проверяются на диске повторно
+@lru_cache(maxsize=8192)
+def _resolve_image_path(figure_key: str, mapping_version: Optional[int], images_version: Optional[int]) -> Optional[str]:
+    """Поиск файла рисунка; версии входят в ключ кеша и сбрасывают его при изменениях."""
+    mapping = _MAPPING_CACHE[1] if _MAPPING_CACHE is not None else {}
+    info = mapping.get(figure_key)
+    if info is None:
+        return None
+    path = info.path
+    if path is not None:
         # Нормализуем путь (заменяем Windows-разделители на Unix)
-        path = path.replace("\\", "/")
+        if "\\" in path:
+            path = path.replace("\\", "/")
         
         # Если путь абсолютный, проверяем его существование
         if os.path.isabs(path):
@@ -46,30 +160,26 @@ def get_image_path_for_figure(figure_key: str) -> Optional[str]:
                 return path
             # Если абсолютный путь не существует (например, Windows путь в Linux контейнере),
             # пытаемся извлечь имя файла и найти его в IMAGES_DIR
-            filename = os.path.basename(path)
-            if filename:
-                alt_path = os.path.join(IMAGES_DIR, filename)
-                if os.path.exists(alt_path):
-                    return alt_path
+            alt_path = _image_in_dir(os.path.basename(path))
+            if alt_path:
+                return alt_path
         
         # Если путь относительный, строим его относительно IMAGES_DIR
         if not os.path.isabs(path):
             # Убираем возможные префиксы пути, оставляя только имя файла
-            filename = os.path.basename(path)
-            full_path = os.path.join(IMAGES_DIR, filename)
-            if os.path.exists(full_path):
+            full_path = _image_in_dir(os.path.basename(path))
+            if full_path:
                 return full_path
             
             # Пробуем исходный относительный путь относительно IMAGES_DIR
-            full_path = os.path.join(IMAGES_DIR, path)
-            if os.path.exists(full_path):
+            full_path = _image_in_dir(path)
+            if full_path:
                 return full_path
         
         # Также проверяем поле "image", если оно есть
-        if "image" in mapping[figure_key]:
-            image_filename = mapping[figure_key]["image"]
-            alt_path = os.path.join(IMAGES_DIR, image_filename)
-            if os.path.exists(alt_path):
+        if info.image is not None:
+            alt_path = _image_in_dir(info.image)
+            if alt_path:
                 return alt_path
     
     return None
@@ -77,34 +187,77 @@ def get_image_path_for_figure(figure_key: str) -> Optional[str]:
 
 def get_figure_title(figure_key: str) -> str:
     """Возвращает заголовок рисунка или пустую строку."""
-    mapping = load_figure_mapping()
-    if figure_key in mapping:
-        fig_info = mapping[figure_key]
-        if isinstance(fig_info, dict) and "title" in fig_info:
-            return fig_info["title"]
-    return ""
+    info = load_figure_mapping().get(figure_key)
+    if info is None or info.title is None:
+        return ""
+    return info.title
+
+
+def _build_title_index(mapping: Dict[str, FigInfo]) -> Tuple[Tuple[str, ...], Tuple[int, ...], str, Dict[str, frozenset]]:
+    """Индекс заголовков для поиска по ключевым словам (только валидные записи с заголовком).
+
+    Ключи рисунков и позиции заголовков лежат в параллельных кортежах, а сами заголовки
+    в нижнем регистре склеены в одну строку через "\\0", поэтому поиск подстроки
+    выполняется одним ``str.find`` по всему тексту, а не обходом словарей маппинга.
+    """
+    fig_keys: List[str] = []
+    starts: List[int] = []
+    titles: List[str] = []
+    pos = 0
+    for fig_key, info in mapping.items():
+        title = str(info.title if info.title is not None else "").lower()
+        if not title:
+            continue
+        fig_keys.append(fig_key)
+        starts.append(pos)
+        titles.append(title)
+        pos += len(title) + 1
+    return tuple(fig_keys), tuple(starts), "\0".join(titles), {}
+
 
+def _figures_with_keyword(keyword: str, starts: Tuple[int, ...], haystack: str) -> frozenset:
+    """Индексы рисунков, в заголовке которых встречается keyword (подстрокой)."""
+    found = set()
+    pos = haystack.find(keyword)
+    while pos != -1:
+        idx = bisect_right(starts, pos) - 1
+        found.add(idx)
+        # Остальные вхождения в этом же заголовке не нужны — переходим к следующему
+        if idx + 1 >= len(starts):
+            break
+        pos = haystack.find(keyword, starts[idx + 1])
+    return frozenset(found)
 
-def find_figures_by_keywords(keywords: Iterable[str]) -> List[str]:
+
+def find_figures_by_keywords(keywords: Iterable[str], limit: Optional[int] = None) -> List[str]:
     """Возвращает список ключей рисунков, у которых заголовок содержит любые из ключевых слов.
 
     Результат отсортирован по количеству совпавших ключевых слов (по убыванию), затем по ключу.
+    Если задан limit, возвращаются только первые limit рисунков (без полной сортировки).
     """
     kw = {k.lower() for k in keywords if k}
     if not kw:
         return []
-    mapping = load_figure_mapping()
-    scored: List[Tuple[str, int]] = []
-    for fig_key, info in mapping.items():
-        if not isinstance(info, dict):
-            continue
-        title = str(info.get("title", "")).lower()
-        if not title:
-            continue
-        score = sum(1 for k in kw if k and k in title)
-        if score > 0:
-            scored.append((fig_key, score))
+    load_figure_mapping()
+    if _TITLE_INDEX is None:
+        return []
+    fig_keys, starts, haystack, postings = _TITLE_INDEX
+    if len(postings) > _MAX_KEYWORD_POSTINGS:
+        postings.clear()
+    scores: Dict[int, int] = {}
+    # Каждое ключевое слово ищется отдельно: общая альтернатива "k1|k2|..." в re даёт
+    # одно совпадение на позицию и теряет вложенные слова ("шар" внутри "шары"),
+    # а повторные слова и так берутся из кеша postings без прохода по заголовкам
+    for k in kw:
+        matched = postings.get(k)
+        if matched is None:
+            matched = postings[k] = _figures_with_keyword(k, starts, haystack)
+        for idx in matched:
+            scores[idx] = scores.get(idx, 0) + 1
+    scored: List[Tuple[str, int]] = [(fig_keys[idx], score) for idx, score in scores.items()]
     # Сортируем по score (desc), затем по fig_key для стабильности
-    scored.sort(key=lambda x: (-x[1], x[0]))
+    if limit is not None:
+        scored = heapq.nsmallest(limit, scored, key=lambda x: (-x[1], x[0]))
+    else:
+        scored.sort(key=lambda x: (-x[1], x[0]))
     return [fig for fig, _ in scored]
-
@@ -5,18 +5,49 @@
 Альтернатива векторной базе данных - более надежная и простая система.
 """
 
+import atexit
 import os
 import re
 import sqlite3
 import sys
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
 
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 STRUCTURED_DIR = os.path.join(DATA_DIR, "structured")
 DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "knowledge.db"))
 
+# Регулярные выражения компилируются один раз при импорте модуля
+_WS_RE = re.compile(r'\s+')
+_FIG_RE = re.compile(r'Рис\.(\d+\.\d+\.\d+)')
+_HDR_RE = re.compile(r'^#+\s*')
+# Номер пункта/подпункта в начале строки: N. или N.N. или N.N.N.
+_POINT_RE = re.compile(r'(?:^|\n)(\d{1,2}(?:\.\d+)*\.)\s+')
+# Заголовок раздела "# ..."
+_SECTION_RE = re.compile(r'^# ([^\n]+)', re.MULTILINE)
+# Строка только из маркеров перечисления
+_ENUM_MARKER_RE = re.compile(r'^[\s\-•\(\)]+$')
+_LEADING_NUMBER_RE = re.compile(r'^(\d+(?:\.\d+)*\.)\s+')
+# Строка (не первая), которая после strip() начинается с "# " - заголовок следующего раздела
+_SECTION_LINE_RE = re.compile(r'\n[^\S\n]*# [^\n]*\S')
+_NEWLINE_RE = re.compile(r'\n')
+# Начало строки с заголовком раздела (без захвата названия)
+_NEXT_SECTION_RE = re.compile(r'^# ', re.MULTILINE)
+# Номер пункта в любом месте текста
+_INLINE_POINT_RE = re.compile(r'(\d{1,2}(?:\.\d+)*\.)\s+')
+_DIGITS_RE = re.compile(r'\d+')
+# Строка - элемент списка: после пробелов в начале строки идёт "-"
+_LIST_ITEM_LINE_RE = re.compile(r'^[^\S\n]*-', re.MULTILINE)
+# Фраза в звёздочках в запросе: *точная фраза*
+_PHRASE_RE = re.compile(r'\*([^*]+?)\*')
+
 
 @dataclass
 class SearchHit:
@@ -27,25 +58,74 @@ class SearchHit:
     figures: str = ""  # Список рисунков в формате "Рис.1.1.1,Рис.1.1.2"
     section: str = ""  # Секция/раздел документа
 
+    @property
+    def figure_list(self) -> tuple[str, ...]:
+        """Рисунки из figures в виде кортежа ключей ("Рис.1.1.1", ...), без пустых элементов."""
+        if not self.figures:
+            return ()
+        return tuple(fig for fig in map(str.strip, self.figures.split(",")) if fig)
 
-def _get_connection() -> sqlite3.Connection:
-    """Создает подключение к SQLite базе данных."""
+
+# Подключения только для чтения, по одному на поток (поиск не открывает файл БД на каждый запрос)
+_conn_local = threading.local()
+_read_connections: list[sqlite3.Connection] = []
+_read_connections_lock = threading.Lock()
+# Индекс проверен ensure_index() (см. ниже), повторные проверки не нужны
+_index_ready = False
+_index_lock = threading.Lock()
+
+
+def _open_connection() -> sqlite3.Connection:
+    """Создает новое подключение к SQLite базе данных (для записи при построении индекса)."""
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def _get_connection() -> sqlite3.Connection:
+    """Возвращает подключение только для чтения, закешированное для текущего потока.
+
+    Подключение общее для всех запросов потока — не закрывайте его.
+    """
+    cached = getattr(_conn_local, "conn", None)
+    if cached is not None and cached[0] == DB_PATH:
+        return cached[1]
+    
+    conn = sqlite3.connect(Path(DB_PATH).as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    with _read_connections_lock:
+        _read_connections.append(conn)
+    _conn_local.conn = (DB_PATH, conn)
+    return conn
+
+
+@atexit.register
+def _close_read_connections() -> None:
+    """Закрывает закешированные подключения при завершении процесса."""
+    with _read_connections_lock:
+        for conn in _read_connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _read_connections.clear()
+
+
 def _normalize_text(text: str) -> str:
     """Нормализует текст для поиска."""
     # Убираем лишние пробелы, переносы строк
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     text = text.strip()
     return text
 
 
 def _extract_figures(text: str) -> str:
     """Извлекает все упоминания рисунков из текста."""
-    figures = re.findall(r'Рис\.(\d+\.\d+\.\d+)', text)
+    figures = _FIG_RE.findall(text)
     if figures:
         return ",".join([f"Рис.{f}" for f in figures])
     return ""
@@ -59,7 +139,7 @@ def _extract_section(text: str, max_lines: int = 10) -> str:
         line = line.strip()
         if line.startswith('#'):
             # Убираем символы # и лишние пробелы
-            section = re.sub(r'^#+\s*', '', line)
+            section = _HDR_RE.sub('', line)
             section = section.strip()
             if section and len(section) < 100:
                 return section
@@ -68,7 +148,7 @@ def _extract_section(text: str, max_lines: int = 10) -> str:
 
 def _rule_number_sort_key(fragment: dict) -> tuple[int, ...]:
     number = fragment.get("rule_number") or ""
-    parts = [int(part) for part in re.findall(r"\d+", number)]
+    parts = [int(part) for part in _DIGITS_RE.findall(number)]
     if not parts:
         return (sys.maxsize,)
     return tuple(parts)
@@ -87,6 +167,55 @@ def _sort_and_return_fragments(fragments: list[dict]) -> list[dict]:
     return fragments
 
 
+def _prepare_document(filename: str) -> Optional[tuple[tuple[str, str, str, str, str], int]]:
+    """Читает структурированный файл и готовит строку для таблицы documents.
+
+    Возвращает строку (source, title, content, section, figures) и длину исходного текста
+    или None, если файл пустой.
+    """
+    filepath = os.path.join(STRUCTURED_DIR, filename)
+    title = filename.replace("_structured.txt", "").replace(".pdf", "")
+    
+    with open(filepath, "r", encoding="utf-8") as f:
+        content = f.read()
+    
+    if not content.strip():
+        return None
+    
+    # Извлекаем все рисунки из всего документа
+    figures = _extract_figures(content)
+    
+    # Извлекаем название (первый заголовок или название файла)
+    section_name = _extract_section(content)
+    if not section_name:
+        section_name = title
+    
+    # Вставляем ВЕСЬ текст файла как один документ (не разбиваем на фрагменты)
+    # Нормализуем текст для поиска последним шагом и сразу освобождаем исходный текст,
+    # чтобы до вставки в памяти оставалась только нормализованная копия
+    size = len(content)
+    normalized = _normalize_text(content)
+    del content
+    
+    return (filename, title, normalized, section_name, figures), size
+
+
+@lru_cache(maxsize=1)
+def _has_fts5() -> bool:
+    """Проверяет, собран ли SQLite с FTS5 (пробная таблица в памяти, без файла БД)."""
+    try:
+        probe = sqlite3.connect(":memory:")
+    except sqlite3.Error:
+        return False
+    try:
+        probe.execute("CREATE VIRTUAL TABLE test_fts5 USING fts5(test)")
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        probe.close()
+
+
 def build_index() -> None:
     """
     Строит индекс из структурированных текстов.
@@ -96,8 +225,12 @@ def build_index() -> None:
         print(f"[WARNING] Директория со структурированными текстами не найдена: {STRUCTURED_DIR}")
         return
     
-    conn = _get_connection()
+    conn = _open_connection()
     cursor = conn.cursor()
+    # Индекс целиком пересобирается из файлов: fsync после каждой записи не нужен.
+    # Журнал не отключаем — DELETE и вставка остаются одной атомарной транзакцией
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA temp_store=MEMORY")
     
     # Создаем основную таблицу для хранения документов
     cursor.execute("""
@@ -112,22 +245,8 @@ def build_index() -> None:
         )
     """)
     
-    # Проверяем поддержку FTS5
-    try:
-        cursor.execute("PRAGMA compile_options")
-        compile_options = [row[0] for row in cursor.fetchall()]
-        has_fts5 = any('FTS5' in opt for opt in compile_options)
-    except:
-        has_fts5 = False
-    
-    if not has_fts5:
-        # Проверяем через попытку создания таблицы
-        try:
-            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS test_fts5 USING fts5(test)")
-            cursor.execute("DROP TABLE test_fts5")
-            has_fts5 = True
-        except:
-            has_fts5 = False
+    # Поддержка FTS5 зависит только от сборки SQLite, проверяется один раз за процесс
+    has_fts5 = _has_fts5()
     
     # Сохраняем флаг для использования позже
     use_fts5 = has_fts5
@@ -177,42 +296,33 @@ def build_index() -> None:
     print(f"[INFO] Найдено структурированных файлов: {len(structured_files)}")
     
     total_docs = 0
+    rows: list[tuple[str, str, str, str, str]] = []
     
-    for filename in sorted(structured_files):
-        filepath = os.path.join(STRUCTURED_DIR, filename)
-        title = filename.replace("_structured.txt", "").replace(".pdf", "")
-        
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
-            
-            if not content.strip():
+    # Чтение и нормализация файлов идут параллельно, запись в SQLite — только в этом потоке
+    with ThreadPoolExecutor(max_workers=min(len(structured_files), os.cpu_count() or 1)) as pool:
+        futures = [
+            (filename, pool.submit(_prepare_document, filename))
+            for filename in sorted(structured_files)
+        ]
+        for filename, future in futures:
+            try:
+                prepared = future.result()
+            except Exception as e:
+                print(f"  [ERROR] Ошибка при обработке {filename}: {e}")
                 continue
             
-            # Вставляем ВЕСЬ текст файла как один документ (не разбиваем на фрагменты)
-            # Нормализуем текст для поиска (но сохраняем оригинал для отображения)
-            normalized = _normalize_text(content)
-            
-            # Извлекаем все рисунки из всего документа
-            figures = _extract_figures(content)
-            
-            # Извлекаем название (первый заголовок или название файла)
-            section_name = _extract_section(content)
-            if not section_name:
-                section_name = title
-            
-            # Вставляем весь документ как одну запись
-            cursor.execute("""
-                INSERT INTO documents (source, title, content, section, figures)
-                VALUES (?, ?, ?, ?, ?)
-            """, (filename, title, normalized, section_name, figures))
+            if prepared is None:
+                continue
             
+            row, content_length = prepared
+            rows.append(row)
             total_docs += 1
-            print(f"  [OK] {filename}: индексирован как один документ ({len(content)} символов)")
-            
-        except Exception as e:
-            print(f"  [ERROR] Ошибка при обработке {filename}: {e}")
-            continue
+            print(f"  [OK] {filename}: индексирован как один документ ({content_length} символов)")
+    
+    cursor.executemany("""
+        INSERT INTO documents (source, title, content, section, figures)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
     
     # Заполняем FTS таблицу данными
     if use_fts5:
@@ -232,6 +342,10 @@ def build_index() -> None:
             SELECT id, content, source, title, section, figures FROM documents
         """)
     
+    # Индекс по источнику и статистика для планировщика запросов
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source)")
+    conn.commit()
+    cursor.execute("ANALYZE")
     conn.commit()
     conn.close()
     
@@ -239,10 +353,20 @@ def build_index() -> None:
 
 
 def ensure_index() -> None:
-    """Проверяет наличие индекса, создает если нужно."""
-    if not os.path.exists(DB_PATH):
-        build_index()
-    else:
+    """Проверяет наличие индекса, создает если нужно.
+
+    Проверка выполняется до первого успешного результата: дальше индекс считается
+    стабильным на всё время жизни процесса и search() не тратит на неё запросы.
+    """
+    global _index_ready
+    if _index_ready:
+        return
+    with _index_lock:
+        if _index_ready:
+            return
+        if not os.path.exists(DB_PATH):
+            build_index()
+            return
         # Проверяем, что индекс не пустой
         conn = _get_connection()
         cursor = conn.cursor()
@@ -256,10 +380,68 @@ def ensure_index() -> None:
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='documents_fts'")
                 if not cursor.fetchone():
                     build_index()
+                else:
+                    _index_ready = True
         except Exception:
             build_index()
-        finally:
-            conn.close()
+
+
+# Тексты запросов поиска - константы: sqlite3 кеширует подготовленные выражения на
+# подключении по тексту SQL, а LIMIT передаётся параметром, поэтому повторные
+# вызовы не разбирают SQL заново
+_SQL_FTS_BM25 = """
+    SELECT 
+        d.source,
+        d.title,
+        d.content,
+        d.section,
+        d.figures,
+        bm25(documents_fts) as rank
+    FROM documents_fts
+    JOIN documents d ON documents_fts.rowid = d.id
+    WHERE documents_fts MATCH ?
+    ORDER BY rank
+    LIMIT ?
+"""
+_SQL_FTS_PLAIN = """
+    SELECT 
+        d.source,
+        d.title,
+        d.content,
+        d.section,
+        d.figures,
+        0.0 as rank
+    FROM documents_fts
+    JOIN documents d ON documents_fts.rowid = d.id
+    WHERE documents_fts MATCH ?
+    LIMIT ?
+"""
+_SQL_LIKE = """
+    SELECT source, title, content, section, figures
+    FROM documents
+    WHERE content LIKE ?
+    LIMIT ?
+"""
+
+
+@lru_cache(maxsize=32)
+def _lower_content(content: str) -> str:
+    """content.lower() с кешем: поиск раз за разом возвращает одни и те же документы.
+
+    Ключ кеша - сам текст, поэтому после пересборки индекса устаревших значений не бывает.
+    """
+    return content.lower()
+
+
+def _fts_match(cursor: sqlite3.Cursor, fts_query: str, limit: int) -> list:
+    """Выполняет FTS-запрос; строки упорядочены по bm25, если он поддерживается (FTS5)."""
+    try:
+        # Пробуем использовать bm25 (FTS5)
+        cursor.execute(_SQL_FTS_BM25, (fts_query, limit))
+    except:
+        # Fallback для FTS4 или если bm25 не работает
+        cursor.execute(_SQL_FTS_PLAIN, (fts_query, limit))
+    return cursor.fetchall()
 
 
 def search(query: str, top_k: int = 5) -> List[SearchHit]:
@@ -307,45 +489,18 @@ def search(query: str, top_k: int = 5) -> List[SearchHit]:
         # Используем префиксный поиск (*) для частичного совпадения
         fts_query = f'"{word}"*'
     
-    conn = _get_connection()
+    try:
+        conn = _get_connection()
+    except sqlite3.Error as e:
+        # Индекс так и не был создан (например, нет структурированных текстов)
+        import logging
+        logging.getLogger(__name__).warning(f"База поиска недоступна: {e}")
+        return []
     cursor = conn.cursor()
     
     try:
         # Выполняем FTS поиск с ранжированием по релевантности
-        # Проверяем, поддерживается ли bm25 (только в FTS5)
-        try:
-            # Пробуем использовать bm25 (FTS5)
-            cursor.execute("""
-                SELECT 
-                    d.source,
-                    d.title,
-                    d.content,
-                    d.section,
-                    d.figures,
-                    bm25(documents_fts) as rank
-                FROM documents_fts
-                JOIN documents d ON documents_fts.rowid = d.id
-                WHERE documents_fts MATCH ?
-                ORDER BY rank
-                LIMIT ?
-            """, (fts_query, top_k * 2))
-        except:
-            # Fallback для FTS4 или если bm25 не работает
-            cursor.execute("""
-                SELECT 
-                    d.source,
-                    d.title,
-                    d.content,
-                    d.section,
-                    d.figures,
-                    0.0 as rank
-                FROM documents_fts
-                JOIN documents d ON documents_fts.rowid = d.id
-                WHERE documents_fts MATCH ?
-                LIMIT ?
-            """, (fts_query, top_k * 2))
-        
-        results = cursor.fetchall()
+        results = _fts_match(cursor, fts_query, top_k * 2)
         
         # Добавляем логирование для отладки
         import logging
@@ -353,16 +508,20 @@ def search(query: str, top_k: int = 5) -> List[SearchHit]:
         logger.debug(f"FTS запрос: '{fts_query}', найдено строк: {len(results)}")
         
         hits: List[SearchHit] = []
-        seen_texts = set()  # Для дедупликации
+        seen_texts: set[str] = set()  # Для дедупликации
+        
+        # Слова запроса в нижнем регистре не зависят от строки результата — считаем один раз
+        query_lower = query_normalized.lower()
+        query_words = query_lower.split()
         
         for row in results:
             content = row['content']
             
-            # Дедупликация по первым 100 символам
-            content_key = content[:100]
-            if content_key in seen_texts:
+            # Дедупликация по всему тексту: хеш строки вычисляется один раз и
+            # кешируется в ней, его же переиспользует _lower_content() ниже
+            if content in seen_texts:
                 continue
-            seen_texts.add(content_key)
+            seen_texts.add(content)
             
             # Вычисляем score (чем меньше rank, тем выше релевантность)
             # bm25 возвращает отрицательные значения, конвертируем в 0-1
@@ -370,12 +529,11 @@ def search(query: str, top_k: int = 5) -> List[SearchHit]:
             score = max(0.0, min(1.0, 1.0 / (1.0 + abs(rank) / 10.0)))
             
             # Если запрос точно совпадает с началом текста, повышаем score
-            if content.lower().startswith(query_normalized.lower()):
+            content_lower = _lower_content(content)
+            if content_lower.startswith(query_lower):
                 score = min(1.0, score + 0.2)
             
             # Подсчитываем количество совпадений слов
-            query_words = query_normalized.lower().split()
-            content_lower = content.lower()
             matches = sum(1 for word in query_words if word in content_lower)
             if matches > 0:
                 score = min(1.0, score + (matches / len(query_words)) * 0.3)
@@ -393,58 +551,62 @@ def search(query: str, top_k: int = 5) -> List[SearchHit]:
             if len(hits) >= top_k:
                 break
         
+        def _add_fallback_hits(rows) -> None:
+            """Добавляет строки fallback-поиска в hits (с дедупликацией и упрощенным score)."""
+            for row in rows:
+                content = row['content']
+                if content in seen_texts:
+                    continue
+                seen_texts.add(content)
+                
+                # Подсчитываем количество совпадений слов
+                content_lower = _lower_content(content)
+                matches = sum(1 for w in query_words if w in content_lower)
+                score = 0.7 if matches > 0 else 0.5
+                
+                if matches > 0:
+                    score = min(1.0, 0.7 + (matches / len(query_words)) * 0.3)
+                
+                hit = SearchHit(
+                    source=row['source'] or "",
+                    title=row['title'] or "",
+                    text=content,
+                    score=score,
+                    figures=row['figures'] or "",
+                    section=row['section'] or ""
+                )
+                hits.append(hit)
+                
+                if len(hits) >= top_k:
+                    break
+        
+        # Если точные слова не нашлись, ищем их как префиксы одним FTS-запросом:
+        # "шар" OR "удар" -> "шар"* OR "удар"* (одно слово уже искалось префиксом выше)
+        if not hits:
+            prefix_words = [w for w in query_normalized.split() if len(w) > 2]
+            if len(prefix_words) > 1:
+                prefix_query = " OR ".join('"{}"*'.format(w.replace('"', '""')) for w in prefix_words)
+                prefix_results = _fts_match(cursor, prefix_query, top_k * 2)
+                logger.debug(f"FTS префиксный запрос: '{prefix_query}', найдено строк: {len(prefix_results)}")
+                _add_fallback_hits(prefix_results)
+        
         # Если FTS не нашел результатов, делаем fallback поиск по LIKE
         if not hits:
             logger.debug("FTS не нашел результатов, используем fallback LIKE поиск")
-            query_words = query_normalized.split()
-            
             # Пробуем разные варианты поиска
-            for word in query_words:
+            for word in query_normalized.split():
                 if len(word) < 3:
                     continue
                     
                 like_pattern = f"%{word}%"
                 
-                cursor.execute("""
-                    SELECT source, title, content, section, figures
-                    FROM documents
-                    WHERE content LIKE ?
-                    LIMIT ?
-                """, (like_pattern, top_k * 2))
+                cursor.execute(_SQL_LIKE, (like_pattern, top_k * 2))
                 
                 fallback_results = cursor.fetchall()
                 
                 if fallback_results:
                     logger.debug(f"Fallback нашел {len(fallback_results)} результатов для слова '{word}'")
-                    
-                    for row in fallback_results:
-                        content = row['content']
-                        content_key = content[:100]
-                        if content_key in seen_texts:
-                            continue
-                        seen_texts.add(content_key)
-                        
-                        # Подсчитываем количество совпадений слов
-                        query_words_lower = query_normalized.lower().split()
-                        content_lower = content.lower()
-                        matches = sum(1 for w in query_words_lower if w in content_lower)
-                        score = 0.7 if matches > 0 else 0.5
-                        
-                        if matches > 0:
-                            score = min(1.0, 0.7 + (matches / len(query_words_lower)) * 0.3)
-                        
-                        hit = SearchHit(
-                            source=row['source'] or "",
-                            title=row['title'] or "",
-                            text=content,
-                            score=score,
-                            figures=row['figures'] or "",
-                            section=row['section'] or ""
-                        )
-                        hits.append(hit)
-                        
-                        if len(hits) >= top_k:
-                            break
+                    _add_fallback_hits(fallback_results)
                     
                     # Если нашли результаты, прекращаем поиск
                     if hits:
@@ -465,12 +627,7 @@ def search(query: str, top_k: int = 5) -> List[SearchHit]:
         like_pattern = f"%{'%'.join(query_words)}%"
         
         try:
-            cursor.execute("""
-                SELECT source, title, content, section, figures
-                FROM documents
-                WHERE content LIKE ?
-                LIMIT ?
-            """, (like_pattern, top_k))
+            cursor.execute(_SQL_LIKE, (like_pattern, top_k))
             
             results = cursor.fetchall()
             logger.debug(f"Fallback LIKE поиск: найдено {len(results)} результатов")
@@ -491,9 +648,6 @@ def search(query: str, top_k: int = 5) -> List[SearchHit]:
         except Exception as e2:
             logger.error(f"Ошибка fallback поиска: {e2}", exc_info=True)
             return []
-    
-    finally:
-        conn.close()
 
 
 import re
@@ -515,10 +669,141 @@ CONTEXT_ROUTES = {
 CONTEXT_STOP_WORDS = set([w for w in CONTEXT_ROUTES] + ['игра', 'русский', 'бильярд', 'стол', 'общие'])
 
 
+def _doc_sort_key(doc: str) -> tuple[int, str]:
+    """Ключ сортировки документа: сначала "Международные правила" (2.1.1_), затем "Правила Корона" (2.1.2_), затем остальные."""
+    if doc.startswith("2.1.1_"):
+        return (0, doc)  # Международные правила - первый приоритет
+    elif doc.startswith("2.1.2_"):
+        return (1, doc)  # Правила Корона - второй приоритет
+    else:
+        return (2, doc)  # Остальные - третий приоритет
+
+
+# Кандидаты всегда берутся из ALLOWED_SOURCES, поэтому ключи сортировки считаются один раз
+_DOC_SORT_KEYS = {doc: _doc_sort_key(doc) for doc in ALLOWED_SOURCES}
+
+
 def _normalize_number(number: str) -> str:
     return number.strip().rstrip('.').strip()
 
 
+def _build_section_index(content: str) -> tuple[list[int], list[str]]:
+    """Позиции заголовков разделов "# ..." и их названия (strip) в порядке следования."""
+    section_starts: list[int] = []
+    section_names: list[str] = []
+    for m in _SECTION_RE.finditer(content):
+        section_starts.append(m.start())
+        section_names.append(m.group(1).strip())
+    return section_starts, section_names
+
+
+def _section_before(section_starts: list[int], section_names: list[str], pos: int) -> Optional[str]:
+    """Название последнего раздела, заголовок которого начинается до pos (None, если такого нет).
+
+    pos должен быть началом строки: тогда результат совпадает с поиском последнего
+    заголовка в content[:pos], но без прохода по всему префиксу.
+    """
+    idx = bisect_left(section_starts, pos) - 1
+    return section_names[idx] if idx >= 0 else None
+
+
+def _section_spans(content: str) -> tuple[list[int], list[int]]:
+    """Начала и концы совпадений _SECTION_RE (заголовков "# ...") в content."""
+    section_starts: list[int] = []
+    section_ends: list[int] = []
+    for m in _SECTION_RE.finditer(content):
+        section_starts.append(m.start())
+        section_ends.append(m.end())
+    return section_starts, section_ends
+
+
+def _section_span_before(section_starts: list[int], section_ends: list[int], pos: int) -> Optional[tuple[int, int]]:
+    """Границы последнего совпадения _SECTION_RE в content[:pos] (None, если его нет).
+
+    Результат тот же, что у поиска по срезу content[:pos], включая заголовок, обрезанный
+    позицией pos; название раздела - content[start + 2:end].
+    """
+    # В срезе заголовку нужны "# " и хотя бы один символ названия: start + 2 < pos
+    idx = bisect_left(section_starts, pos - 2) - 1
+    if idx < 0:
+        return None
+    return section_starts[idx], min(section_ends[idx], pos)
+
+
+def _section_name_before(content: str, section_starts: list[int], section_ends: list[int], pos: int) -> str:
+    """Название (strip) последнего раздела в content[:pos] или пустая строка."""
+    span = _section_span_before(section_starts, section_ends, pos)
+    return content[span[0] + 2:span[1]].strip() if span else ''
+
+
+def _next_section_start(text: str, pos: int) -> int:
+    """Начало первой строки "# " в text[pos:] (len(text), если её нет), без копии среза.
+
+    Как и при поиске по срезу, сама позиция pos считается началом строки.
+    """
+    if text.startswith('# ', pos):
+        return pos
+    match = _NEXT_SECTION_RE.search(text, pos)
+    return match.start() if match else len(text)
+
+
+def _trim_section_name(name: str) -> str:
+    """Название раздела - первая строка без "." на конце."""
+    if name.endswith('.'):
+        name = name[:-1].strip()
+    return name
+
+
+def _newline_positions(text: str) -> list[int]:
+    """Позиции всех переводов строки в text (по возрастанию)."""
+    return [m.start() for m in _NEWLINE_RE.finditer(text)]
+
+
+def _line_start(newlines: list[int], pos: int) -> int:
+    """Начало строки, содержащей pos: как text.rfind('\\n', 0, pos) + 1, но бинарным поиском."""
+    idx = bisect_left(newlines, pos) - 1
+    return newlines[idx] + 1 if idx >= 0 else 0
+
+
+def _line_end(newlines: list[int], pos: int) -> int:
+    """Первый перевод строки начиная с pos: как text.find('\\n', pos) (-1, если его нет)."""
+    idx = bisect_left(newlines, pos)
+    return newlines[idx] if idx < len(newlines) else -1
+
+
+def _stripped_end(text: str, start: int, end: int) -> int:
+    """Конец text[start:end].rstrip() в координатах text (без копии среза)."""
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def _list_end_before(text: str, base: int, limit: int) -> int:
+    """Конец последнего элемента списка, который заканчивается на "." и завершается до limit.
+
+    Элемент списка начинается строкой с "-" (после пробелов) и продолжается до следующей
+    такой строки; строки считаются от base. Элемент без следующей строки с "-" тянется
+    до конца текста и поэтому не подходит. Возвращает -1, если подходящего элемента нет.
+    """
+    first_line_end = text.find('\n', base)
+    if first_line_end == -1:
+        return -1
+    list_end_pos = -1
+    item_start = base if text[base:first_line_end].lstrip().startswith('-') else -1
+    for m in _LIST_ITEM_LINE_RE.finditer(text, first_line_end + 1):
+        line_start = m.start()
+        # Дальше элементы кончаются не раньше limit
+        if line_start > limit:
+            break
+        if item_start >= 0:
+            # Предыдущий элемент кончается переводом строки перед line_start
+            item_end = _stripped_end(text, item_start, line_start - 1)
+            if item_end > item_start and text[item_end - 1] == '.' and line_start - 1 < limit:
+                list_end_pos = line_start - 1
+        item_start = line_start
+    return list_end_pos
+
+
 def _extract_blocks_from_content(content: str) -> list[dict]:
     """
     Извлекает блоки из структурированного текста согласно новой структуре:
@@ -536,13 +821,14 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
     # Паттерн для поиска номеров: N. или N.N. или N.N.N. в начале строки
     # Исключаем номера в конце строки (они заканчиваются на ".")
     # Пункт начинается с номера в начале строки или после пробела/табуляции
-    point_pattern = re.compile(r'(?:^|\n)(\d{1,2}(?:\.\d+)*\.)\s+')
-    
-    matches = list(point_pattern.finditer(content_with_newlines))
+    matches = list(_POINT_RE.finditer(content_with_newlines))
     
     if not matches:
         return blocks
     
+    # Заголовки разделов находим один раз; раздел номера определяется бинарным поиском
+    section_starts, section_names = _build_section_index(content_with_newlines)
+    
     # Обрабатываем каждый найденный номер как начало блока
     for i, match in enumerate(matches):
         # КРИТИЧНО: Начало блока должно быть строго с начала строки, содержащей номер
@@ -557,7 +843,7 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
         line_before_number = content_with_newlines[line_start:match_start].strip()
         # Если перед номером есть непустой текст - это не начало блока, пропускаем
         # Исключение: если это перечисление (номер в скобках или после дефиса)
-        if line_before_number and not re.match(r'^[\s\-•\(\)]+$', line_before_number):
+        if line_before_number and not _ENUM_MARKER_RE.match(line_before_number):
             # Перед номером есть текст - это не начало блока пункта/подпункта
             # Пропускаем этот номер (возможно, это часть перечисления)
             continue
@@ -568,18 +854,9 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
         # Определяем, является ли это подпунктом (N.N или N.N.N)
         is_subpoint = number.count('.') > 1
         
-        # Находим раздел для этого блока СНАЧАЛА
-        before = content_with_newlines[:start]
-        section = ''
-        # Ищем последний маркер раздела "# ..."
-        section_match = list(re.finditer(r'^# ([^\n]+)', before, re.MULTILINE))
-        if section_match:
-            last_section = section_match[-1]
-            section_text = last_section.group(1).strip()
-            # Название раздела - первая строка без "." на конце
-            if section_text.endswith('.'):
-                section_text = section_text[:-1].strip()
-            section = section_text
+        # Находим раздел для этого блока СНАЧАЛА (последний маркер раздела "# ..." до номера)
+        section_text = _section_before(section_starts, section_names, start)
+        section = _trim_section_name(section_text) if section_text is not None else ''
         
         # КРИТИЧНО: Сначала проверяем границы раздела
         # Блок должен заканчиваться до начала следующего раздела (если он есть)
@@ -606,15 +883,8 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
             
             # Если следующий блок находится в другом разделе - блок должен заканчиваться до него
             # Находим раздел следующего блока
-            before_next = content_with_newlines[:next_start]
-            next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-            next_block_section = ''
-            if next_section_match:
-                last_next_section = next_section_match[-1]
-                next_section_text = last_next_section.group(1).strip()
-                if next_section_text.endswith('.'):
-                    next_section_text = next_section_text[:-1].strip()
-                next_block_section = next_section_text
+            next_section_text = _section_before(section_starts, section_names, next_start)
+            next_block_section = _trim_section_name(next_section_text) if next_section_text is not None else ''
             
             # Если следующий блок в другом разделе - блок должен заканчиваться до него
             if next_block_section and next_block_section != section:
@@ -628,11 +898,11 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
                 # Если следующий блок - подпункт текущего пункта
                 if next_first_part == current_point_num and next_number.count('.') > 1:
                     # Ищем первый подпункт - это будет конец блока пункта
-                    # Ищем паттерн "N.1." или "N.1.N" после текущего номера
-                    first_subpoint_pattern = re.compile(r'(?:^|\n)' + re.escape(current_point_num) + r'\.1\.')
-                    first_subpoint_match = first_subpoint_pattern.search(content_with_newlines, start)
-                    if first_subpoint_match:
-                        end = min(first_subpoint_match.start(), section_end_limit)
+                    # Ищем "N.1." или "N.1.N" в начале строки после текущего номера
+                    # (текст всегда начинается с "\n", поэтому достаточно поиска подстроки)
+                    first_subpoint_pos = content_with_newlines.find('\n' + current_point_num + '.1.', start)
+                    if first_subpoint_pos != -1:
+                        end = min(first_subpoint_pos, section_end_limit)
                     else:
                         end = min(next_start, section_end_limit)
                 else:
@@ -675,114 +945,36 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
             block_text = content_with_newlines[line_start_pos:end].strip()
         
         # КРИТИЧНО: Убеждаемся, что блок начинается строго с номера
-        # Проверяем первую строку и обрезаем все, что перед номером
-        lines = block_text.split('\n')
-        if not lines:
-            continue
-        
-        first_line = lines[0]
-        # Находим позицию номера в первой строке (без strip, чтобы сохранить пробелы)
-        number_pos = first_line.find(number)
-        if number_pos < 0:
-            # Номер не найден в первой строке - ошибка
-            continue
-        elif number_pos > 0:
-            # Перед номером есть текст - это остаток предыдущего блока
-            # Проверяем, является ли это частью перечисления (только маркеры)
-            text_before = first_line[:number_pos].strip()
-            is_enum_marker = re.match(r'^[\s\-•\(\)]+$', text_before) if text_before else False
-            
-            # КРИТИЧНО: По требованиям - перед номером пункта/подпункта не должно быть текста
-            # Исключение: только маркеры перечисления
-            # ВСЕГДА обрезаем текст перед номером, если это не маркер перечисления
-            if not is_enum_marker:
-                # Это не маркер перечисления - обрезаем первую строку до номера
-                first_line = first_line[number_pos:]
-                lines[0] = first_line
-                block_text = '\n'.join(lines).strip()
-            else:
-                # Это маркер перечисления - тоже обрезаем, так как перед номером пункта/подпункта не должно быть ничего
-                first_line = first_line[number_pos:]
-                lines[0] = first_line
-                block_text = '\n'.join(lines).strip()
-        else:
-            # Номер в начале строки - это правильно
-            # Убеждаемся, что нет пробелов перед номером
-            first_line_stripped = first_line.strip()
-            if not first_line_stripped.startswith(number):
-                # Есть пробелы перед номером - удаляем их
-                first_line = first_line.lstrip()
-                if first_line.startswith(number):
-                    lines[0] = first_line
-                    block_text = '\n'.join(lines).strip()
-                else:
-                    # Номер не найден после удаления пробелов - ошибка
-                    continue
-            else:
-                block_text = '\n'.join(lines).strip()
-        
-        # ФИНАЛЬНАЯ ПРОВЕРКА: блок должен начинаться строго с номера
-        if not block_text.strip().startswith(number):
+        # Обрезаем все, что перед номером в первой строке (в том числе маркеры перечисления)
+        block_text = _trim_to_number(block_text, number)
+        if block_text is None or not block_text.startswith(number):
             continue
         
         # Удаляем маркеры следующих разделов из конца блока
-        # Блок не должен содержать маркер следующего раздела "# ..."
-        lines = block_text.split('\n')
-        cleaned_lines = []
-        for line in lines:
-            stripped = line.strip()
-            # Если строка начинается с маркера раздела "# " - это конец блока
-            if stripped.startswith('# '):
-                break
-            cleaned_lines.append(line)
-        block_text = '\n'.join(cleaned_lines).strip()
+        # Блок не должен содержать маркер следующего раздела "# ..." - с него начинается конец блока
+        next_section_line = _SECTION_LINE_RE.search(block_text)
+        if next_section_line:
+            block_text = block_text[:next_section_line.start()].strip()
         
         # ФИНАЛЬНАЯ ПРОВЕРКА: блок должен начинаться с правильного номера
         # И не должен содержать текст из предыдущего блока
-        block_text_stripped = block_text.strip()
-        if not block_text_stripped.startswith(number):
-            # Блок все еще не начинается с правильного номера - пропускаем его
+        if not block_text.startswith(number):
             continue
         
         # ФИНАЛЬНАЯ ПРОВЕРКА: убеждаемся, что первая строка начинается строго с номера
-        # ВСЕГДА обрезаем любой текст перед номером в первой строке
-        lines_final = block_text.split('\n')
-        if lines_final:
-            first_line_final = lines_final[0]
-            # Находим позицию номера в первой строке
-            number_pos_final = first_line_final.find(number)
-            if number_pos_final < 0:
-                # Номер не найден - пропускаем блок
-                continue
-            elif number_pos_final > 0:
-                # Перед номером есть текст - ВСЕГДА обрезаем его
-                # По требованиям: перед номером пункта/подпункта не должно быть текста
-                first_line_final = first_line_final[number_pos_final:]
-                lines_final[0] = first_line_final
-                block_text = '\n'.join(lines_final).strip()
-            else:
-                # Номер в начале строки - удаляем пробелы перед ним
-                first_line_final = first_line_final.lstrip()
-                if first_line_final.startswith(number):
-                    lines_final[0] = first_line_final
-                    block_text = '\n'.join(lines_final).strip()
-                else:
-                    # Номер не найден после удаления пробелов - пропускаем блок
-                    continue
-        
-        # ФИНАЛЬНАЯ ПРОВЕРКА: блок должен начинаться строго с номера
-        if not block_text.strip().startswith(number):
+        block_text = _trim_to_number(block_text, number)
+        if block_text is None or not block_text.startswith(number):
             continue
         
         # ДОПОЛНИТЕЛЬНАЯ ПРОВЕРКА: блок не должен содержать текст с другим номером перед правильным номером
         # Проверяем первые строки блока на наличие других номеров пунктов/подпунктов
-        lines_check = block_text.split('\n')
+        lines_check = block_text.split('\n', 3)
         for line_idx, line in enumerate(lines_check[:3]):  # Проверяем первые 3 строки
             stripped_line = line.strip()
             if not stripped_line:
                 continue
             # Ищем номер пункта/подпункта в строке (паттерн: N. или N.N. или N.N.N.)
-            other_number_match = re.match(r'^(\d+(?:\.\d+)*\.)\s+', stripped_line)
+            other_number_match = _LEADING_NUMBER_RE.match(stripped_line)
             if other_number_match:
                 found_number = other_number_match.group(1)
                 # Если найденный номер отличается от номера блока
@@ -811,22 +1003,61 @@ def _extract_blocks_from_content(content: str) -> list[dict]:
     return blocks
 
 
+def _trim_to_number(block_text: str, number: str) -> Optional[str]:
+    """Обрезает текст перед номером в первой строке блока (результат без пробелов по краям).
+
+    Возвращает None, если номера в первой строке нет.
+    """
+    newline_pos = block_text.find('\n')
+    first_line = block_text if newline_pos == -1 else block_text[:newline_pos]
+    number_pos = first_line.find(number)
+    if number_pos < 0:
+        return None
+    return block_text[number_pos:].strip()
+
+
+def _cut_block_at_number(block_text: str, number: str) -> Optional[str]:
+    """Обрезает блок пункта до его номера (результат без пробелов по краям).
+
+    Возвращает None, если номера в первой строке нет или перед ним стоит другой номер пункта.
+    """
+    # Первую строку отделяем от остатка блока без разбиения всего блока на строки
+    first_line, newline, rest = block_text.partition('\n')
+    first_line = first_line.strip()
+    if not first_line.startswith(number + ' '):
+        number_pos_in_first = first_line.find(number)
+        if number_pos_in_first <= 0:
+            return None
+        text_before_number = first_line[:number_pos_in_first].strip()
+        # Номер пункта сам подходит под _INLINE_POINT_RE, поэтому этот поиск покрывает
+        # и случай "тот же номер перед номером"
+        if text_before_number and _INLINE_POINT_RE.search(text_before_number):
+            return None
+        first_line = first_line[number_pos_in_first:].strip()
+        block_text = (first_line + newline + rest).strip()
+    
+    if not block_text.startswith(number):
+        number_pos = block_text.find(number)
+        if number_pos < 0:
+            return None
+        text_before = block_text[:number_pos].strip()
+        if text_before and _INLINE_POINT_RE.search(text_before):
+            return None
+        block_text = block_text[number_pos:].strip()
+    
+    if not block_text.partition('\n')[0].strip().startswith(number):
+        return None
+    return block_text
+
+
 def _block_has_content(block: dict) -> bool:
-    """Проверяет, содержит ли блок полезный текст (не только заголовки)."""
-    # Проверяем, что блок не пустой
-    if not block['text'].strip():
-        return False
-    # Проверяем, что в блоке есть хотя бы одно слово, отличное от заголовка
-    # Исключаем заголовки, которые могут быть в начале блока
-    if block['section'] and block['section'].lower() in ['глава', 'раздел', 'пункт', 'подпункт', 'абзац', 'часть']:
-        # Ищем слова, которые не являются заголовками
-        words = re.findall(r'\b\w+\b', block['text'])
-        if words:
-            # Проверяем, есть ли среди слов хоть одно, которое не является заголовком
-            # (например, '1.1.1' или '1.1.1.1')
-            if not any(re.match(r'\d+\.\d+\.\d+', w) for w in words):
-                return True
-    return True
+    """Проверяет, содержит ли блок полезный текст (не только пробельные символы).
+
+    Дополнительная проверка блоков разделов "глава"/"пункт"/... на слова-номера
+    результат не меняла (обе её ветки возвращали True) и убрана вместе с findall по тексту.
+    """
+    text = block['text']
+    return bool(text) and not text.isspace()
 
 
 def _collect_candidate_docs(hits, allowed_sources, lwquery):
@@ -844,65 +1075,98 @@ def _collect_candidate_docs(hits, allowed_sources, lwquery):
                 candidate_docs.append(src)
     
     # Сортируем документы: сначала "Международные правила" (2.1.1_), затем "Правила Корона" (2.1.2_), затем остальные
-    def _sort_key(doc: str) -> tuple[int, str]:
-        """Возвращает ключ сортировки для документа."""
-        if doc.startswith("2.1.1_"):
-            return (0, doc)  # Международные правила - первый приоритет
-        elif doc.startswith("2.1.2_"):
-            return (1, doc)  # Правила Корона - второй приоритет
-        else:
-            return (2, doc)  # Остальные - третий приоритет
-    
-    candidate_docs.sort(key=_sort_key)
+    candidate_docs.sort(key=_DOC_SORT_KEYS.__getitem__)
     return candidate_docs
 
 
+class _StructuredDoc(NamedTuple):
+    """Структурированный документ, подготовленный для _collect_fragments_*."""
+    text: str  # Текст с "\n" перед каждым "###" и в начале
+    text_lower: str  # text.lower() (та же длина, позиции совпадают)
+    newlines: list[int]  # Позиции переводов строки в text
+    points: list[re.Match]  # Номера пунктов (_POINT_RE)
+    point_starts: list[int]  # Позиции номеров пунктов (start(1)), по возрастанию
+    point_numbers: list[str]  # Номера пунктов ("1.2.")
+    point_levels: list[int]  # Уровни пунктов: "1." - 1, "1.2." - 2
+    point_section_ids: list[int]  # Номер раздела каждого пункта из points (по section_ids)
+    section_ids: dict[str, int]  # Название раздела -> номер
+    section_starts: list[int]  # Начала заголовков "# ..."
+    section_ends: list[int]  # Концы заголовков "# ..."
+
+
+def _build_structured_doc(content: str) -> _StructuredDoc:
+    """Размечает текст документа: переводы строк, пункты и разделы."""
+    text = content.replace('###', '\n###')
+    if not text.startswith('\n'):
+        text = '\n' + text
+    points = list(_POINT_RE.finditer(text))
+    section_starts, section_ends = _section_spans(text)
+    # Раздел каждого пункта - бинарным поиском по заголовкам, без прохода по префиксу текста;
+    # одинаковые названия получают один номер, чтобы в циклах сравнивать числа, а не строки
+    section_ids: dict[str, int] = {}
+    point_section_ids = [
+        section_ids.setdefault(
+            _section_name_before(text, section_starts, section_ends, point_match.start(1)),
+            len(section_ids),
+        )
+        for point_match in points
+    ]
+    # Номер пункта - группа _POINT_RE без пробелов с одной точкой в конце,
+    # поэтому его уровень равен числу точек
+    point_numbers = [m.group(1) for m in points]
+    return _StructuredDoc(
+        text,
+        text.lower(),
+        _newline_positions(text),
+        points,
+        [m.start(1) for m in points],
+        point_numbers,
+        [number.count('.') for number in point_numbers],
+        point_section_ids,
+        section_ids,
+        section_starts,
+        section_ends,
+    )
+
+
+@lru_cache(maxsize=16)
+def _load_structured_doc(path: str, mtime_ns: int) -> _StructuredDoc:
+    """Читает и размечает документ; mtime входит в ключ кеша и сбрасывает его при изменении файла."""
+    with open(path, encoding="utf-8") as f:
+        return _build_structured_doc(f.read())
+
+
 def _collect_fragments(candidate_docs, search_words, max_fragments, phrases=None):
     """
     Маршрутизатор для формирования окон первоисточника.
     Определяет тип документа и вызывает соответствующую специализированную функцию.
     """
-    structured_dir = os.path.join(os.path.dirname(__file__), "data", "structured")
-    fragments: list[dict] = []
     phrases = [p for p in (phrases or []) if p] if phrases else []
-    
-    # Константы для определения типа документа
-    INTERNATIONAL_RULES = "2.1.1_Международные правила_structured.txt"
-    CORONA_RULES = "2.1.2_Правила игры Корона_structured.txt"
-    TECHNICAL_REQUIREMENTS = "2.2_Технические требования к бильярдным столам и оборудованию ФБСР_structured.txt"
-    
+    # Специализированные функции - генераторы: после max_fragments фрагментов islice
+    # перестаёт их продолжать, и оставшиеся позиции и документы не обрабатываются
+    fragments = list(islice(_iter_fragments(candidate_docs, search_words, phrases), max_fragments))
+    return _sort_and_return_fragments(fragments)
+
+
+def _iter_fragments(candidate_docs, search_words, phrases) -> Iterator[dict]:
+    """Фрагменты документов-первоисточников по порядку candidate_docs."""
+    structured_dir = os.path.join(os.path.dirname(__file__), "data", "structured")
     for doc in candidate_docs:
-        path = os.path.join(structured_dir, doc)
-        if not os.path.exists(path):
+        # Определяем тип документа по таблице специализированных функций
+        collector = _FRAGMENT_COLLECTORS.get(doc)
+        if collector is None:
+            # Для других документов пропускаем (если понадобится - добавим отдельную функцию)
             continue
         
-        with open(path, encoding="utf-8") as f:
-            content = f.read()
-        
-        # Для каждого документа используем отдельный processed_blocks, чтобы избежать конфликтов
-        processed_blocks = set()
-        
-        # Определяем тип документа и вызываем соответствующую функцию
-        if doc == TECHNICAL_REQUIREMENTS:
-            fragments = _collect_fragments_technical_requirements(
-                content, doc, search_words, phrases, max_fragments, fragments, processed_blocks
-            )
-        elif doc == CORONA_RULES:
-            fragments = _collect_fragments_corona_rules(
-                content, doc, search_words, phrases, max_fragments, fragments, processed_blocks
-            )
-        elif doc == INTERNATIONAL_RULES:
-            fragments = _collect_fragments_international_rules(
-                content, doc, search_words, phrases, max_fragments, fragments, processed_blocks
-            )
-        else:
-            # Для других документов пропускаем (если понадобится - добавим отдельную функцию)
+        path = os.path.join(structured_dir, doc)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
             continue
         
-        if len(fragments) >= max_fragments:
-            return _sort_and_return_fragments(fragments)
-    
-    return _sort_and_return_fragments(fragments)
+        # Файл читается и размечается один раз, пока не изменится его mtime
+        structured = _load_structured_doc(path, mtime)
+        yield from collector(structured, doc, search_words, phrases)
 
 
 # Старая универсальная логика удалена - теперь используются специализированные функции для каждого документа
@@ -918,109 +1182,92 @@ def _collect_fragments(candidate_docs, search_words, max_fragments, phrases=None
 
 
 
-def _collect_fragments_technical_requirements(content, doc, search_words, phrases, max_fragments, fragments, processed_blocks):
+def _find_relevant_positions(text_lower: str, search_words, phrases) -> list[int]:
+    """Позиции вхождений поисковых слов и фраз в text_lower, по возрастанию и без повторов.
+
+    Слова и фразы уже в нижнем регистре (get_primary_source_fragments берёт их из lower() запроса).
+    """
+    # Множество: одна позиция может найтись по нескольким словам и фразам
+    found_positions: set[int] = set()
+    for pattern in (search_words or []) + (phrases or []):
+        pos = 0
+        while True:
+            pos = text_lower.find(pattern, pos)
+            if pos == -1:
+                break
+            found_positions.add(pos)
+            pos += len(pattern)
+    return sorted(found_positions)
+
+
+def _collect_fragments_technical_requirements(structured, doc, search_words, phrases) -> Iterator[dict]:
     """
     Специализированная логика для 2.2_Технические требования к бильярдным столам и оборудованию ФБСР_structured.txt
     Сохраняет текущую работающую логику для этого документа
+    Генератор: фрагменты выдаются по одному, лимит задаёт вызывающий код (_collect_fragments).
     """
-    # Подготавливаем контент для поиска
-    content_with_newlines = content.replace('###', '\n###')
-    if not content_with_newlines.startswith('\n'):
-        content_with_newlines = '\n' + content_with_newlines
+    # Номера уже выданных блоков (свои для каждого документа)
+    processed_blocks: set[str] = set()
+    # Текст и его разметка подготовлены заранее (_load_structured_doc)
+    content_with_newlines = structured.text
+    newlines = structured.newlines
     
     # ШАГ 1: Находим все релевантные фрагменты (где есть поисковые слова)
-    content_lower = content_with_newlines.lower()
-    relevant_positions = []
-    
-    if search_words:
-        for word in search_words:
-            pos = 0
-            while True:
-                pos = content_lower.find(word, pos)
-                if pos == -1:
-                    break
-                relevant_positions.append(pos)
-                pos += len(word)
-    
-    if phrases:
-        for phrase in phrases:
-            pos = 0
-            while True:
-                pos = content_lower.find(phrase, pos)
-                if pos == -1:
-                    break
-                relevant_positions.append(pos)
-                pos += len(phrase)
-    
+    content_lower = structured.text_lower
+    relevant_positions = _find_relevant_positions(content_lower, search_words, phrases)
     if not relevant_positions:
-        return fragments
-    
-    # Сортируем позиции и убираем дубликаты
-    relevant_positions = sorted(set(relevant_positions))
+        return
     
     # ШАГ 2: Для каждой релевантной позиции находим ближайший номер пункта/подпункта СВЕРХУ
-    point_pattern = re.compile(r'(?:^|\n)(\d{1,2}(?:\.\d+)*\.)\s+')
-    all_points = list(point_pattern.finditer(content_with_newlines))
+    all_points = structured.points
+    point_section_ids = structured.point_section_ids
+    section_ids = structured.section_ids
+    point_starts = structured.point_starts
+    section_starts = structured.section_starts
+    section_ends = structured.section_ends
     
     for rel_pos in relevant_positions:
         # КРИТИЧНО: Сначала находим раздел для релевантной позиции
-        before_rel_pos = content_with_newlines[:rel_pos]
-        section_match_rel = list(re.finditer(r'^# ([^\n]+)', before_rel_pos, re.MULTILINE))
-        rel_section = section_match_rel[-1].group(1).strip() if section_match_rel else ''
+        rel_span = _section_span_before(section_starts, section_ends, rel_pos)
+        rel_section = content_with_newlines[rel_span[0] + 2:rel_span[1]].strip() if rel_span else ''
+        # Разделы пунктов сравниваются по номерам (-1 - названия нет ни у одного пункта)
+        rel_section_id = section_ids.get(rel_section, -1)
         
         # Находим границы раздела для релевантной позиции
-        section_start = 0
-        if section_match_rel:
-            section_start = section_match_rel[-1].start(0)
+        section_start = rel_span[0] if rel_span else 0
         
-        section_end = len(content_with_newlines)
-        next_section_match = re.search(r'^# ', content_with_newlines[rel_pos:], re.MULTILINE)
-        if next_section_match:
-            section_end = rel_pos + next_section_match.start()
+        section_end = _next_section_start(content_with_newlines, rel_pos)
         
         # Находим ближайший номер пункта СВЕРХУ от релевантной позиции
         nearest_point = None
-        nearest_point_pos = -1
-        
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            if point_pos <= rel_pos and point_pos >= section_start:
-                before_point = content_with_newlines[:point_pos]
-                point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                
-                if point_section == rel_section:
-                    if point_pos > nearest_point_pos:
-                        nearest_point_pos = point_pos
-                        nearest_point = point_match
+        
+        # Кандидаты - только пункты от начала раздела до позиции (границы - бинарным поиском);
+        # идём снизу вверх, и первый пункт того же раздела - ближайший
+        for point_idx in reversed(range(bisect_left(point_starts, section_start), bisect_right(point_starts, rel_pos))):
+            if point_section_ids[point_idx] == rel_section_id:
+                nearest_point = all_points[point_idx]
+                break
         
         # КРИТИЧНО: Если не нашли номер СВЕРХУ, но релевантная позиция в разделе,
         # проверяем, есть ли номера НИЖЕ в этом разделе
         if not nearest_point:
             first_point_below = None
-            first_point_below_pos = sys.maxsize
             
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos > rel_pos and point_pos < section_end:
-                    before_point = content_with_newlines[:point_pos]
-                    point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                    point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                    
-                    if point_section == rel_section:
-                        if point_pos < first_point_below_pos:
-                            first_point_below_pos = point_pos
-                            first_point_below = point_match
+            # Кандидаты - только пункты после позиции до конца раздела; первый пункт того же раздела - ближайший
+            for point_idx in range(bisect_right(point_starts, rel_pos), bisect_left(point_starts, section_end)):
+                if point_section_ids[point_idx] == rel_section_id:
+                    first_point_below = all_points[point_idx]
+                    break
             
             if first_point_below:
                 number = first_point_below.group(1).strip()
                 number_start = first_point_below.start(1)
                 
-                line_start_first = content_with_newlines.rfind('\n', 0, number_start) + 1
+                line_start_first = _line_start(newlines, number_start)
                 if line_start_first == 0 and not content_with_newlines.startswith('\n'):
                     line_start_first = 0
                 
-                line_end_first = content_with_newlines.find('\n', number_start)
+                line_end_first = _line_end(newlines, number_start)
                 if line_end_first < 0:
                     line_end_first = len(content_with_newlines)
                 first_line_with_number = content_with_newlines[number_start:line_end_first].strip()
@@ -1028,10 +1275,10 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
                 
                 if is_list_item:
                     # Это список - формируем блок от начала вводного текста до конца списка
-                    section_header_match = list(re.finditer(r'^# ([^\n]+)', content_with_newlines[:rel_pos], re.MULTILINE))
-                    if section_header_match:
-                        section_header_end = section_header_match[-1].end()
-                        section_content_start = content_with_newlines.find('\n', section_header_end)
+                    # Заголовок раздела релевантной позиции уже найден выше (rel_span)
+                    if rel_span:
+                        section_header_end = rel_span[1]
+                        section_content_start = _line_end(newlines, section_header_end)
                         if section_content_start >= 0:
                             section_content_start += 1
                         else:
@@ -1042,32 +1289,29 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
                     list_end = section_end
                     last_list_item_pos = number_start
                     
-                    for point_match in all_points:
-                        point_pos = point_match.start(1)
-                        if point_pos > last_list_item_pos and point_pos < section_end:
-                            before_point = content_with_newlines[:point_pos]
-                            point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                            point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                            
-                            if point_section == rel_section:
-                                line_end_point = content_with_newlines.find('\n', point_pos)
-                                if line_end_point < 0:
-                                    line_end_point = len(content_with_newlines)
-                                line_with_point = content_with_newlines[point_pos:line_end_point].strip()
-                                if line_with_point.endswith('.'):
-                                    last_list_item_pos = point_pos
-                                    line_end_item = content_with_newlines.find('\n', point_pos)
-                                    if line_end_item < 0:
-                                        line_end_item = len(content_with_newlines)
-                                    list_end = line_end_item
-                                else:
-                                    break
+                    for point_idx in range(bisect_right(point_starts, last_list_item_pos), bisect_left(point_starts, section_end)):
+                        point_pos = point_starts[point_idx]
+                        if point_section_ids[point_idx] == rel_section_id:
+                            line_end_point = _line_end(newlines, point_pos)
+                            if line_end_point < 0:
+                                line_end_point = len(content_with_newlines)
+                            line_with_point = content_with_newlines[point_pos:line_end_point].strip()
+                            if line_with_point.endswith('.'):
+                                last_list_item_pos = point_pos
+                                line_end_item = _line_end(newlines, point_pos)
+                                if line_end_item < 0:
+                                    line_end_item = len(content_with_newlines)
+                                list_end = line_end_item
+                            else:
+                                break
                 
                     start = section_content_start
                     end = list_end
                     block_text = content_with_newlines[start:end].strip()
                     
-                    block_text_lower = block_text.lower()
+                    # Срез заранее приведённого к нижнему регистру текста вместо lower() блока:
+                    # пробелы по краям на проверку вхождения слов не влияют
+                    block_text_lower = content_lower[start:end]
                     has_search_word = False
                     if search_words:
                         has_search_word = any(w in block_text_lower for w in search_words)
@@ -1086,14 +1330,14 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
                             'found_phrases': phrases if phrases else [],
                             '_position': start,
                         }
-                        fragments.append(fragment)
                         print(f"[DEBUG] Фрагмент из технических требований (вводный текст раздела со списком): раздел={section}, позиция={start}, текст (первые 200 символов)={block_text[:200]}")
+                        yield fragment
                 else:
                     # Это не список, а обычный пункт - формируем блок от начала раздела до этого пункта
-                    section_header_match = list(re.finditer(r'^# ([^\n]+)', content_with_newlines[:rel_pos], re.MULTILINE))
-                    if section_header_match:
-                        section_header_end = section_header_match[-1].end()
-                        section_content_start = content_with_newlines.find('\n', section_header_end)
+                    # Заголовок раздела релевантной позиции уже найден выше (rel_span)
+                    if rel_span:
+                        section_header_end = rel_span[1]
+                        section_content_start = _line_end(newlines, section_header_end)
                         if section_content_start >= 0:
                             section_content_start += 1
                         else:
@@ -1104,7 +1348,9 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
                     start = section_content_start
                     end = number_start
                     block_text = content_with_newlines[start:end].strip()
-                    block_text_lower = block_text.lower()
+                    # Срез заранее приведённого к нижнему регистру текста вместо lower() блока:
+                    # пробелы по краям на проверку вхождения слов не влияют
+                    block_text_lower = content_lower[start:end]
                     has_search_word = False
                     if search_words:
                         has_search_word = any(w in block_text_lower for w in search_words)
@@ -1123,8 +1369,8 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
                             'found_phrases': phrases if phrases else [],
                             '_position': start,
                         }
-                        fragments.append(fragment)
                         print(f"[DEBUG] Фрагмент из технических требований (вводный текст раздела): раздел={section}, позиция={start}, текст (первые 100 символов)={block_text[:100]}")
+                        yield fragment
             
             continue
         
@@ -1137,11 +1383,11 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
         
         # КРИТИЧНО: Проверяем, является ли найденный номер элементом списка
         # Если да, и релевантная позиция находится в этом списке, извлекаем весь список с приамбулой
-        line_start_check = content_with_newlines.rfind('\n', 0, number_start) + 1
+        line_start_check = _line_start(newlines, number_start)
         if line_start_check == 0 and not content_with_newlines.startswith('\n'):
             line_start_check = 0
         
-        line_end_check = content_with_newlines.find('\n', number_start)
+        line_end_check = _line_end(newlines, number_start)
         if line_end_check < 0:
             line_end_check = len(content_with_newlines)
         line_with_number_check = content_with_newlines[number_start:line_end_check].strip()
@@ -1150,10 +1396,10 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
         # Если это элемент списка и релевантная позиция находится в этом списке
         if is_list_item:
             # Находим начало приамбулы (после заголовка раздела)
-            section_header_match = list(re.finditer(r'^# ([^\n]+)', content_with_newlines[:rel_pos], re.MULTILINE))
-            if section_header_match:
-                section_header_end = section_header_match[-1].end()
-                section_content_start = content_with_newlines.find('\n', section_header_end)
+            # Заголовок раздела релевантной позиции уже найден выше (rel_span)
+            if rel_span:
+                section_header_end = rel_span[1]
+                section_content_start = _line_end(newlines, section_header_end)
                 if section_content_start >= 0:
                     section_content_start += 1
                 else:
@@ -1166,52 +1412,46 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
             first_list_item_pos = number_start
             
             # Находим первый элемент списка в этом разделе
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos < number_start and point_pos >= section_start:
-                    before_point = content_with_newlines[:point_pos]
-                    point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                    point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                    if point_section == rel_section:
-                        line_end_point = content_with_newlines.find('\n', point_pos)
-                        if line_end_point < 0:
-                            line_end_point = len(content_with_newlines)
-                        line_with_point = content_with_newlines[point_pos:line_end_point].strip()
-                        if line_with_point.endswith('.'):
-                            first_list_item_pos = point_pos
-                        break
+            for point_idx in range(bisect_left(point_starts, section_start), bisect_left(point_starts, number_start)):
+                point_pos = point_starts[point_idx]
+                if point_section_ids[point_idx] == rel_section_id:
+                    line_end_point = _line_end(newlines, point_pos)
+                    if line_end_point < 0:
+                        line_end_point = len(content_with_newlines)
+                    line_with_point = content_with_newlines[point_pos:line_end_point].strip()
+                    if line_with_point.endswith('.'):
+                        first_list_item_pos = point_pos
+                    break
             
             # Находим последний элемент списка
             last_list_item_pos = number_start
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos > last_list_item_pos and point_pos < section_end:
-                    before_point = content_with_newlines[:point_pos]
-                    point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                    point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                    if point_section == rel_section:
-                        line_end_point = content_with_newlines.find('\n', point_pos)
-                        if line_end_point < 0:
-                            line_end_point = len(content_with_newlines)
-                        line_with_point = content_with_newlines[point_pos:line_end_point].strip()
-                        if line_with_point.endswith('.'):
-                            last_list_item_pos = point_pos
-                            # Находим конец строки с этим элементом (включая перенос строки)
-                            line_end_item = content_with_newlines.find('\n', point_pos)
-                            if line_end_item < 0:
-                                line_end_item = len(content_with_newlines)
-                            else:
-                                line_end_item += 1  # Включаем перенос строки
-                            list_end = line_end_item
+            for point_idx in range(bisect_right(point_starts, last_list_item_pos), bisect_left(point_starts, section_end)):
+                point_pos = point_starts[point_idx]
+                if point_section_ids[point_idx] == rel_section_id:
+                    line_end_point = _line_end(newlines, point_pos)
+                    if line_end_point < 0:
+                        line_end_point = len(content_with_newlines)
+                    line_with_point = content_with_newlines[point_pos:line_end_point].strip()
+                    if line_with_point.endswith('.'):
+                        last_list_item_pos = point_pos
+                        # Находим конец строки с этим элементом (включая перенос строки)
+                        line_end_item = _line_end(newlines, point_pos)
+                        if line_end_item < 0:
+                            line_end_item = len(content_with_newlines)
                         else:
-                            break
+                            line_end_item += 1  # Включаем перенос строки
+                        list_end = line_end_item
+                    else:
+                        break
             
             start = section_content_start
             end = list_end
             block_text = content_with_newlines[start:end].strip()
             
             # Проверяем, что блок содержит поисковые слова
-            block_text_lower = block_text.lower()
+            # Срез заранее приведённого к нижнему регистру текста вместо lower() блока:
+            # пробелы по краям на проверку вхождения слов не влияют
+            block_text_lower = content_lower[start:end]
             has_search_word = False
         if search_words:
             has_search_word = any(w in block_text_lower for w in search_words)
@@ -1230,200 +1470,56 @@ def _collect_fragments_technical_requirements(content, doc, search_words, phrase
                     'found_phrases': phrases if phrases else [],
                     '_position': start,
                 }
-                fragments.append(fragment)
                 print(f"[DEBUG] Фрагмент из технических требований (список с приамбулой): раздел={section}, позиция={start}, текст (первые 200 символов)={block_text[:200]}")
-        
-        if len(fragments) >= max_fragments:
-            return fragments
-        
-        continue
-        
-        # Если это не элемент списка, используем обычную логику
-        line_start = content_with_newlines.rfind('\n', 0, number_start) + 1
-        if line_start == 0 and not content_with_newlines.startswith('\n'):
-            line_start = 0
-        
-        line_with_number = content_with_newlines[line_start:number_start + len(number) + 10]
-        if not line_with_number.strip().startswith(number):
-            number_pos_in_line = line_with_number.find(number)
-            if number_pos_in_line >= 0:
-                line_start = line_start + number_pos_in_line
-            else:
-                continue
-        
-        start = line_start
-        end = section_end
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            if point_pos > start and point_pos < section_end:
-                before_next = content_with_newlines[:point_pos]
-                next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                if next_section == rel_section:
-                    end = point_pos
-                    break
-        
-        block_text = content_with_newlines[start:end].strip()
-        
-        if start < section_start:
-            continue
-        
-        section_markers_in_block = list(re.finditer(r'^# ', block_text, re.MULTILINE))
-        if section_markers_in_block and section_markers_in_block[0].start() > 0:
-            continue
-        
-        lines = block_text.split('\n')
-        if lines:
-            first_line = lines[0].strip()
-            if first_line.startswith(number + ' '):
-                pass
-            elif number in first_line:
-                number_pos_in_first = first_line.find(number)
-                if number_pos_in_first > 0:
-                    text_before_number = first_line[:number_pos_in_first].strip()
-                    if text_before_number:
-                        same_number_pattern = re.compile(r'^' + re.escape(number) + r'\s+')
-                        same_number_before = same_number_pattern.match(text_before_number)
-                        if same_number_before:
-                            continue
-                        other_number_match = re.search(r'(\d{1,2}(?:\.\d+)*\.)\s+', text_before_number)
-                        if other_number_match:
-                            continue
-                    first_line = first_line[number_pos_in_first:].strip()
-                    lines[0] = first_line
-                    block_text = '\n'.join(lines).strip()
-                else:
-                    continue
-            else:
-                continue
-        
-        if not block_text.startswith(number):
-            number_pos = block_text.find(number)
-            if number_pos >= 0:
-                text_before = block_text[:number_pos].strip()
-                if text_before:
-                    other_number_match = re.search(r'(\d{1,2}(?:\.\d+)*\.)\s+', text_before)
-                    if other_number_match:
-                        continue
-                block_text = block_text[number_pos:].strip()
-            else:
-                continue
-        
-        first_line_final = block_text.split('\n')[0].strip()
-        if not first_line_final.startswith(number):
-            continue
-        
-        block_text_lower = block_text.lower()
-        has_search_word = False
-        if search_words:
-            has_search_word = any(w in block_text_lower for w in search_words)
-        if phrases:
-            has_search_word = has_search_word or all(p in block_text_lower for p in phrases)
-        
-        if not has_search_word:
-                continue
-            
-        before = content_with_newlines[:start]
-        section = ''
-        section_match = list(re.finditer(r'^# ([^\n]+)', before, re.MULTILINE))
-        if section_match:
-            last_section = section_match[-1]
-            section_text = last_section.group(1).strip()
-            if section_text.endswith('.'):
-                section_text = section_text[:-1].strip()
-            section = section_text
-        
-        processed_blocks.add(number)
-        fragment = {
-            'source': doc,
-            'section': section,
-            'text': block_text,
-            'rule_number': number,
-            'rule_label': '',
-            'found_words': search_words if search_words else [],
-            'found_phrases': phrases if phrases else [],
-            '_position': start,
-        }
-        fragments.append(fragment)
-        print(f"[DEBUG] Фрагмент из технических требований: номер={number}, позиция={start}, раздел={section}, текст (первые 100 символов)={block_text[:100]}")
-        
-        if len(fragments) >= max_fragments:
-            return fragments
-    
-    return fragments
+                yield fragment
 
 
-def _collect_fragments_corona_rules(content, doc, search_words, phrases, max_fragments, fragments, processed_blocks):
+def _collect_fragments_corona_rules(structured, doc, search_words, phrases) -> Iterator[dict]:
     """
     Специализированная логика для 2.1.2_Правила игры Корона_structured.txt
     Сохраняет текущую работающую логику для этого документа
+    Генератор: фрагменты выдаются по одному, лимит задаёт вызывающий код (_collect_fragments).
     """
-    # Подготавливаем контент для поиска
-    content_with_newlines = content.replace('###', '\n###')
-    if not content_with_newlines.startswith('\n'):
-        content_with_newlines = '\n' + content_with_newlines
+    # Номера уже выданных блоков (свои для каждого документа)
+    processed_blocks: set[str] = set()
+    # Текст и его разметка подготовлены заранее (_load_structured_doc)
+    content_with_newlines = structured.text
+    newlines = structured.newlines
         
     # ШАГ 1: Находим все релевантные фрагменты
-    content_lower = content_with_newlines.lower()
-    relevant_positions = []
-    
-    if search_words:
-        for word in search_words:
-            pos = 0
-            while True:
-                pos = content_lower.find(word, pos)
-                if pos == -1:
-                    break
-                relevant_positions.append(pos)
-                pos += len(word)
-    
-    if phrases:
-        for phrase in phrases:
-            pos = 0
-            while True:
-                pos = content_lower.find(phrase, pos)
-                if pos == -1:
-                    break
-                relevant_positions.append(pos)
-                pos += len(phrase)
-    
+    content_lower = structured.text_lower
+    relevant_positions = _find_relevant_positions(content_lower, search_words, phrases)
     if not relevant_positions:
-        return fragments
-    
-    relevant_positions = sorted(set(relevant_positions))
+        return
     
     # ШАГ 2: Для каждой релевантной позиции находим ближайший номер пункта/подпункта СВЕРХУ
-    point_pattern = re.compile(r'(?:^|\n)(\d{1,2}(?:\.\d+)*\.)\s+')
-    all_points = list(point_pattern.finditer(content_with_newlines))
+    all_points = structured.points
+    point_section_ids = structured.point_section_ids
+    section_ids = structured.section_ids
+    point_starts = structured.point_starts
+    point_numbers = structured.point_numbers
+    point_levels = structured.point_levels
+    section_starts = structured.section_starts
+    section_ends = structured.section_ends
     
     for rel_pos in relevant_positions:
-        before_rel_pos = content_with_newlines[:rel_pos]
-        section_match_rel = list(re.finditer(r'^# ([^\n]+)', before_rel_pos, re.MULTILINE))
-        rel_section = section_match_rel[-1].group(1).strip() if section_match_rel else ''
+        rel_span = _section_span_before(section_starts, section_ends, rel_pos)
+        rel_section = content_with_newlines[rel_span[0] + 2:rel_span[1]].strip() if rel_span else ''
+        # Разделы пунктов сравниваются по номерам (-1 - названия нет ни у одного пункта)
+        rel_section_id = section_ids.get(rel_section, -1)
         
-        section_start = 0
-        if section_match_rel:
-            section_start = section_match_rel[-1].start(0)
+        section_start = rel_span[0] if rel_span else 0
         
-        section_end = len(content_with_newlines)
-        next_section_match = re.search(r'^# ', content_with_newlines[rel_pos:], re.MULTILINE)
-        if next_section_match:
-            section_end = rel_pos + next_section_match.start()
+        section_end = _next_section_start(content_with_newlines, rel_pos)
         
         nearest_point = None
-        nearest_point_pos = -1
-        
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            if point_pos <= rel_pos and point_pos >= section_start:
-                before_point = content_with_newlines[:point_pos]
-                point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                
-                if point_section == rel_section:
-                    if point_pos > nearest_point_pos:
-                        nearest_point_pos = point_pos
-                        nearest_point = point_match
+        
+        # Кандидаты - только пункты от начала раздела до позиции (границы - бинарным поиском);
+        # идём снизу вверх, и первый пункт того же раздела - ближайший
+        for point_idx in reversed(range(bisect_left(point_starts, section_start), bisect_right(point_starts, rel_pos))):
+            if point_section_ids[point_idx] == rel_section_id:
+                nearest_point = all_points[point_idx]
+                break
         
         if not nearest_point:
                 continue
@@ -1433,54 +1529,47 @@ def _collect_fragments_corona_rules(content, doc, search_words, phrases, max_fra
             continue
         
         number_start = nearest_point.start(1)
-        point_level = len(number.rstrip('.').split('.'))
+        # Номер из _POINT_RE кончается одной точкой: уровень - число точек, а номера
+        # подпунктов начинаются с самого номера
+        point_level = number.count('.')
         
         found_subpoint = None
         found_subpoint_pos = -1
         next_same_level_pos = section_end
         
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            if point_pos > number_start and point_pos < section_end:
-                point_number = point_match.group(1).strip()
-                point_number_level = len(point_number.rstrip('.').split('.'))
+        for point_idx in range(bisect_right(point_starts, number_start), bisect_left(point_starts, section_end)):
+            point_match = all_points[point_idx]
+            point_pos = point_starts[point_idx]
+            point_number = point_numbers[point_idx]
+            point_number_level = point_levels[point_idx]
                 
-                before_next = content_with_newlines[:point_pos]
-                next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                
-                if next_section == rel_section:
-                    if point_number_level <= point_level:
-                        if next_same_level_pos == section_end or point_pos < next_same_level_pos:
-                            next_same_level_pos = point_pos
-                    elif point_number_level > point_level:
-                        if point_number.startswith(number.rstrip('.') + '.'):
-                            if point_pos <= rel_pos:
-                                if point_pos > found_subpoint_pos:
-                                    found_subpoint = point_match
-                                    found_subpoint_pos = point_pos
+            if point_section_ids[point_idx] == rel_section_id:
+                if point_number_level <= point_level:
+                    if next_same_level_pos == section_end or point_pos < next_same_level_pos:
+                        next_same_level_pos = point_pos
+                elif point_number_level > point_level:
+                    if point_number.startswith(number):
+                        if point_pos <= rel_pos:
+                            if point_pos > found_subpoint_pos:
+                                found_subpoint = point_match
+                                found_subpoint_pos = point_pos
         
         original_number = number
         has_subpoints = False
         first_subpoint_pos = section_end
         
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            if point_pos > number_start and point_pos < next_same_level_pos:
-                point_number = point_match.group(1).strip()
-                point_number_level = len(point_number.rstrip('.').split('.'))
-                
-                before_next = content_with_newlines[:point_pos]
-                next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
+        for point_idx in range(bisect_right(point_starts, number_start), bisect_left(point_starts, next_same_level_pos)):
+            point_pos = point_starts[point_idx]
+            point_number = point_numbers[point_idx]
+            point_number_level = point_levels[point_idx]
                 
-                if next_section == rel_section:
-                    if point_number_level > point_level:
-                        if point_number.startswith(number.rstrip('.') + '.'):
-                            has_subpoints = True
-                            if point_pos < first_subpoint_pos:
-                                first_subpoint_pos = point_pos
-                    break
+            if point_section_ids[point_idx] == rel_section_id:
+                if point_number_level > point_level:
+                    if point_number.startswith(number):
+                        has_subpoints = True
+                        if point_pos < first_subpoint_pos:
+                            first_subpoint_pos = point_pos
+                break
             
         if has_subpoints and rel_pos < first_subpoint_pos:
             processed_blocks.add(original_number)
@@ -1496,7 +1585,7 @@ def _collect_fragments_corona_rules(content, doc, search_words, phrases, max_fra
         if number in processed_blocks:
             continue
         
-        line_start = content_with_newlines.rfind('\n', 0, number_start) + 1
+        line_start = _line_start(newlines, number_start)
         if line_start == 0 and not content_with_newlines.startswith('\n'):
             line_start = 0
         
@@ -1510,67 +1599,31 @@ def _collect_fragments_corona_rules(content, doc, search_words, phrases, max_fra
             
         start = line_start
         end = section_end
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            if point_pos > start and point_pos < section_end:
-                before_next = content_with_newlines[:point_pos]
-                next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                if next_section == rel_section:
-                    end = point_pos
-                    break
+        for point_idx in range(bisect_right(point_starts, start), bisect_left(point_starts, section_end)):
+            point_pos = point_starts[point_idx]
+            if point_section_ids[point_idx] == rel_section_id:
+                end = point_pos
+                break
         
         block_text = content_with_newlines[start:end].strip()
         
         if start < section_start:
             continue
         
-        section_markers_in_block = list(re.finditer(r'^# ', block_text, re.MULTILINE))
-        if section_markers_in_block and section_markers_in_block[0].start() > 0:
+        # Нужен только первый заголовок в блоке - без списка всех совпадений
+        section_marker_in_block = _NEXT_SECTION_RE.search(block_text)
+        if section_marker_in_block and section_marker_in_block.start() > 0:
             continue
         
-        lines = block_text.split('\n')
-        if lines:
-            first_line = lines[0].strip()
-            if first_line.startswith(number + ' '):
-                pass
-            elif number in first_line:
-                number_pos_in_first = first_line.find(number)
-                if number_pos_in_first > 0:
-                    text_before_number = first_line[:number_pos_in_first].strip()
-                    if text_before_number:
-                        same_number_pattern = re.compile(r'^' + re.escape(number) + r'\s+')
-                        same_number_before = same_number_pattern.match(text_before_number)
-                        if same_number_before:
-                            continue
-                        other_number_match = re.search(r'(\d{1,2}(?:\.\d+)*\.)\s+', text_before_number)
-                        if other_number_match:
-                            continue
-                    first_line = first_line[number_pos_in_first:].strip()
-                    lines[0] = first_line
-                    block_text = '\n'.join(lines).strip()
-                else:
-                    continue
-            else:
-                continue
-        
-        if not block_text.startswith(number):
-            number_pos = block_text.find(number)
-            if number_pos >= 0:
-                text_before = block_text[:number_pos].strip()
-                if text_before:
-                    other_number_match = re.search(r'(\d{1,2}(?:\.\d+)*\.)\s+', text_before)
-                    if other_number_match:
-                        continue
-                block_text = block_text[number_pos:].strip()
-            else:
-                continue
-        
-        first_line_final = block_text.split('\n')[0].strip()
-        if not first_line_final.startswith(number):
+        # Блок должен начинаться с номера пункта (текст перед номером в первой строке отрезается)
+        block_text = _cut_block_at_number(block_text, number)
+        if block_text is None:
             continue
         
-        block_text_lower = block_text.lower()
+        # После strip() и отрезания текста перед номером block_text остаётся хвостом
+        # content_with_newlines[start:end], поэтому нижний регистр берётся срезом content_lower
+        block_end = _stripped_end(content_with_newlines, start, end)
+        block_text_lower = content_lower[block_end - len(block_text):block_end]
         has_search_word = False
         if search_words:
             has_search_word = any(w in block_text_lower for w in search_words)
@@ -1580,15 +1633,7 @@ def _collect_fragments_corona_rules(content, doc, search_words, phrases, max_fra
         if not has_search_word:
             continue
         
-        before = content_with_newlines[:start]
-        section = ''
-        section_match = list(re.finditer(r'^# ([^\n]+)', before, re.MULTILINE))
-        if section_match:
-            last_section = section_match[-1]
-            section_text = last_section.group(1).strip()
-            if section_text.endswith('.'):
-                section_text = section_text[:-1].strip()
-            section = section_text
+        section = _trim_section_name(_section_name_before(content_with_newlines, section_starts, section_ends, start))
         
         processed_blocks.add(number)
         fragment = {
@@ -1601,167 +1646,81 @@ def _collect_fragments_corona_rules(content, doc, search_words, phrases, max_fra
                         'found_phrases': phrases if phrases else [],
             '_position': start,
         }
-        fragments.append(fragment)
-        
-        if len(fragments) >= max_fragments:
-            return fragments
-    
-    return fragments
+        yield fragment
 
 
-def _collect_fragments_international_rules(content, doc, search_words, phrases, max_fragments, fragments, processed_blocks):
+def _collect_fragments_international_rules(structured, doc, search_words, phrases) -> Iterator[dict]:
     """
     Специализированная логика для 2.1.1_Международные правила_structured.txt
     Полная копия текущей логики для этого документа
+    Генератор: фрагменты выдаются по одному, лимит задаёт вызывающий код (_collect_fragments).
     """
-    # Подготавливаем контент для поиска
-    content_with_newlines = content.replace('###', '\n###')
-    if not content_with_newlines.startswith('\n'):
-        content_with_newlines = '\n' + content_with_newlines
+    # Номера уже выданных блоков (свои для каждого документа)
+    processed_blocks: set[str] = set()
+    # Текст и его разметка подготовлены заранее (_load_structured_doc)
+    content_with_newlines = structured.text
+    newlines = structured.newlines
     
     # ШАГ 1: Находим все релевантные фрагменты
-    content_lower = content_with_newlines.lower()
-    relevant_positions = []
-    
-    if search_words:
-        for word in search_words:
-            word_lower = word.lower()
-            # Обычный поиск подстроки
-            pos = 0
-            while True:
-                pos = content_lower.find(word_lower, pos)
-                if pos == -1:
-                    break
-                relevant_positions.append(pos)
-                pos += len(word_lower)
-    
-    if phrases:
-        for phrase in phrases:
-            pos = 0
-            while True:
-                pos = content_lower.find(phrase, pos)
-                if pos == -1:
-                    break
-                relevant_positions.append(pos)
-                pos += len(phrase)
-    
+    content_lower = structured.text_lower
+    relevant_positions = _find_relevant_positions(content_lower, search_words, phrases)
     if not relevant_positions:
-        return fragments
-    
-    relevant_positions = sorted(set(relevant_positions))
+        return
     
     # ШАГ 2: Для каждой релевантной позиции находим ближайший номер пункта/подпункта СВЕРХУ
-    point_pattern = re.compile(r'(?:^|\n)(\d{1,2}(?:\.\d+)*\.)\s+')
-    all_points = list(point_pattern.finditer(content_with_newlines))
+    all_points = structured.points
+    point_section_ids = structured.point_section_ids
+    section_ids = structured.section_ids
+    point_starts = structured.point_starts
+    point_numbers = structured.point_numbers
+    point_levels = structured.point_levels
+    section_starts = structured.section_starts
+    section_ends = structured.section_ends
     
     for rel_pos in relevant_positions:
-        before_rel_pos = content_with_newlines[:rel_pos]
-        section_match_rel = list(re.finditer(r'^# ([^\n]+)', before_rel_pos, re.MULTILINE))
-        rel_section = section_match_rel[-1].group(1).strip() if section_match_rel else ''
+        rel_span = _section_span_before(section_starts, section_ends, rel_pos)
+        rel_section = content_with_newlines[rel_span[0] + 2:rel_span[1]].strip() if rel_span else ''
+        # Разделы пунктов сравниваются по номерам (-1 - названия нет ни у одного пункта)
+        rel_section_id = section_ids.get(rel_section, -1)
         
-        section_start = 0
-        if section_match_rel:
-            section_start = section_match_rel[-1].start(0)
+        section_start = rel_span[0] if rel_span else 0
         
-        section_end = len(content_with_newlines)
-        next_section_match = re.search(r'^# ', content_with_newlines[rel_pos:], re.MULTILINE)
-        if next_section_match:
-            section_end = rel_pos + next_section_match.start()
+        section_end = _next_section_start(content_with_newlines, rel_pos)
         
         # КРИТИЧНО: Сначала ищем подпункты, которые содержат релевантную позицию
         # Это важно, чтобы приоритет был у подпунктов, а не у родительских пунктов
         found_subpoint_for_rel = None
         found_subpoint_for_rel_pos = -1
         
-        for point_match in all_points:
-            point_pos = point_match.start(1)
-            point_number = point_match.group(1).strip()
-            point_level = len(point_number.rstrip('.').split('.'))
+        # Кандидаты - только пункты раздела (границы - бинарным поиском)
+        for point_idx in range(bisect_left(point_starts, section_start), bisect_left(point_starts, section_end)):
+            point_match = all_points[point_idx]
+            point_pos = point_starts[point_idx]
+            point_number = point_numbers[point_idx]
+            point_level = point_levels[point_idx]
             
             # Ищем только подпункты (уровень > 1)
-            if point_level > 1 and point_pos >= section_start and point_pos < section_end:
-                before_point = content_with_newlines[:point_pos]
-                point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                
-                if point_section == rel_section:
+            if point_level > 1:
+                if point_section_ids[point_idx] == rel_section_id:
                     # Находим конец этого подпункта
                     # Сначала проверяем, есть ли список в подпункте (элементы, начинающиеся с "-")
                     # Если есть список, конец подпункта определяется по последнему элементу списка, который заканчивается на "."
                     subpoint_end = section_end
                     
                     # Ищем список в подпункте (элементы, начинающиеся с "-")
-                    list_end_pos = -1
-                    text_after_subpoint = content_with_newlines[point_pos:]
-                    
-                    # Ищем все элементы списка более гибко - учитываем многострочные элементы
-                    # Элемент списка начинается с "-" и заканчивается на ";" или "."
-                    # Может быть многострочным (продолжение на следующих строках без "-")
-                    lines_after_subpoint = text_after_subpoint.split('\n')
-                    current_list_item_start = -1
-                    current_list_item_end = -1
-                    
-                    for i, line in enumerate(lines_after_subpoint):
-                        stripped_line = line.strip()
-                        # Проверяем, начинается ли строка с "-" (элемент списка)
-                        if stripped_line.startswith('-'):
-                            # Если был предыдущий элемент списка, сохраняем его конец
-                            if current_list_item_start >= 0 and current_list_item_end >= 0:
-                                # Проверяем, заканчивается ли предыдущий элемент на "."
-                                prev_text = '\n'.join(lines_after_subpoint[current_list_item_start:current_list_item_end+1])
-                                if prev_text.rstrip().endswith('.'):
-                                    # Находим абсолютную позицию конца этого элемента
-                                    text_before_lines = lines_after_subpoint[:current_list_item_end+1]
-                                    # Вычисляем позицию: начало подпункта + длина всех строк до конца предыдущего элемента
-                                    # Учитываем, что каждая строка заканчивается на \n (кроме последней)
-                                    total_length = 0
-                                    for j, line in enumerate(text_before_lines):
-                                        total_length += len(line)
-                                        if j < len(text_before_lines) - 1:  # Не последняя строка
-                                            total_length += 1  # Добавляем \n
-                                    list_item_end_absolute = point_pos + total_length
-                                    if list_item_end_absolute < section_end:
-                                        list_end_pos = list_item_end_absolute
-                            
-                            # Начинаем новый элемент списка
-                            current_list_item_start = i
-                            current_list_item_end = i
-                        elif current_list_item_start >= 0:
-                            # Продолжение текущего элемента списка (многострочный)
-                            current_list_item_end = i
-                    
-                    # Проверяем последний элемент списка
-                    if current_list_item_start >= 0 and current_list_item_end >= 0:
-                        last_item_text = '\n'.join(lines_after_subpoint[current_list_item_start:current_list_item_end+1])
-                        if last_item_text.rstrip().endswith('.'):
-                            # Находим абсолютную позицию конца последнего элемента списка
-                            text_before_lines = lines_after_subpoint[:current_list_item_end+1]
-                            # Вычисляем позицию: начало подпункта + длина всех строк до конца последнего элемента
-                            # Учитываем, что каждая строка заканчивается на \n (кроме последней)
-                            total_length = 0
-                            for j, line in enumerate(text_before_lines):
-                                total_length += len(line)
-                                if j < len(text_before_lines) - 1:  # Не последняя строка
-                                    total_length += 1  # Добавляем \n
-                            list_item_end_absolute = point_pos + total_length
-                            if list_item_end_absolute < section_end:
-                                list_end_pos = list_item_end_absolute
+                    list_end_pos = _list_end_before(content_with_newlines, point_pos, section_end)
                     
                     # Ищем следующий пункт того же или более высокого уровня
                     next_point_end = section_end
-                    for next_point_match in all_points:
-                        next_point_pos = next_point_match.start(1)
-                        if next_point_pos > point_pos and next_point_pos < section_end:
-                            next_point_number = next_point_match.group(1).strip()
-                            next_point_level = len(next_point_number.rstrip('.').split('.'))
-                            before_next = content_with_newlines[:next_point_pos]
-                            next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                            next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                            if next_section == rel_section:
-                                # Если следующий пункт того же или более высокого уровня - это конец подпункта
-                                if next_point_level <= point_level:
-                                    next_point_end = next_point_pos
-                                    break
+                    for next_point_idx in range(bisect_right(point_starts, point_pos), bisect_left(point_starts, section_end)):
+                        next_point_pos = point_starts[next_point_idx]
+                        next_point_number = point_numbers[next_point_idx]
+                        next_point_level = point_levels[next_point_idx]
+                        if point_section_ids[next_point_idx] == rel_section_id:
+                            # Если следующий пункт того же или более высокого уровня - это конец подпункта
+                            if next_point_level <= point_level:
+                                next_point_end = next_point_pos
+                                break
                     
                     # Используем более ранний конец (либо конец списка, либо следующий пункт)
                     if list_end_pos > 0 and list_end_pos < next_point_end:
@@ -1774,18 +1733,14 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
                     # Лучше использовать позицию следующего пункта 13.2, если он есть
                     if subpoint_end == section_end:
                         # Ищем следующий пункт 13.2 в том же разделе
-                        for next_point_match in all_points:
-                            next_point_pos = next_point_match.start(1)
-                            if next_point_pos > point_pos:
-                                next_point_number = next_point_match.group(1).strip()
-                                before_next = content_with_newlines[:next_point_pos]
-                                next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                                next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                                if next_section == rel_section:
-                                    # Проверяем, является ли это пунктом 13.2 (следующим после 13.1)
-                                    if next_point_number.startswith('13.') and next_point_number != '13.1.':
-                                        subpoint_end = next_point_pos
-                                        break
+                        for next_point_idx in range(bisect_right(point_starts, point_pos), len(point_starts)):
+                            next_point_pos = point_starts[next_point_idx]
+                            next_point_number = point_numbers[next_point_idx]
+                            if point_section_ids[next_point_idx] == rel_section_id:
+                                # Проверяем, является ли это пунктом 13.2 (следующим после 13.1)
+                                if next_point_number.startswith('13.') and next_point_number != '13.1.':
+                                    subpoint_end = next_point_pos
+                                    break
                                     
                     # Проверяем, находится ли релевантная позиция в этом подпункте
                     if point_pos <= rel_pos < subpoint_end:
@@ -1797,10 +1752,9 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
         skip_subpoint_check = False
         if found_subpoint_for_rel:
             nearest_point = found_subpoint_for_rel
-            nearest_point_pos = found_subpoint_for_rel_pos
             number = found_subpoint_for_rel.group(1).strip()
             number_start = found_subpoint_for_rel.start(1)
-            point_level = len(number.rstrip('.').split('.'))
+            point_level = number.count('.')
             
             # КРИТИЧНО: Проверяем, не был ли уже обработан этот подпункт
             if number in processed_blocks:
@@ -1821,21 +1775,15 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
         else:
             # Если подпункт не найден, ищем обычный пункт
             nearest_point = None
-            nearest_point_pos = -1
             has_subpoints = False  # Инициализируем переменную
             first_subpoint_pos = section_end
             
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos <= rel_pos and point_pos >= section_start:
-                    before_point = content_with_newlines[:point_pos]
-                    point_section_match = list(re.finditer(r'^# ([^\n]+)', before_point, re.MULTILINE))
-                    point_section = point_section_match[-1].group(1).strip() if point_section_match else ''
-                    
-                    if point_section == rel_section:
-                        if point_pos > nearest_point_pos:
-                            nearest_point_pos = point_pos
-                            nearest_point = point_match
+            # Кандидаты - только пункты от начала раздела до позиции (границы - бинарным поиском);
+            # идём снизу вверх, и первый пункт того же раздела - ближайший
+            for point_idx in reversed(range(bisect_left(point_starts, section_start), bisect_right(point_starts, rel_pos))):
+                if point_section_ids[point_idx] == rel_section_id:
+                    nearest_point = all_points[point_idx]
+                    break
             
             if not nearest_point:
                 continue
@@ -1845,49 +1793,43 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
                 continue
             
             number_start = nearest_point.start(1)
-            point_level = len(number.rstrip('.').split('.'))
+            # Номер из _POINT_RE кончается одной точкой: уровень - число точек, а номера
+            # подпунктов начинаются с самого номера
+            point_level = number.count('.')
             
             # Проверяем, есть ли подпункты у найденного пункта
             found_subpoint = None
             found_subpoint_pos = -1
             next_same_level_pos = section_end
             
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos > number_start and point_pos < section_end:
-                    point_number = point_match.group(1).strip()
-                    point_number_level = len(point_number.rstrip('.').split('.'))
-                    
-                    before_next = content_with_newlines[:point_pos]
-                    next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                    next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
+            for point_idx in range(bisect_right(point_starts, number_start), bisect_left(point_starts, section_end)):
+                point_match = all_points[point_idx]
+                point_pos = point_starts[point_idx]
+                point_number = point_numbers[point_idx]
+                point_number_level = point_levels[point_idx]
                     
-                    if next_section == rel_section:
-                        if point_number_level <= point_level:
-                            if next_same_level_pos == section_end or point_pos < next_same_level_pos:
-                                next_same_level_pos = point_pos
-                        elif point_number_level > point_level:
-                            if point_number.startswith(number.rstrip('.') + '.'):
-                                # Находим конец этого подпункта
-                                subpoint_end = section_end
-                                for next_point_match in all_points:
-                                    next_point_pos = next_point_match.start(1)
-                                    if next_point_pos > point_pos and next_point_pos < section_end:
-                                        next_point_number = next_point_match.group(1).strip()
-                                        next_point_level = len(next_point_number.rstrip('.').split('.'))
-                                        before_next = content_with_newlines[:next_point_pos]
-                                        next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                                        next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                                        if next_section == rel_section:
-                                            if next_point_level <= point_number_level:
-                                                subpoint_end = next_point_pos
-                        break
+                if point_section_ids[point_idx] == rel_section_id:
+                    if point_number_level <= point_level:
+                        if next_same_level_pos == section_end or point_pos < next_same_level_pos:
+                            next_same_level_pos = point_pos
+                    elif point_number_level > point_level:
+                        if point_number.startswith(number):
+                            # Находим конец этого подпункта
+                            subpoint_end = section_end
+                            for next_point_idx in range(bisect_right(point_starts, point_pos), bisect_left(point_starts, section_end)):
+                                next_point_pos = point_starts[next_point_idx]
+                                next_point_number = point_numbers[next_point_idx]
+                                next_point_level = point_levels[next_point_idx]
+                                if point_section_ids[next_point_idx] == rel_section_id:
+                                    if next_point_level <= point_number_level:
+                                        subpoint_end = next_point_pos
+                    break
                 
-                        # Проверяем, находится ли релевантная позиция в этом подпункте
-                        if point_pos <= rel_pos < subpoint_end:
-                            if point_pos > found_subpoint_pos:
-                                found_subpoint = point_match
-                                found_subpoint_pos = point_pos
+                    # Проверяем, находится ли релевантная позиция в этом подпункте
+                    if point_pos <= rel_pos < subpoint_end:
+                        if point_pos > found_subpoint_pos:
+                            found_subpoint = point_match
+                            found_subpoint_pos = point_pos
             
             original_number = number
         
@@ -1896,23 +1838,18 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
             has_subpoints = False
             first_subpoint_pos = section_end
             
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos > number_start and point_pos < next_same_level_pos:
-                    point_number = point_match.group(1).strip()
-                    point_number_level = len(point_number.rstrip('.').split('.'))
-                    
-                    before_next = content_with_newlines[:point_pos]
-                    next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                    next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
+            for point_idx in range(bisect_right(point_starts, number_start), bisect_left(point_starts, next_same_level_pos)):
+                point_pos = point_starts[point_idx]
+                point_number = point_numbers[point_idx]
+                point_number_level = point_levels[point_idx]
                     
-                    if next_section == rel_section:
-                        if point_number_level > point_level:
-                            if point_number.startswith(number.rstrip('.') + '.'):
-                                has_subpoints = True
-                                if point_pos < first_subpoint_pos:
-                                    first_subpoint_pos = point_pos
-                                break
+                if point_section_ids[point_idx] == rel_section_id:
+                    if point_number_level > point_level:
+                        if point_number.startswith(number):
+                            has_subpoints = True
+                            if point_pos < first_subpoint_pos:
+                                first_subpoint_pos = point_pos
+                            break
             
             if has_subpoints and rel_pos < first_subpoint_pos:
                 processed_blocks.add(original_number)
@@ -1928,7 +1865,7 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
         if number in processed_blocks:
             continue
         
-        line_start = content_with_newlines.rfind('\n', 0, number_start) + 1
+        line_start = _line_start(newlines, number_start)
         if line_start == 0 and not content_with_newlines.startswith('\n'):
             line_start = 0
         
@@ -1946,124 +1883,38 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
         # КРИТИЧНО: Если подпункт содержит список (элементы, начинающиеся с "-"),
         # конец подпункта определяется по последнему элементу списка, который заканчивается на "."
         # Проверяем, есть ли список в подпункте
-        text_after_start = content_with_newlines[start:]
-        lines_after_start = text_after_start.split('\n')
-        current_list_item_start = -1
-        current_list_item_end = -1
-        list_end_pos = -1
-        
-        for i, line in enumerate(lines_after_start):
-            stripped_line = line.strip()
-            # Проверяем, начинается ли строка с "-" (элемент списка)
-            if stripped_line.startswith('-'):
-                # Если был предыдущий элемент списка, сохраняем его конец
-                if current_list_item_start >= 0 and current_list_item_end >= 0:
-                    # Проверяем, заканчивается ли предыдущий элемент на "."
-                    prev_text = '\n'.join(lines_after_start[current_list_item_start:current_list_item_end+1])
-                    if prev_text.rstrip().endswith('.'):
-                        # Находим абсолютную позицию конца этого элемента
-                        text_before_lines = lines_after_start[:current_list_item_end+1]
-                        # Вычисляем позицию: начало блока + длина всех строк до конца предыдущего элемента
-                        # Учитываем, что каждая строка заканчивается на \n (кроме последней)
-                        total_length = 0
-                        for j, line in enumerate(text_before_lines):
-                            total_length += len(line)
-                            if j < len(text_before_lines) - 1:  # Не последняя строка
-                                total_length += 1  # Добавляем \n
-                        list_item_end_absolute = start + total_length
-                        if list_item_end_absolute < section_end:
-                            list_end_pos = list_item_end_absolute
-                
-                # Начинаем новый элемент списка
-                current_list_item_start = i
-                current_list_item_end = i
-            elif current_list_item_start >= 0:
-                # Продолжение текущего элемента списка (многострочный)
-                current_list_item_end = i
-        
-        # Проверяем последний элемент списка
-        if current_list_item_start >= 0 and current_list_item_end >= 0:
-            last_item_text = '\n'.join(lines_after_start[current_list_item_start:current_list_item_end+1])
-            if last_item_text.rstrip().endswith('.'):
-                # Находим абсолютную позицию конца последнего элемента списка
-                text_before_lines = lines_after_start[:current_list_item_end+1]
-                # Вычисляем позицию: начало блока + длина всех строк до конца последнего элемента
-                # Учитываем, что каждая строка заканчивается на \n (кроме последней)
-                total_length = 0
-                for i, line in enumerate(text_before_lines):
-                    total_length += len(line)
-                    if i < len(text_before_lines) - 1:  # Не последняя строка
-                        total_length += 1  # Добавляем \n
-                list_item_end_absolute = start + total_length
-                if list_item_end_absolute < section_end:
-                    list_end_pos = list_item_end_absolute
+        list_end_pos = _list_end_before(content_with_newlines, start, section_end)
         
         if list_end_pos > 0:
             end = list_end_pos
         
         # Если список не найден или не определили конец, ищем следующий пункт
         if end == section_end:
-            for point_match in all_points:
-                point_pos = point_match.start(1)
-                if point_pos > start and point_pos < section_end:
-                    before_next = content_with_newlines[:point_pos]
-                    next_section_match = list(re.finditer(r'^# ([^\n]+)', before_next, re.MULTILINE))
-                    next_section = next_section_match[-1].group(1).strip() if next_section_match else ''
-                    if next_section == rel_section:
-                        end = point_pos
-                        break
+            for point_idx in range(bisect_right(point_starts, start), bisect_left(point_starts, section_end)):
+                point_pos = point_starts[point_idx]
+                if point_section_ids[point_idx] == rel_section_id:
+                    end = point_pos
+                    break
         
         block_text = content_with_newlines[start:end].strip()
         
         if start < section_start:
                         continue
                     
-        section_markers_in_block = list(re.finditer(r'^# ', block_text, re.MULTILINE))
-        if section_markers_in_block and section_markers_in_block[0].start() > 0:
+        # Нужен только первый заголовок в блоке - без списка всех совпадений
+        section_marker_in_block = _NEXT_SECTION_RE.search(block_text)
+        if section_marker_in_block and section_marker_in_block.start() > 0:
                             continue
                     
-        lines = block_text.split('\n')
-        if lines:
-            first_line = lines[0].strip()
-            if first_line.startswith(number + ' '):
-                pass
-            elif number in first_line:
-                number_pos_in_first = first_line.find(number)
-                if number_pos_in_first > 0:
-                    text_before_number = first_line[:number_pos_in_first].strip()
-                    if text_before_number:
-                        same_number_pattern = re.compile(r'^' + re.escape(number) + r'\s+')
-                        same_number_before = same_number_pattern.match(text_before_number)
-                        if same_number_before:
-                                continue
-                        other_number_match = re.search(r'(\d{1,2}(?:\.\d+)*\.)\s+', text_before_number)
-                        if other_number_match:
-                                    continue
-                    first_line = first_line[number_pos_in_first:].strip()
-                    lines[0] = first_line
-                    block_text = '\n'.join(lines).strip()
-                else:
-                                continue
-            else:
-                    continue
-        
-        if not block_text.startswith(number):
-            number_pos = block_text.find(number)
-            if number_pos >= 0:
-                text_before = block_text[:number_pos].strip()
-                if text_before:
-                    other_number_match = re.search(r'(\d{1,2}(?:\.\d+)*\.)\s+', text_before)
-                    if other_number_match:
-                        continue
-                block_text = block_text[number_pos:].strip()
-            else:
-                continue
-        
-        first_line_final = block_text.split('\n')[0].strip()
-        if not first_line_final.startswith(number):
+        # Блок должен начинаться с номера пункта (текст перед номером в первой строке отрезается)
+        block_text = _cut_block_at_number(block_text, number)
+        if block_text is None:
             continue
         
-        block_text_lower = block_text.lower()
+        # После strip() и отрезания текста перед номером block_text остаётся хвостом
+        # content_with_newlines[start:end], поэтому нижний регистр берётся срезом content_lower
+        block_end = _stripped_end(content_with_newlines, start, end)
+        block_text_lower = content_lower[block_end - len(block_text):block_end]
         has_search_word = False
         if search_words:
             has_search_word = any(w in block_text_lower for w in search_words)
@@ -2073,15 +1924,7 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
         if not has_search_word:
             continue
                         
-        before = content_with_newlines[:start]
-        section = ''
-        section_match = list(re.finditer(r'^# ([^\n]+)', before, re.MULTILINE))
-        if section_match:
-            last_section = section_match[-1]
-            section_text = last_section.group(1).strip()
-            if section_text.endswith('.'):
-                section_text = section_text[:-1].strip()
-            section = section_text
+        section = _trim_section_name(_section_name_before(content_with_newlines, section_starts, section_ends, start))
         
         processed_blocks.add(number)
         fragment = {
@@ -2094,12 +1937,15 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
                         'found_phrases': phrases if phrases else [],
             '_position': start,
         }
-        fragments.append(fragment)
-        
-        if len(fragments) >= max_fragments:
-            return fragments
-    
-    return fragments
+        yield fragment
+
+
+# Специализированная функция формирования окон для каждого документа-первоисточника
+_FRAGMENT_COLLECTORS = {
+    "2.1.1_Международные правила_structured.txt": _collect_fragments_international_rules,
+    "2.1.2_Правила игры Корона_structured.txt": _collect_fragments_corona_rules,
+    "2.2_Технические требования к бильярдным столам и оборудованию ФБСР_structured.txt": _collect_fragments_technical_requirements,
+}
 
 
 # Старая логика удалена - теперь используется простая логика:
@@ -2112,13 +1958,13 @@ def _collect_fragments_international_rules(content, doc, search_words, phrases,
 
 def get_primary_source_fragments(hits, query, allowed_sources=None, max_fragments=20):
     lwquery = (query or '').lower()
-    phrase_matches = re.findall(r"\*([^*]+?)\*", lwquery)
+    phrase_matches = _PHRASE_RE.findall(lwquery)
     phrases = []
     for raw in phrase_matches:
-        cleaned = re.sub(r"\s+", " ", raw.strip())
+        cleaned = _WS_RE.sub(" ", raw.strip())
         if cleaned and len(cleaned.split()) >= 2:
             phrases.append(cleaned)
-    query_without_phrases = re.sub(r"\*[^*]+?\*", " ", lwquery)
+    query_without_phrases = _PHRASE_RE.sub(" ", lwquery)
     all_words = [w.strip() for w in query_without_phrases.split() if w.strip() and len(w.strip()) > 1]
     # Не фильтруем слова из CONTEXT_ROUTES - они нужны для поиска внутри документа
     # Фильтруем только базовые стоп-слова, которые не являются ключевыми словами контекста
@@ -17,6 +17,15 @@ except ImportError:
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
     from knowledge.text_search import DATA_DIR
 
+# Чистка пробелов и переносов в собранном тексте (применяются по порядку)
+_MULTI_NEWLINE_RE = re.compile(r"\n{3,}")
+_MULTI_SPACE_RE = re.compile(r"[ ]{2,}")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([.,;:!?])")
+_SPACE_AFTER_PUNCT_RE = re.compile(r"([.,;:!?])\s+")
+_SPACED_HYPHEN_RE = re.compile(r"\s+-\s+([А-Яа-яЁёA-Za-z])")
+# Строка-заголовок: "1. Текст" / "1) Текст" или короткая фраза с заглавной буквы
+_HEADER_RE = re.compile(r"^(?:\d+[\.\)]\s+[А-ЯЁ]|[А-ЯЁ][а-яё\s]{0,50}:?$)")
+
 
 def extract_pdf_text(file_path: str) -> str:
     """Извлекает текст из PDF файла."""
@@ -33,27 +42,29 @@ def extract_pdf_text(file_path: str) -> str:
 def _join_section(lines: List[Tuple[str, bool]]) -> str:
     if not lines:
         return ""
-    result, prev_had_space = lines[0]
+    # Куски собираются в список и склеиваются один раз (без квадратичного +=)
+    first, prev_had_space = lines[0]
+    pieces = [first]
     for text, had_space in lines[1:]:
-        if result.endswith('-'):
-            result = result[:-1] + text
+        if pieces[-1].endswith('-'):
+            # Перенос слова: убираем дефис и приклеиваем продолжение
+            pieces[-1] = pieces[-1][:-1]
         elif prev_had_space:
-            result += " " + text
-        else:
-            result += text
+            pieces.append(" ")
+        pieces.append(text)
         prev_had_space = had_space
-    return result
+    return "".join(pieces)
 
 
 def structure_text(text: str) -> str:
     """Структурирует извлечённый текст из PDF."""
     if not text.strip():
         return ""
-    lines = text.split("\n")
     structured: list[str] = []
     current_section: list[tuple[str, bool]] = []
-    for raw_line in lines:
-        stripped = raw_line.rstrip("\n\r")
+    for raw_line in text.split("\n"):
+        # После split("\n") в строке может остаться только "\r"
+        stripped = raw_line.rstrip("\r")
         had_trailing_space = bool(stripped) and stripped.endswith(" ")
         line = stripped.strip()
         if not line:
@@ -61,13 +72,11 @@ def structure_text(text: str) -> str:
                 structured.append(_join_section(current_section))
                 current_section = []
             continue
-        is_header = (
-            len(line) < 80 and (
-                line.isupper()
-                or re.match(r"^\d+[\.\)]\s+[А-ЯЁ]", line)
-                or re.match(r"^[А-ЯЁ][а-яё\s]{0,50}:?$", line)
-                or (line.endswith(':') and len(line) < 60)
-            )
+        # Дешёвые проверки идут раньше регулярки
+        is_header = len(line) < 80 and (
+            line.isupper()
+            or (line.endswith(':') and len(line) < 60)
+            or _HEADER_RE.match(line) is not None
         )
         if is_header and current_section:
             structured.append(_join_section(current_section))
@@ -80,11 +89,11 @@ def structure_text(text: str) -> str:
     if current_section:
         structured.append(_join_section(current_section))
     result = "\n".join(structured)
-    result = re.sub(r"\n{3,}", "\n\n", result)
-    result = re.sub(r"[ ]{2,}", " ", result)
-    result = re.sub(r"\s+([.,;:!?])", r"\1", result)
-    result = re.sub(r"([.,;:!?])\s+", r"\1 ", result)
-    result = re.sub(r"\s+-\s+([А-Яа-яЁёA-Za-z])", r"-\1", result)
+    result = _MULTI_NEWLINE_RE.sub("\n\n", result)
+    result = _MULTI_SPACE_RE.sub(" ", result)
+    result = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", result)
+    result = _SPACE_AFTER_PUNCT_RE.sub(r"\1 ", result)
+    result = _SPACED_HYPHEN_RE.sub(r"-\1", result)
     return result.strip()
 
 
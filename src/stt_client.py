@@ -4,23 +4,45 @@ from __future__ import annotations
 
 import asyncio
 import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, BinaryIO, Dict, Optional, Tuple
 
 from .stt_settings import STT_SETTINGS
 
-_model: Optional[Any] = None
+# Частота дискретизации, которую ожидает Whisper для сырого PCM
+PCM_SAMPLE_RATE = 16000
 
+_models: Dict[str, Any] = {}
+_batched_pipelines: Dict[str, Any] = {}
+# Защищает _models от повторной загрузки одной модели из разных потоков
+_models_lock = threading.Lock()
+# Модель одна на процесс, и параллельные транскрибации только мешают друг другу
+# за ядра CPU, поэтому все они выполняются по очереди в одном отдельном потоке
+_stt_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stt")
 
-def _load_model() -> Any:
-    """Загружает модель faster-whisper для транскрибации."""
+
+def _load_model(model_size: Optional[str] = None) -> Any:
+    """Загружает модель faster-whisper для транскрибации (по одному экземпляру на размер)."""
     import logging
     logger = logging.getLogger(__name__)
     
-    global _model
-    if _model is None:
-        logger.info(f"Загрузка модели STT: размер={STT_SETTINGS.model_size}, device={STT_SETTINGS.device}, compute_type={STT_SETTINGS.compute_type}")
+    model_size = model_size or STT_SETTINGS.model_size
+    model = _models.get(model_size)
+    if model is not None:
+        logger.debug("Модель уже загружена, используем существующий экземпляр")
+        return model
+    with _models_lock:
+        model = _models.get(model_size)
+        if model is not None:
+            return model
+        logger.info(
+            f"Загрузка модели STT: размер={model_size}, device={STT_SETTINGS.device}, "
+            f"compute_type={STT_SETTINGS.compute_type}, cpu_threads={STT_SETTINGS.cpu_threads}, "
+            f"num_workers={STT_SETTINGS.num_workers}"
+        )
         try:
             fw_module = importlib.import_module("faster_whisper")
             logger.info("Модуль faster_whisper импортирован успешно")
@@ -31,55 +53,135 @@ def _load_model() -> Any:
             ) from exc
         
         WhisperModel = getattr(fw_module, "WhisperModel")
-        logger.info(f"Создание экземпляра WhisperModel с параметрами: model_size={STT_SETTINGS.model_size}")
+        logger.info(f"Создание экземпляра WhisperModel с параметрами: model_size={model_size}")
         
         try:
-            _model = WhisperModel(
-                STT_SETTINGS.model_size,
+            model = WhisperModel(
+                model_size,
                 device=STT_SETTINGS.device,
                 compute_type=STT_SETTINGS.compute_type,
+                cpu_threads=STT_SETTINGS.cpu_threads,
+                num_workers=STT_SETTINGS.num_workers,
             )
+            _models[model_size] = model
             logger.info("Модель WhisperModel создана успешно")
         except Exception as e:
             logger.error(f"Ошибка при создании модели: {e}", exc_info=True)
             raise
+        return model
+
+
+def _load_batched_pipeline(model_size: str) -> Optional[Any]:
+    """Возвращает пакетный пайплайн faster-whisper или None, если он недоступен.
+
+    ``BatchedInferencePipeline`` декодирует речевые фрагменты одного аудио пачками
+    по ``batch_size``, поэтому работает только вместе с VAD-фильтром.
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+
+    if STT_SETTINGS.batch_size <= 1 or not STT_SETTINGS.vad_filter:
+        return None
+    pipeline = _batched_pipelines.get(model_size)
+    if pipeline is None:
+        model = _load_model(model_size)
+        fw_module = importlib.import_module("faster_whisper")
+        BatchedInferencePipeline = getattr(fw_module, "BatchedInferencePipeline", None)
+        if BatchedInferencePipeline is None:
+            logger.warning("BatchedInferencePipeline недоступен в установленной версии faster-whisper, используется обычный режим")
+            return None
+        pipeline = BatchedInferencePipeline(model=model)
+        _batched_pipelines[model_size] = pipeline
+        logger.info(f"Пакетный пайплайн STT создан: model_size={model_size}, batch_size={STT_SETTINGS.batch_size}")
+    return pipeline
+
+
+def preload_model() -> None:
+    """Заранее загружает основную модель (и пакетный пайплайн), чтобы первое голосовое не ждало загрузки."""
+    import logging
+    logger = logging.getLogger(__name__)
+
+    try:
+        _load_model(STT_SETTINGS.model_size)
+        _load_batched_pipeline(STT_SETTINGS.model_size)
+    except Exception as e:
+        # Без модели бот работает дальше: ошибка повторится и будет показана при транскрибации
+        logger.warning(f"Не удалось заранее загрузить модель STT: {e}")
+
+
+def _run_transcribe(audio: Any, model_size: str) -> Tuple[str, float]:
+    """Транскрибирует аудио (путь, файловый объект или массив PCM) моделью заданного размера.
+
+    Возвращает текст и средний ``avg_logprob`` по сегментам (уверенность модели).
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+
+    # Файловый объект при повторной транскрибации нужно читать с начала
+    if hasattr(audio, "seek"):
+        audio.seek(0)
+
+    model = _load_model(model_size)
+    transcribe_kwargs = dict(
+        language=STT_SETTINGS.language or None,
+        beam_size=STT_SETTINGS.beam_size,
+        vad_filter=STT_SETTINGS.vad_filter,
+        temperature=STT_SETTINGS.temperature,
+    )
+    pipeline = _load_batched_pipeline(model_size)
+    if pipeline is not None:
+        segments, info = pipeline.transcribe(
+            audio,
+            batch_size=STT_SETTINGS.batch_size,
+            **transcribe_kwargs,
+        )
     else:
-        logger.debug("Модель уже загружена, используем существующий экземпляр")
+        # Без подстановки предыдущего текста и таймстемпов декодер делает меньше работы
+        segments, info = model.transcribe(
+            audio,
+            condition_on_previous_text=False,
+            without_timestamps=True,
+            **transcribe_kwargs,
+        )
+    
+    logger.info(f"Язык транскрибации: {info.language}, вероятность: {info.language_probability:.2f}")
     
-    return _model
+    pieces = []
+    logprobs = []
+    for seg in segments:
+        logprobs.append(seg.avg_logprob)
+        if seg.text and seg.text.strip():
+            pieces.append(seg.text.strip())
+            logger.debug(f"Сегмент: {seg.text.strip()}")
+    
+    # Без сегментов (тишина) повторная транскрибация ничего не даст
+    avg_logprob = sum(logprobs) / len(logprobs) if logprobs else 0.0
+    return " ".join(pieces).strip(), avg_logprob
+
 
+def _sync_transcribe(audio: Any, description: str) -> str:
+    """Транскрибирует аудио.
 
-def _sync_transcribe(path: Path) -> str:
-    """Транскрибирует аудио файл."""
+    Сначала используется быстрая модель ``model_size``; если её уверенность ниже
+    ``fallback_logprob_threshold``, файл повторно распознаётся моделью ``fallback_model_size``.
+    """
     import logging
     logger = logging.getLogger(__name__)
     
-    logger.info(f"Загрузка модели STT (размер: {STT_SETTINGS.model_size})...")
-    model = _load_model()
-    logger.info(f"Модель загружена успешно")
-    
-    audio_path = str(path)
-    logger.info(f"Начало транскрибации файла: {audio_path}")
+    logger.info(f"Начало транскрибации: {description} (модель: {STT_SETTINGS.model_size})")
     
     try:
-        segments, info = model.transcribe(
-            audio_path,
-            language=STT_SETTINGS.language or None,
-            beam_size=STT_SETTINGS.beam_size,
-            vad_filter=STT_SETTINGS.vad_filter,
-            temperature=STT_SETTINGS.temperature,
-        )
+        result, avg_logprob = _run_transcribe(audio, STT_SETTINGS.model_size)
         
-        logger.info(f"Язык транскрибации: {info.language}, вероятность: {info.language_probability:.2f}")
-        
-        pieces = []
-        for seg in segments:
-            if seg.text and seg.text.strip():
-                pieces.append(seg.text.strip())
-                logger.debug(f"Сегмент: {seg.text.strip()}")
+        fallback_size = STT_SETTINGS.fallback_model_size
+        if fallback_size and fallback_size != STT_SETTINGS.model_size and avg_logprob < STT_SETTINGS.fallback_logprob_threshold:
+            logger.info(
+                f"Низкая уверенность распознавания (avg_logprob={avg_logprob:.2f}), "
+                f"повторная транскрибация моделью {fallback_size}"
+            )
+            result, avg_logprob = _run_transcribe(audio, fallback_size)
         
-        result = " ".join(pieces).strip()
-        logger.info(f"Транскрибация завершена, получено символов: {len(result)}")
+        logger.info(f"Транскрибация завершена, получено символов: {len(result)}, avg_logprob={avg_logprob:.2f}")
         
         if not result:
             logger.warning("Транскрибация вернула пустой результат!")
@@ -90,10 +192,25 @@ def _sync_transcribe(path: Path) -> str:
         raise
 
 
-async def transcribe_file(path: str | Path) -> str:
-    """Transcribe an audio file asynchronously using faster-whisper."""
-    audio_path = Path(path)
+async def transcribe_file(path: str | Path | BinaryIO) -> str:
+    """Transcribe an audio file (path or binary file object) asynchronously using faster-whisper."""
+    if isinstance(path, (str, Path)):
+        audio: Any = str(path)
+        description = f"файл {audio}"
+    else:
+        audio = path
+        description = "файловый объект"
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_stt_executor, partial(_sync_transcribe, audio, description))
+
+
+async def transcribe_pcm(pcm: bytes) -> str:
+    """Transcribe raw 16 kHz mono s16le PCM (e.g. ffmpeg stdout) without touching the disk."""
+    import numpy as np
+
+    audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    description = f"PCM {len(audio) / PCM_SAMPLE_RATE:.1f} с"
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, partial(_sync_transcribe, audio_path))
+    return await loop.run_in_executor(_stt_executor, partial(_sync_transcribe, audio, description))
 
 
@@ -9,6 +9,7 @@ from __future__ import annotations
 import json
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict
 
@@ -18,15 +19,28 @@ CONFIG_PATH = Path(__file__).resolve().parent.parent / "config" / "stt_config.js
 
 @dataclass(frozen=True)
 class STTSettings:
-    model_size: str = "medium"
+    model_size: str = "base"
+    fallback_model_size: str = "medium"
+    fallback_logprob_threshold: float = -1.0
     device: str = "cpu"
     compute_type: str = "int8"
     language: str = "ru"
-    beam_size: int = 5
-    vad_filter: bool = False
+    # Жадное декодирование и пропуск тишины VAD-фильтром: для коротких голосовых
+    # заметно быстрее при почти той же точности (переопределяются STT_BEAM_SIZE / STT_VAD_FILTER)
+    beam_size: int = 1
+    vad_filter: bool = True
     temperature: float = 0.0
+    batch_size: int = 8
+    cpu_threads: int = 0
+    # Транскрибации выполняются по очереди в одном потоке (см. stt_client), поэтому
+    # второй экземпляр модели в CTranslate2 не использовался бы и только занимал память
+    num_workers: int = 1
+    # Загружать модель при запуске бота, а не при первом голосовом сообщении
+    preload: bool = True
 
 
+# Настройки читаются один раз на путь (повторный импорт или вызов не перечитывает файл)
+@lru_cache(maxsize=None)
 def _load_settings(path: Path) -> STTSettings:
     # Загружаем из JSON файла, если он существует
     json_data: Dict[str, Any] = {}
@@ -38,20 +52,25 @@ def _load_settings(path: Path) -> STTSettings:
             # Игнорируем ошибку чтения JSON, используем значения по умолчанию
             pass
 
+    # Переменные окружения читаются один раз, а не при каждом вызове _get
+    env_map = {
+        "model_size": os.getenv("STT_MODEL_SIZE"),
+        "fallback_model_size": os.getenv("STT_FALLBACK_MODEL_SIZE"),
+        "fallback_logprob_threshold": os.getenv("STT_FALLBACK_LOGPROB_THRESHOLD"),
+        "device": os.getenv("STT_DEVICE"),
+        "compute_type": os.getenv("STT_COMPUTE_TYPE"),
+        "language": os.getenv("STT_LANGUAGE"),
+        "beam_size": os.getenv("STT_BEAM_SIZE"),
+        "vad_filter": os.getenv("STT_VAD_FILTER"),
+        "temperature": os.getenv("STT_TEMPERATURE"),
+        "batch_size": os.getenv("STT_BATCH_SIZE"),
+        "cpu_threads": os.getenv("STT_CPU_THREADS"),
+        "num_workers": os.getenv("STT_NUM_WORKERS"),
+        "preload": os.getenv("STT_PRELOAD"),
+    }
+
     def _get(name: str, default: Any) -> Any:
         # Приоритет: переменные окружения > JSON > значения по умолчанию
-        
-        # Проверяем переменные окружения
-        env_map = {
-            "model_size": os.getenv("STT_MODEL_SIZE"),
-            "device": os.getenv("STT_DEVICE"),
-            "compute_type": os.getenv("STT_COMPUTE_TYPE"),
-            "language": os.getenv("STT_LANGUAGE"),
-            "beam_size": os.getenv("STT_BEAM_SIZE"),
-            "vad_filter": os.getenv("STT_VAD_FILTER"),
-            "temperature": os.getenv("STT_TEMPERATURE"),
-        }
-        
         env_value = env_map.get(name)
         if env_value is not None:
             return env_value
@@ -65,8 +84,12 @@ def _load_settings(path: Path) -> STTSettings:
 
     # Преобразуем значения с правильными типами
     model_size = str(_get("model_size", STTSettings.model_size))
+    # Пустая строка отключает повторную транскрибацию более крупной моделью
+    fallback_model_size = str(_get("fallback_model_size", STTSettings.fallback_model_size) or "")
     device = str(_get("device", STTSettings.device))
-    compute_type = str(_get("compute_type", STTSettings.compute_type))
+    # На GPU по умолчанию int8-веса с float16-активациями, на CPU — чистый int8
+    default_compute_type = "int8_float16" if device.startswith("cuda") else STTSettings.compute_type
+    compute_type = str(_get("compute_type", default_compute_type))
     language = str(_get("language", STTSettings.language))
     
     beam_size_val = _get("beam_size", STTSettings.beam_size)
@@ -81,14 +104,43 @@ def _load_settings(path: Path) -> STTSettings:
     temperature_val = _get("temperature", STTSettings.temperature)
     temperature = float(temperature_val) if temperature_val is not None else STTSettings.temperature
 
+    threshold_val = _get("fallback_logprob_threshold", STTSettings.fallback_logprob_threshold)
+    fallback_logprob_threshold = (
+        float(threshold_val) if threshold_val is not None else STTSettings.fallback_logprob_threshold
+    )
+
+    batch_size_val = _get("batch_size", STTSettings.batch_size)
+    batch_size = int(batch_size_val) if batch_size_val is not None else STTSettings.batch_size
+
+    # 0 означает "по числу ядер процессора"
+    cpu_threads_val = _get("cpu_threads", STTSettings.cpu_threads)
+    cpu_threads = int(cpu_threads_val) if cpu_threads_val is not None else STTSettings.cpu_threads
+    if cpu_threads <= 0:
+        cpu_threads = os.cpu_count() or 1
+
+    num_workers_val = _get("num_workers", STTSettings.num_workers)
+    num_workers = int(num_workers_val) if num_workers_val is not None else STTSettings.num_workers
+
+    preload_val = _get("preload", STTSettings.preload)
+    if isinstance(preload_val, bool):
+        preload = preload_val
+    else:
+        preload = str(preload_val).lower() in ("true", "1", "yes") if preload_val is not None else STTSettings.preload
+
     return STTSettings(
         model_size=model_size,
+        fallback_model_size=fallback_model_size,
+        fallback_logprob_threshold=fallback_logprob_threshold,
         device=device,
         compute_type=compute_type,
         language=language,
         beam_size=beam_size,
         vad_filter=vad_filter,
         temperature=temperature,
+        batch_size=batch_size,
+        cpu_threads=cpu_threads,
+        num_workers=num_workers,
+        preload=preload,
     )
 
 